@@ -12,10 +12,15 @@ import numpy as np
 import meshio
 
 from lizzy.IO import geometry as geom
+from lizzy.IO import gmsh
+from lizzy.IO.cache import MeshCache
+from lizzy.IO.stream import StreamWriter
+from lizzy.IO.vtk import write_vtk_series
 
 # class syntax
 class Format(Enum):
-    MSH = auto()
+    MSH = auto()            # gmsh 4.1, ASCII or binary, read by the native reader
+    MSH_LEGACY = auto()     # older gmsh versions, read through meshio
     INP = auto()
     STL = auto()
 
@@ -31,6 +36,10 @@ class Reader:
         The path to the mesh file.
     case_name : str
         The name of the case we are simulating.
+    cache_key : str
+        Key of the mesh in the MeshCache (hash of the mesh file), None if the cache is disabled.
+    cached_arrays : dict
+        Arrays of the mesh loaded from the MeshCache, None if the mesh was read from the file.
 
     """
     def __init__(self, mesh_path:str):
@@ -41,23 +50,67 @@ class Reader:
     
     def __read_mesh_file(self):
         print(f"Reading mesh file: {self.mesh_path}")
+        self.cache_key = None
+        self.cached_arrays = None
+        if MeshCache.enabled and self.mesh_path.is_file():
+            self.cache_key = MeshCache.key("mesh", MeshCache.hash_file(self.mesh_path))
+            cached = MeshCache.load(self.cache_key)
+            if cached is not None:
+                arrays, info = cached
+                self.mesh_data = MeshCache.unpack(arrays, "mesh_data", info["nested"])
+                self.cached_arrays = arrays
+                return
         _format = self.detect_format()
         match _format:
             case Format.MSH:
                 self.mesh_data = self.read_gmsh_file()
+            case Format.MSH_LEGACY:
+                self.mesh_data = self.read_gmsh_file_meshio()
+            case _:
+                raise NotImplementedError(f"Mesh format not supported yet: {_format.name}")
 
     def __read_case_name(self):
         case_name = self.mesh_path.stem
         return case_name
 
     def detect_format(self):
-        """Read the ending of the mesh file path and detect the correct format. 
-        NOT IMPLEMENTED"""
-        return Format.MSH
+        """
+        Detects the format of the mesh file from the extension of its path. For .msh files, the version in the $MeshFormat header selects the native reader (gmsh 4.1) or the meshio reader (older versions).
+        """
+        suffix = self.mesh_path.suffix.lower()
+        if suffix == ".msh":
+            if not self.mesh_path.is_file():
+                raise FileNotFoundError(f"Mesh file not found: {self.mesh_path}")
+            version, _, _ = gmsh.read_mesh_format(self.mesh_path)
+            return Format.MSH if version.startswith("4.1") else Format.MSH_LEGACY
+        for _format in Format:
+            if suffix == f".{_format.name.lower()}":
+                return _format
+        raise ValueError(f"Unknown mesh format: {self.mesh_path}")
 
     def read_gmsh_file(self) -> dict:
         """
-        Reads a mesh file in .msh format (ASCII 4). Initialises all mesh attributes.
+        Reads a mesh file in .msh format (gmsh 4.1, ASCII or binary) with the native gmsh reader. Initialises all mesh attributes.
+        """
+        msh = gmsh.read_msh4(self.mesh_path)
+        physical_domains = {}
+        physical_lines = {}
+        for name, (dim, tag) in msh['physical_names'].items():
+            entities = [entity for entity, physicals in msh['entity_physicals'][dim].items() if tag in physicals]
+            match dim:
+                case 1:
+                    ids = np.nonzero(np.isin(msh['lines_entity'], entities))[0]
+                    if len(ids) > 0:
+                        physical_lines[name] = ids
+                case 2:
+                    ids = np.nonzero(np.isin(msh['triangles_entity'], entities))[0]
+                    if len(ids) > 0:
+                        physical_domains[name] = ids
+        return self.build_mesh_data(msh['nodes'], msh['triangles'], msh['lines'], physical_domains, physical_lines)
+
+    def read_gmsh_file_meshio(self) -> dict:
+        """
+        Reads a mesh file in .msh format (gmsh versions older than 4.1) through meshio. Initialises all mesh attributes.
         """
         try:
             mesh_file = meshio.read(self.mesh_path, file_format="gmsh")
@@ -66,25 +119,35 @@ class Reader:
         all_nodes_coords : np.ndarray = mesh_file.points
         nodes_conn = mesh_file.cells_dict["triangle"]
         # get lines conn
-        physical_lines_conn = mesh_file.cells_dict["line"]
+        physical_lines_conn = mesh_file.cells_dict.get("line", np.empty((0, 2), dtype=int))
         # get inlet and vent lines conn
         physical_domains = {}
         physical_lines = {}
-        physical_nodes_ids = {}
         for key in mesh_file.cell_sets_dict:
             if 'triangle' in mesh_file.cell_sets_dict[key] and 'gmsh' not in key:
                 physical_domains[key] = mesh_file.cell_sets_dict[key]['triangle']
             if 'line' in mesh_file.cell_sets_dict[key] and 'gmsh' not in key:
                 physical_lines[key] = mesh_file.cell_sets_dict[key]['line']
+        return self.build_mesh_data(all_nodes_coords, nodes_conn, physical_lines_conn, physical_domains, physical_lines)
+
+    @staticmethod
+    def build_mesh_data(all_nodes_coords, nodes_conn, physical_lines_conn, physical_domains, physical_lines) -> dict:
+        """
+        Builds the mesh data dict from the nodes, the triangles and the lines of the physical groups read from a mesh file.
+        """
         # get node ids for nodes in the physical lines
+        physical_nodes_ids = {}
         for key in physical_lines:
-            physical_nodes_ids[key] = geom.extract_unique_nodes(mesh_file.cells_dict["line"][physical_lines[key]])
-        lines_conn = geom.extract_lines(nodes_conn)
+            physical_nodes_ids[key] = geom.extract_unique_nodes(physical_lines_conn[physical_lines[key]])
+        lines_conn, lines_triangles, boundary_lines, triangles_lines = geom.extract_lines(nodes_conn)
 
         mesh_data = {
             'all_nodes_coords'      : all_nodes_coords,
             'nodes_conn'            : nodes_conn,
             'lines_conn'            : lines_conn,
+            'lines_triangles'       : lines_triangles,
+            'boundary_lines'        : boundary_lines,
+            'triangles_lines'       : triangles_lines,
             'physical_lines_conn'   : physical_lines_conn,
             'physical_domains'      : physical_domains,
             'physical_lines'        : physical_lines,
@@ -113,6 +176,22 @@ class Writer:
         self.mesh = mesh
 
     def save_results(self, solution, result_name:str, **kwargs):
+        """
+        Saves the results of a solution in ``results/result_name``.
+
+        Parameters
+        ----------
+        solution : dict
+            The solution returned by ``Solver.solve``.
+        result_name : str
+            Name of the results folder and prefix of the files.
+        format : str
+            "xdmf" for an XDMF/HDF5 pair, "vtu" for one binary VTK XML file per time step with a ``.pvd`` time index, or "vtk" for one legacy VTK file per time step (default: "xdmf").
+        workers : int
+            Number of processes writing the "vtu" and "vtk" files in parallel (default: the number of CPUs).
+        save_cv_mesh : bool
+            If True, the mesh of the control volumes is also saved, as ``result_name_CV.vtk`` (default: False).
+        """
         _format = kwargs.get("format", "xdmf")
         save_cv_mesh = kwargs.get("save_cv_mesh", False)
         print("\nSaving results...")
@@ -120,53 +199,43 @@ class Writer:
         if os.path.isdir(destination_path):
             shutil.rmtree(destination_path)
         os.makedirs(destination_path, exist_ok=True)
-        points = self.mesh.nodes.XYZ  # Node coordinates, assumed to be (N, 3)
-        cells = self.mesh.triangles.nodes_conn_table  # Triangle connectivity (M, 3)
-        cells_list = []
-        for i in range(len(cells)) :
-            cells_list.append(cells[i])
-        # Iterate over time steps
-        for i in range(solution["time_steps"]):
-            # Create point data and cell data for the current time step
-            point_data = {
-                "FillFactor": solution["fill_factor"][i],  # Point data
-                "Pressure": solution["p"][i],  # Point data
-                "Time" : solution["time"],
-                "FreeSurface" : solution["free_surface"][i],
-            }
-            cell_data = {
-                "Velocity": [solution["v"][i]],  # Cell data for velocity
-            }
-            if _format == "vtk":# Create the meshio object with correct point and cell data
-                mesh_res = meshio.Mesh(
-                    points=points,
-                    cells=[("triangle", cells_list)],  # Triangle connectivity
-                    point_data=point_data,
-                    cell_data=cell_data,
-                )
-                # write the time step
-                mesh_res.write(destination_path / f"{result_name}_RES_{i}.vtk")
+        if _format in ("vtu", "vtk"):
+            write_vtk_series(self.mesh.nodes.XYZ, self.mesh.triangles.nodes_conn_table, self.iter_steps(solution), destination_path, result_name,
+                             _format, kwargs.get("workers"))
 
         if save_cv_mesh:
+            cv_points, cv_conn = self.mesh.cv_mesh
             mesh_cv = meshio.Mesh(
-                points=self.mesh.cv_mesh_nodes,
-                cells=[("line", self.mesh.cv_mesh_conn)],  # Triangle connectivity
+                points=cv_points,
+                cells=[("line", cv_conn)],  # CV boundary segments
             )
             mesh_cv.write(destination_path / f"{result_name}_CV.vtk")
 
         if _format == "xdmf":
-            filename = f"{result_name}_RES.xdmf"
-            with meshio.xdmf.TimeSeriesWriter(filename) as writer:
-                writer.write_points_cells(points, [("triangle", cells_list)])
-                for j in range(solution["time_steps"]):
-                    time = solution["time"][j]
-                    point_data = {  "Pressure" : np.array(solution["p"][j]),
-                                    "FillFactor" : np.array(solution["fill_factor"][j]),
-                                    "FreeSurface" : np.array(solution["free_surface"][j])
-                                 }
-                    cell_data = { "Velocity" : np.array(solution["v"][j]) }
-                    writer.write_data(time, point_data=point_data, cell_data=cell_data)
-            shutil.move(filename, destination_path / filename)
-            shutil.move(f"{result_name}_RES.h5", destination_path / f"{result_name}_RES.h5")
-
-        print(f"Results saved in {destination_path}")
\ No newline at end of file
+            writer = StreamWriter(self.mesh, result_name, destination_path.parent)
+            writer.open()
+            for j in range(solution["time_steps"]):
+                writer.write_step(solution["time"][j], solution["p"][j], solution["fill_factor"][j], solution["free_surface"][j], solution["v"][j])
+            if "arrival_time" in solution:
+                writer.write_field("ArrivalTime", solution["arrival_time"])
+            writer.close()
+
+        print(f"Results saved in {destination_path}")
+
+    @staticmethod
+    def iter_steps(solution):
+        """
+        Yields the (time, point data, cell data) of each time step of a solution.
+        """
+        for i in range(solution["time_steps"]):
+            point_data = {
+                "FillFactor": solution["fill_factor"][i],
+                "Pressure": solution["p"][i],
+                "FreeSurface": solution["free_surface"][i],
+            }
+            if "arrival_time" in solution:
+                point_data["ArrivalTime"] = solution["arrival_time"]
+            cell_data = {
+                "Velocity": [solution["v"][i]],
+            }
+            yield float(solution["time"][i]), point_data, cell_data
\ No newline at end of file
@@ -0,0 +1,219 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from importlib import metadata
+from pathlib import Path
+import numpy as np
+
+# modules whose code computes the cached arrays, relative to the lizzy package
+SOURCE_FILES = ("IO/IO.py", "IO/gmsh.py", "IO/geometry.py", "cvmesh/cvmesh.py", "cvmesh/constr.py",
+                "cvmesh/collections.py", "cvmesh/entities.py", "materials.py", "solver/fem.py")
+
+
+def _default_directory():
+    if "LIZZY_CACHE_DIR" in os.environ:
+        return Path(os.environ["LIZZY_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "lizzy"
+
+
+def _code_version():
+    """
+    Returns a hash of the package version and of the source of the modules computing the cached arrays.
+    """
+    try:
+        version = metadata.version("lizzy")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    digest = hashlib.sha256(version.encode())
+    root = Path(__file__).resolve().parent.parent
+    for name in SOURCE_FILES:
+        digest.update(name.encode())
+        try:
+            digest.update((root / name).read_bytes())
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+class MeshCache:
+    """
+    Persistent on-disk cache of the pre-processed mesh data: the mesh file contents, the mesh arrays (connectivity, geometry), the material and CV arrays of the pre-processing and the assembled FE operators. Attribute values can be assigned as kwargs of the ``assign`` method.
+
+    Each entry is a directory named after its key, with one ``.npy`` file per array and a ``meta.json`` file recording the format version, the array names and the time of creation. Arrays are loaded memory-mapped (copy-on-write), so a warm start only reads the pages that are used. Entries are keyed by hashes of everything they depend on: the bytes of the mesh file, the materials and rosettes of the mesh tags, the viscosity, and the version of the code (package version and source of the pre-processing modules), so that entries written by another version of lizzy are never reused. Entries of another format version are ignored: ``format_version`` must be incremented whenever the names, contents or layout of the cached arrays change. When an entry is stored, the cache is evicted by age (time since last use) and then by size, least recently used first.
+
+    Attributes
+    ----------
+    enabled: bool
+        If False, the cache is neither read nor written (default: True)
+    directory: Path
+        Location of the cache (default: $LIZZY_CACHE_DIR, or $XDG_CACHE_HOME/lizzy, or ~/.cache/lizzy)
+    max_size: int
+        Maximum total size of the cache in bytes (default: 4 GB)
+    max_age: float
+        Maximum time since the last use of an entry, in seconds (default: 30 days)
+    """
+    def __new__(cls, *args, **kwargs):
+        raise TypeError(f"{cls.__name__} is a singleton and must not be instantiated.")
+    format_version = 1
+    code_version: str = _code_version()
+    enabled: bool = True
+    directory: Path = _default_directory()
+    max_size: int = 4 * 1024**3
+    max_age: float = 30 * 24 * 3600.0
+
+    @classmethod
+    def assign(cls, **kwargs):
+        for key, value in kwargs.items():
+            if hasattr(cls, key):
+                setattr(cls, key, Path(value) if key == "directory" else value)
+            else:
+                raise AttributeError(f"'{cls.__name__}' Error: unknown attribute '{key}'")
+
+    @staticmethod
+    def hash_file(path) -> str:
+        """
+        Returns the SHA-256 hash of the contents of a file.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def key(cls, *parts) -> str:
+        """
+        Returns a key hashing all `parts` (strings, numbers or arrays), the format version and the code version.
+        """
+        digest = hashlib.sha256(f"lizzy-cache-v{cls.format_version}-{cls.code_version}".encode())
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(str((part.dtype, part.shape)).encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @classmethod
+    def load(cls, key:str):
+        """
+        Loads the entry `key`. Returns the dict of its arrays (memory-mapped) and the dict of its info, or None if the cache is disabled or has no valid entry.
+        """
+        if not cls.enabled:
+            return None
+        entry = cls.directory / key
+        try:
+            with open(entry / "meta.json") as f:
+                meta = json.load(f)
+            if meta["version"] != cls.format_version:
+                return None
+            arrays = {name: np.load(entry / f"{i}.npy", mmap_mode="c") for i, name in enumerate(meta["arrays"])}
+            os.utime(entry / "meta.json")
+        except (OSError, ValueError, KeyError):
+            return None
+        return arrays, meta["info"]
+
+    @classmethod
+    def store(cls, key:str, arrays:dict, info:dict = None):
+        """
+        Stores `arrays` (a dict of arrays) and `info` (a dict that can be written as JSON) in the entry `key`. The entry is written to a temporary directory and renamed, so that an entry is either complete or absent. Then evicts old entries.
+        """
+        if not cls.enabled:
+            return
+        try:
+            cls.directory.mkdir(parents=True, exist_ok=True)
+            tmp = Path(cls.directory / f".{key}.{os.getpid()}.tmp")
+            tmp.mkdir(exist_ok=True)
+            names = list(arrays)
+            for i, name in enumerate(names):
+                np.save(tmp / f"{i}.npy", np.asarray(arrays[name]), allow_pickle=False)
+            with open(tmp / "meta.json", "w") as f:
+                json.dump({"version": cls.format_version, "created": time.time(), "arrays": names, "info": info or {}}, f)
+            try:
+                os.replace(tmp, cls.directory / key)
+            except OSError:
+                # the entry was stored in the meantime
+                shutil.rmtree(tmp, ignore_errors=True)
+        except OSError as error:
+            print(f"Warning: could not write the mesh cache in {cls.directory}: {error}")
+            return
+        cls.evict()
+
+    @classmethod
+    def entries(cls):
+        """
+        Returns the (last use time, size in bytes, path) of all entries, least recently used first.
+        """
+        entries = []
+        if not cls.directory.is_dir():
+            return entries
+        for entry in cls.directory.iterdir():
+            meta = entry / "meta.json"
+            if entry.name.startswith(".") or not meta.is_file():
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((meta.stat().st_mtime, size, entry))
+        return sorted(entries)
+
+    @classmethod
+    def evict(cls):
+        """
+        Removes the entries not used for more than `max_age`, then the least recently used entries until the cache size is below `max_size`.
+        """
+        entries = cls.entries()
+        total_size = sum(size for _, size, _ in entries)
+        now = time.time()
+        for last_used, size, entry in entries:
+            if now - last_used <= cls.max_age and total_size <= cls.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+    @classmethod
+    def clear(cls):
+        """
+        Removes all entries.
+        """
+        for _, _, entry in cls.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    @staticmethod
+    def pack(data:dict, prefix:str):
+        """
+        Flattens a dict of arrays and of dicts of arrays (as the mesh data of the Reader) into a dict of arrays, with names "prefix/key" and "prefix/key/subkey". Returns the flat dict and the keys of the nested dicts.
+        """
+        arrays = {}
+        nested = []
+        for key, value in data.items():
+            if isinstance(value, dict):
+                nested.append(key)
+                for subkey, subvalue in value.items():
+                    arrays[f"{prefix}/{key}/{subkey}"] = np.asarray(subvalue)
+            else:
+                arrays[f"{prefix}/{key}"] = np.asarray(value)
+        return arrays, nested
+
+    @staticmethod
+    def unpack(arrays:dict, prefix:str, nested:list):
+        """
+        Inverse of `pack`.
+        """
+        data = {key: {} for key in nested}
+        for name, value in arrays.items():
+            parts = name.split("/", 2)
+            if parts[0] != prefix:
+                continue
+            if parts[1] in data and isinstance(data[parts[1]], dict) and len(parts) == 3:
+                data[parts[1]][parts[2]] = value
+            else:
+                data["/".join(parts[1:])] = value
+        return data
@@ -6,35 +6,39 @@
 
 import numpy as np
 
-# Extract lines: they will be REPEATED
 def extract_lines(nodes_conn):
     """
-    Extract lines connectivity from a nodes connectivity table.
+    Extracts the unique lines (element edges) of a mesh, with their incidence to the elements. Each element contributes the edges between consecutive nodes (1-2, 2-3, ..., n-1), which are sorted by node ids and made unique in one sort, so that a line shared by adjacent elements appears once.
 
     Parameters
     ----------
-    nodes_conn: list
-        The nodes connectivity table of the mesh
+    nodes_conn: ndarray
+        The nodes connectivity table of the mesh, in shape (n_elements, n_nodes_per_element)
 
     Returns
     -------
-    lines_conn : list
-        The lines connectivity table
+    lines_conn : ndarray
+        The lines connectivity table, in shape (n_lines, 2). Lines are canonical: the first node has the lower id
+    lines_elements : ndarray
+        The elements sharing each line, in ascending order, in shape (n_lines, max elements per line). Unused entries are -1
+    boundary_lines : ndarray
+        Boolean mask of the lines that belong to one element only, in shape (n_lines,)
+    elements_lines : ndarray
+        The lines of each element (edges 1-2, 2-3, ..., n-1), in shape (n_elements, n_nodes_per_element)
     """
-    lines_conn = []
-    n_geom = len(nodes_conn[0])
-    for e in nodes_conn:
-        candidate_lines_conns = []
-        for i in range(n_geom-1):
-            candidate_lines_conns.append([e[i], e[i+1]])
-        candidate_lines_conns.append([e[i+1], e[0]])
-        for line_conn in candidate_lines_conns:
-            line_test_1 = [line_conn[0], line_conn[1]]
-            line_test_2 = [line_conn[1], line_conn[0]]
-            # if normals give problems, might be necessary to not get repeated lines
-            if line_test_1 not in lines_conn and line_test_2 not in lines_conn:
-                lines_conn.append(line_conn)
-    return lines_conn
+    conn = np.asarray(nodes_conn, dtype=np.int64)
+    n_elements, n_geom = conn.shape
+    edges = np.sort(np.stack((conn, np.roll(conn, -1, axis=1)), axis=2).reshape(-1, 2), axis=1)
+    n_nodes = conn.max() + 1 if conn.size > 0 else 0
+    keys, edge_to_line, counts = np.unique(edges[:, 0] * n_nodes + edges[:, 1], return_inverse=True, return_counts=True)
+    lines_conn = np.stack((keys // n_nodes, keys % n_nodes), axis=1)
+    # incidence: sort the element edges by line, the position of an edge within its line gives the column
+    order = np.argsort(edge_to_line, kind='stable')
+    starts = np.cumsum(counts) - counts
+    position = np.arange(len(order)) - np.repeat(starts, counts)
+    lines_elements = np.full((len(keys), counts.max(initial=0)), -1, dtype=np.int64)
+    lines_elements[edge_to_line[order], position] = order // n_geom
+    return lines_conn, lines_elements, counts == 1, edge_to_line.reshape(n_elements, n_geom)
 
 
 def extract_unique_nodes(node_ids_list):
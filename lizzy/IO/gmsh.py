@@ -0,0 +1,275 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import mmap
+import struct
+import numpy as np
+
+# number of nodes of the gmsh element types
+NODES_PER_ELEMENT = {1: 2, 2: 3, 3: 4, 4: 4, 5: 8, 6: 6, 7: 5, 8: 3, 9: 6, 10: 9, 11: 10, 12: 27, 13: 18, 14: 14, 15: 1, 16: 8, 17: 20,
+                     18: 15, 19: 13, 20: 9, 21: 10, 22: 12, 23: 15, 24: 15, 25: 21, 26: 4, 27: 5, 28: 6, 29: 20, 30: 35, 31: 56}
+LINE = 1
+TRIANGLE = 2
+# size in bytes of the pieces of text parsed at once in ASCII files
+CHUNK_SIZE = 1 << 24
+
+
+def read_mesh_format(path):
+    """
+    Reads the $MeshFormat header of a gmsh file. Returns the version (str), whether the file is binary, and the size of size_t in bytes.
+    """
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"$MeshFormat":
+            raise ValueError(f"Not a gmsh mesh file: {path}")
+        version, file_type, data_size = f.readline().split()
+    return version.decode(), file_type == b"1", int(data_size)
+
+
+class GmshReader:
+    """
+    Reader of gmsh files in format 4.1, ASCII or binary. The file is memory-mapped and the $Nodes and $Elements sections are read block by block into preallocated arrays: in ASCII files the blocks are parsed in chunks of lines, in binary files they are read in place. Only the first order lines and triangles are kept.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the mesh file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.buf = None
+        self.pos = 0
+        self.binary = False
+        self.int = np.dtype("<i4")
+        self.size_t = np.dtype("<u8")
+        self.double = np.dtype("<f8")
+        self.physical_names = {}
+        self.entity_physicals = ({}, {}, {}, {})
+        self.nodes = None
+        self.node_tags = None
+        self.elements = {}
+
+    def read(self) -> dict:
+        """
+        Reads the file. Returns a dict with the nodes coordinates (N,3), the connectivity of the lines (n,2) and of the triangles (n,3) as 0-based node indices, the entity tag of each line and triangle, the physical names {name: (dim, tag)} and the physical tags of the entities of each dimension.
+        """
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as self.buf:
+            self.pos = 0
+            while True:
+                name = self.next_section()
+                if name is None:
+                    break
+                match name:
+                    case "MeshFormat":
+                        self.read_mesh_format()
+                    case "PhysicalNames":
+                        self.read_physical_names()
+                    case "Entities":
+                        self.read_entities()
+                    case "Nodes":
+                        self.read_nodes()
+                    case "Elements":
+                        self.read_elements()
+                    case _:
+                        # unknown sections are ignored, as prescribed by the format
+                        self.pos = self.buf.find(f"$End{name}".encode(), self.pos)
+                self.end_section(name)
+            self.buf = None
+        if self.nodes is None or TRIANGLE not in self.elements:
+            raise ValueError(f"No nodes or triangles found in mesh file: {self.path}")
+        lines, lines_entity = self.elements.get(LINE, (np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64)))
+        triangles, triangles_entity = self.elements[TRIANGLE]
+        return {
+            'nodes': self.nodes,
+            'lines': self.node_ids(lines),
+            'lines_entity': lines_entity,
+            'triangles': self.node_ids(triangles),
+            'triangles_entity': triangles_entity,
+            'physical_names': self.physical_names,
+            'entity_physicals': self.entity_physicals,
+        }
+
+    def node_ids(self, conn):
+        """
+        Converts node tags to indices in the nodes array. Tags are often 1..N in order, in which case no lookup is needed.
+        """
+        tags = self.node_tags
+        if tags[0] == 1 and tags[-1] == len(tags) and np.all(np.diff(tags) == 1):
+            return conn - 1
+        inv_tags = np.full(tags.max() + 1, -1, dtype=np.int64)
+        inv_tags[tags] = np.arange(len(tags))
+        return inv_tags[conn]
+
+    def next_section(self):
+        start = self.buf.find(b"$", self.pos)
+        if start < 0:
+            return None
+        end = self.buf.find(b"\n", start)
+        self.pos = end + 1
+        return self.buf[start + 1:end].strip().decode()
+
+    def end_section(self, name):
+        end = self.buf.find(f"$End{name}".encode(), self.pos)
+        if end < 0:
+            raise ValueError(f"Section ${name} not closed in mesh file: {self.path}")
+        self.pos = end + len(name) + 4
+
+    def section_text(self, name):
+        """
+        Returns the text of an ASCII section, from the current position to the end of the section.
+        """
+        end = self.buf.find(f"$End{name}".encode(), self.pos)
+        text = self.buf[self.pos:end]
+        self.pos = end
+        return text
+
+    def read_mesh_format(self):
+        version, file_type, data_size = self.buf[self.pos:self.buf.find(b"\n", self.pos)].split()
+        if not version.startswith(b"4.1"):
+            raise ValueError(f"Unsupported gmsh format version {version.decode()} in mesh file: {self.path}")
+        self.pos = self.buf.find(b"\n", self.pos) + 1
+        self.binary = file_type == b"1"
+        self.size_t = np.dtype(f"u{int(data_size)}")
+        if self.binary:
+            # the integer 1 written in binary gives the endianness of the file
+            byteorder = "<" if struct.unpack_from("<i", self.buf, self.pos)[0] == 1 else ">"
+            self.int, self.size_t, self.double = self.int.newbyteorder(byteorder), self.size_t.newbyteorder(byteorder), self.double.newbyteorder(byteorder)
+            self.pos += 4
+
+    def read_physical_names(self):
+        lines = self.section_text("PhysicalNames").decode().splitlines()
+        for line in lines[1:int(lines[0]) + 1]:
+            dim, tag, name = line.split(maxsplit=2)
+            self.physical_names[name.strip().strip('"')] = (int(dim), int(tag))
+
+    def read_entities(self):
+        if self.binary:
+            n_entities = self.take(self.size_t, 4)
+            for dim, n in enumerate(n_entities):
+                for _ in range(int(n)):
+                    tag = int(self.take(self.int, 1)[0])
+                    self.take(self.double, 3 if dim == 0 else 6)
+                    self.entity_physicals[dim][tag] = self.take(self.int, int(self.take(self.size_t, 1)[0])).astype(np.int64)
+                    if dim > 0:
+                        self.take(self.int, int(self.take(self.size_t, 1)[0]))
+        else:
+            values = np.fromstring(self.section_text("Entities"), sep=" ")
+            i = 4
+            for dim, n in enumerate(values[:4].astype(np.int64)):
+                for _ in range(n):
+                    tag = int(values[i])
+                    i += 4 if dim == 0 else 7
+                    n_physicals = int(values[i])
+                    self.entity_physicals[dim][tag] = values[i + 1:i + 1 + n_physicals].astype(np.int64)
+                    i += 1 + n_physicals
+                    if dim > 0:
+                        i += 1 + int(values[i])
+
+    def read_nodes(self):
+        n_blocks, n_nodes = self.read_section_header()[:2]
+        self.nodes = np.empty((n_nodes, 3))
+        self.node_tags = np.empty(n_nodes, dtype=np.int64)
+        start = 0
+        for _ in range(n_blocks):
+            _, _, parametric, n = self.read_block_header()
+            if parametric:
+                raise ValueError(f"Parametric nodes are not supported, in mesh file: {self.path}")
+            if self.binary:
+                self.node_tags[start:start + n] = self.view(self.size_t, n)
+                self.nodes[start:start + n] = self.view(self.double, 3 * n).reshape(n, 3)
+            else:
+                self.read_lines(n, 1, np.int64, self.node_tags[start:start + n, None])
+                self.read_lines(n, 3, np.double, self.nodes[start:start + n])
+            start += n
+
+    def read_elements(self):
+        n_blocks = self.read_section_header()[0]
+        blocks = {LINE: ([], []), TRIANGLE: ([], [])}
+        for _ in range(n_blocks):
+            _, entity, element_type, n = self.read_block_header()
+            if element_type not in NODES_PER_ELEMENT:
+                raise ValueError(f"Unknown gmsh element type {element_type} in mesh file: {self.path}")
+            n_nodes = NODES_PER_ELEMENT[element_type]
+            if element_type not in blocks:
+                # other element types are skipped
+                if self.binary:
+                    self.pos += n * (1 + n_nodes) * self.size_t.itemsize
+                else:
+                    self.read_lines(n, 1 + n_nodes, np.int64, None)
+                continue
+            conn = np.empty((n, n_nodes), dtype=np.int64)
+            if self.binary:
+                conn[:] = self.view(self.size_t, n * (1 + n_nodes)).reshape(n, 1 + n_nodes)[:, 1:]
+            else:
+                self.read_lines(n, 1 + n_nodes, np.int64, conn, slice(1, None))
+            blocks[element_type][0].append(conn)
+            blocks[element_type][1].append(np.full(n, entity, dtype=np.int64))
+        for element_type, (conn, entities) in blocks.items():
+            if conn:
+                # a single block (the usual case for each type) is used as it is, without copy
+                self.elements[element_type] = (conn[0], entities[0]) if len(conn) == 1 else (np.concatenate(conn), np.concatenate(entities))
+
+    def read_section_header(self):
+        """
+        Reads the header of the $Nodes and $Elements sections: 4 size_t.
+        """
+        if self.binary:
+            return [int(v) for v in self.take(self.size_t, 4)]
+        return self.read_header_line()
+
+    def read_block_header(self):
+        """
+        Reads the header of an entity block: 3 int and 1 size_t.
+        """
+        if self.binary:
+            return [int(v) for v in self.take(self.int, 3)] + [int(self.take(self.size_t, 1)[0])]
+        return self.read_header_line()
+
+    def read_header_line(self):
+        end = self.buf.find(b"\n", self.pos)
+        values = [int(v) for v in self.buf[self.pos:end].split()]
+        self.pos = end + 1
+        return values
+
+    def read_lines(self, n_lines, n_columns, dtype, out, columns=slice(None)):
+        """
+        Parses the next `n_lines` lines of an ASCII section, with `n_columns` numbers each, and writes the `columns` to `out`. The text is parsed in chunks of whole lines, so that it is never copied at once. If `out` is None, the lines are skipped.
+        """
+        start = 0
+        while start < n_lines:
+            end = self.buf.rfind(b"\n", self.pos, self.pos + CHUNK_SIZE) + 1
+            if end <= self.pos:
+                end = self.buf.find(b"\n", self.pos) + 1
+            chunk = self.buf[self.pos:end]
+            newlines = np.flatnonzero(np.frombuffer(chunk, np.uint8) == ord("\n"))
+            n = min(len(newlines), n_lines - start)
+            if n == 0:
+                raise ValueError(f"Unexpected end of file in mesh file: {self.path}")
+            chunk = chunk[:newlines[n - 1] + 1]
+            if out is not None:
+                out[start:start + n] = np.fromstring(chunk, sep=" ", dtype=dtype).reshape(n, n_columns)[:, columns]
+            self.pos += len(chunk)
+            start += n
+
+    def view(self, dtype, count):
+        """
+        Returns the `count` values of type `dtype` at the current position of a binary section, as a view of the file. Views must be released before the file is closed.
+        """
+        values = np.frombuffer(self.buf, dtype, count, self.pos)
+        self.pos += count * dtype.itemsize
+        return values
+
+    def take(self, dtype, count):
+        """
+        Reads `count` values of type `dtype` at the current position of a binary section, as a copy.
+        """
+        return self.view(dtype, count).copy()
+
+
+def read_msh4(path) -> dict:
+    """
+    Reads a gmsh 4.1 mesh file (ASCII or binary). See `GmshReader.read`.
+    """
+    return GmshReader(path).read()
@@ -0,0 +1,163 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import numpy as np
+import h5py
+
+from lizzy.IO.stream import FIELDS
+
+# names of the datasets of the fields in the results file, by key of the solution
+DATASETS = {"p": "Pressure", "fill_factor": "FillFactor", "free_surface": "FreeSurface", "v": "Velocity"}
+STATIC_DATASETS = {"arrival_time": "ArrivalTime"}
+CENTERS = {name: center for name, center, _ in FIELDS}
+
+
+class ResultsReader:
+    """
+    Reader of the results saved in HDF5 format, by ``Writer.save_results`` (format "xdmf") or by a ``StreamWriter``. Opening the results only reads the times of the steps: the fields are read when they are accessed. Uncompressed datasets are memory-mapped (each time step is a contiguous row of the file), so accessing a step or a subset of nodes only loads the pages that are used.
+
+    The fields are returned with the keys of the solution of ``Solver.solve``: "p", "fill_factor", "free_surface" (nodal fields), "v" (element velocities) and, if saved, "arrival_time". The reader can be used as a context manager, and indexed or iterated over like a list of steps.
+
+    Parameters
+    ----------
+    path : str
+        The HDF5 file, the XDMF file, or the results folder ``results/result_name``.
+
+    Attributes
+    ----------
+    time : ndarray
+        Time of each step, dimension (n_steps,).
+    n_steps : int
+        Number of time steps.
+    points : ndarray
+        Node coordinates, dimension (N,3).
+    cells : ndarray
+        Triangle connectivity, dimension (M,3).
+    fields : tuple
+        Keys of the time-dependent fields in the file.
+    """
+    def __init__(self, path):
+        self.h5_path = self.find_results_file(Path(path))
+        self.h5 = h5py.File(self.h5_path, "r")
+        self.time = self.h5["time"][()]
+        self.n_steps = len(self.time)
+        self.points = self.map("mesh/points")
+        self.cells = self.map("mesh/cells")
+        self.fields = tuple(key for key, name in DATASETS.items() if name in self.h5)
+
+    @staticmethod
+    def find_results_file(path):
+        if path.is_dir():
+            path = path / f"{path.name}_RES.h5"
+        elif path.suffix == ".xdmf":
+            path = path.with_suffix(".h5")
+        if not path.is_file():
+            raise FileNotFoundError(f"Results file not found: {path}")
+        return path
+
+    def map(self, name:str, k:int = None):
+        """
+        Returns the dataset `name`, or its row `k`, as a read-only memory-mapped array. Compressed datasets are read from the file instead.
+        """
+        dataset = self.h5[name]
+        shape = dataset.shape if k is None else dataset.shape[1:]
+        offset = None
+        if dataset.compression is None and np.prod(shape) > 0:
+            if dataset.chunks is None:
+                offset = dataset.id.get_offset()
+                if offset is not None and k is not None:
+                    offset += k * int(np.prod(shape)) * dataset.dtype.itemsize
+            elif k is not None and dataset.chunks == (1, *shape):
+                info = dataset.id.get_chunk_info_by_coord((k,) + (0,) * len(shape))
+                if info.filter_mask == 0:
+                    offset = info.byte_offset
+        if offset is None:
+            return dataset[()] if k is None else dataset[k]
+        return np.memmap(self.h5_path, dtype=dataset.dtype, mode="r", offset=offset, shape=shape)
+
+    def step(self, k:int, nodes=None, elements=None) -> dict:
+        """
+        Returns the time and the fields of the k-th step.
+
+        Parameters
+        ----------
+        k : int
+            Index of the step, negative indices count from the last step.
+        nodes : array_like
+            Indices of the nodes of the nodal fields, or None for all nodes.
+        elements : array_like
+            Indices of the elements of the velocity, or None for all elements.
+        """
+        if k < 0:
+            k += self.n_steps
+        if not 0 <= k < self.n_steps:
+            raise IndexError(f"step {k} out of range for {self.n_steps} steps")
+        step = {"time": self.time[k]}
+        for key in self.fields:
+            step[key] = self.select(self.map(DATASETS[key], k), CENTERS[DATASETS[key]], nodes, elements)
+        return step
+
+    def steps(self, t_start:float = None, t_end:float = None):
+        """
+        Returns the indices of the steps with time in [t_start, t_end]. A bound set to None is open.
+        """
+        selected = np.ones(self.n_steps, dtype=bool)
+        if t_start is not None:
+            selected &= self.time >= t_start
+        if t_end is not None:
+            selected &= self.time <= t_end
+        return np.flatnonzero(selected)
+
+    def field(self, key:str, t_start:float = None, t_end:float = None, nodes=None, elements=None):
+        """
+        Returns a field at all steps with time in [t_start, t_end], with one row per step, for the given nodes (nodal fields) or elements (velocity). For "arrival_time", which does not depend on time, returns the field at the nodes.
+        """
+        if key in STATIC_DATASETS:
+            return self.select(self.map(STATIC_DATASETS[key]), "Node", nodes, elements)
+        if key not in self.fields:
+            raise KeyError(f"Field '{key}' not found in results file: {self.h5_path}")
+        name = DATASETS[key]
+        rows = [self.select(self.map(name, k), CENTERS[name], nodes, elements) for k in self.steps(t_start, t_end)]
+        if rows:
+            return np.stack(rows)
+        n = self.h5[name].shape[1:]
+        return np.empty((0, *self.select(np.empty(n), CENTERS[name], nodes, elements).shape))
+
+    @staticmethod
+    def select(values, center, nodes, elements):
+        ids = nodes if center == "Node" else elements
+        return values if ids is None else values[np.asarray(ids)]
+
+    def as_solution(self) -> dict:
+        """
+        Returns the results as a solution dict of ``Solver.solve``, whose fields are the datasets of the file: the steps are read when they are indexed. The solution can be passed to ``Writer.save_results``, for example to export the results in another format. It is valid while the reader is open.
+        """
+        solution = {"time_steps": self.n_steps, "time": self.time}
+        solution.update({key: self.h5[DATASETS[key]] for key in self.fields})
+        for key, name in STATIC_DATASETS.items():
+            if name in self.h5:
+                solution[key] = self.h5[name][()]
+        return solution
+
+    def close(self):
+        self.h5.close()
+
+    def __len__(self):
+        return self.n_steps
+
+    def __getitem__(self, k):
+        return self.step(k)
+
+    def __iter__(self):
+        for k in range(self.n_steps):
+            yield self.step(k)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,231 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import queue
+import threading
+from pathlib import Path
+import numpy as np
+import torch
+import h5py
+
+# fields of the results: name, centering in the mesh, number of components
+FIELDS = (("Pressure", "Node", 1), ("FillFactor", "Node", 1), ("FreeSurface", "Node", 1), ("Velocity", "Cell", 3))
+
+
+def copy_field(values):
+    """
+    Returns a float64 copy of a field given as array, list or torch tensor.
+    """
+    if isinstance(values, torch.Tensor):
+        values = values.detach().cpu().numpy()
+    return np.array(values, dtype=float)
+
+
+class StreamWriter:
+    """
+    Writes the results of a simulation to an XDMF/HDF5 pair while the solver runs. The geometry is written once when the writer is opened, then each time step is appended to chunked datasets of the HDF5 file (one row per time step) by a background thread, so that writing overlaps with the solution and the results are not kept in memory. The HDF5 file is flushed and the XDMF file describing the steps written so far is rewritten at most every `xdmf_interval` seconds, so the results can be opened while the simulation runs, and once more when the writer is closed.
+
+    A writer is attached to a solver with ``Solver.attach_writer``: the solver then opens it, writes all write-out steps and closes it in ``Solver.solve``.
+
+    Parameters
+    ----------
+    mesh : lizzy.Mesh
+        The Mesh object of the simulation.
+    result_name : str
+        Name of the results: the files are written in ``directory/result_name``, as ``result_name_RES.xdmf`` and ``result_name_RES.h5``.
+    directory : str
+        Directory of the results (default: "results").
+    max_pending : int
+        Maximum number of time steps waiting to be written. When reached, the solver waits for the writer.
+    compression : str
+        Compression filter of the HDF5 datasets, e.g. "gzip" (default: None).
+    xdmf_interval : float
+        Minimum time in seconds between two updates of the XDMF file while the solver runs. With 0, the XDMF file is rewritten after each time step (default: 10).
+    """
+    def __init__(self, mesh, result_name:str, directory="results", max_pending:int = 4, compression:str = None, xdmf_interval:float = 10.0):
+        self.mesh = mesh
+        self.result_name = result_name
+        self.destination_path = Path(directory) / result_name
+        self.h5_path = self.destination_path / f"{result_name}_RES.h5"
+        self.xdmf_path = self.destination_path / f"{result_name}_RES.xdmf"
+        self.max_pending = max_pending
+        self.compression = compression
+        self.xdmf_interval = xdmf_interval
+        self.times = []
+        self.static_fields = []
+        self.h5 = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    @property
+    def is_open(self):
+        return self.h5 is not None
+
+    def open(self):
+        """
+        Creates the HDF5 file, writes the geometry and starts the writing thread. An existing file of the same results is overwritten.
+        """
+        if self.is_open:
+            self.close()
+        os.makedirs(self.destination_path, exist_ok=True)
+        self.times = []
+        self.static_fields = []
+        self._error = None
+        self.h5 = h5py.File(self.h5_path, "w")
+        self.h5.create_dataset("mesh/points", data=self.mesh.nodes.XYZ)
+        self.h5.create_dataset("mesh/cells", data=np.asarray(self.mesh.triangles.nodes_conn_table, dtype=np.int64))
+        self.h5.create_dataset("time", shape=(0,), maxshape=(None,), dtype=float, chunks=(1024,))
+        for name, center, n_components in FIELDS:
+            n = self.mesh.nodes.N if center == "Node" else self.mesh.triangles.N
+            shape = (n,) if n_components == 1 else (n, n_components)
+            self.h5.create_dataset(name, shape=(0, *shape), maxshape=(None, *shape), dtype=float, chunks=(1, *shape), compression=self.compression)
+        self.h5.flush()
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._thread = threading.Thread(target=self._write_loop, name="lizzy-stream-writer", daemon=True)
+        self._thread.start()
+
+    def write_step(self, time:float, p, fill_factor, free_surface, v):
+        """
+        Queues a time step for writing. The fields are copied, so they can be modified as soon as this method returns.
+
+        Parameters
+        ----------
+        time : float
+            Time of the step.
+        p, fill_factor, free_surface : array_like
+            Nodal fields, dimension (N,).
+        v : array_like
+            Element velocities, dimension (M,3) or (M,2).
+        """
+        self._raise_error()
+        v = copy_field(v)
+        if v.shape[1] == 2:
+            v = np.hstack((v, np.zeros((len(v), 1))))
+        fields = (copy_field(p), np.clip(copy_field(fill_factor), 0, 1), copy_field(free_surface), v)
+        self._queue.put((self._write_step, (float(time), fields)))
+
+    def write_field(self, name:str, values, center:str = "Node"):
+        """
+        Queues a field that does not change in time (e.g. the arrival time of the flow front) for writing. It is written once in the HDF5 file and shown in all time steps.
+
+        Parameters
+        ----------
+        name : str
+            Name of the field.
+        values : array_like
+            Values of the field, dimension (N,) for "Node" fields or (M,) for "Cell" fields.
+        center : str
+            Centering of the field in the mesh, "Node" or "Cell" (default: "Node").
+        """
+        self._raise_error()
+        self._queue.put((self._write_field, (name, copy_field(values), center)))
+
+    def close(self):
+        """
+        Waits until all queued time steps are written, writes the XDMF file, then closes the HDF5 file.
+        """
+        if not self.is_open:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self.h5.close()
+        self.h5 = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Writing results to {self.h5_path} failed") from error
+
+    def _write_loop(self):
+        last_update = time.monotonic()
+        while True:
+            item = self._queue.get()
+            if self._error is not None:
+                if item is None:
+                    return
+                # after an error, the remaining steps are discarded so that the solver is not blocked
+                continue
+            try:
+                if item is None:
+                    self.h5.flush()
+                    self._write_xdmf()
+                    return
+                method, args = item
+                method(*args)
+                if time.monotonic() - last_update >= self.xdmf_interval:
+                    # the XDMF file only references data flushed to the HDF5 file
+                    self.h5.flush()
+                    self._write_xdmf()
+                    last_update = time.monotonic()
+            except Exception as error:
+                self._error = error
+
+    def _write_step(self, time, fields):
+        k = len(self.times)
+        self.h5["time"].resize((k + 1,))
+        self.h5["time"][k] = time
+        for (name, _, _), values in zip(FIELDS, fields):
+            dataset = self.h5[name]
+            dataset.resize(k + 1, axis=0)
+            dataset[k] = values
+        self.times.append(time)
+
+    def _write_field(self, name, values, center):
+        if name in self.h5:
+            del self.h5[name]
+        self.h5.create_dataset(name, data=values)
+        self.static_fields = [field for field in self.static_fields if field[0] != name] + [(name, center)]
+
+    def _write_xdmf(self):
+        """
+        Writes the XDMF file describing all time steps written so far. Each step references one row of the datasets through a hyperslab.
+        """
+        h5_name = self.h5_path.name
+        n_nodes, n_elements = self.mesh.nodes.N, self.mesh.triangles.N
+        n_steps = len(self.times)
+        lines = ['<?xml version="1.0"?>',
+                 '<Xdmf Version="3.0">',
+                 '  <Domain>',
+                 '    <Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">']
+        for k, time in enumerate(self.times):
+            lines += [f'      <Grid Name="step_{k}" GridType="Uniform">',
+                      f'        <Time Value="{time!r}"/>',
+                      f'        <Topology TopologyType="Triangle" NumberOfElements="{n_elements}">',
+                      f'          <DataItem Dimensions="{n_elements} 3" NumberType="Int" Precision="8" Format="HDF">{h5_name}:/mesh/cells</DataItem>',
+                      '        </Topology>',
+                      '        <Geometry GeometryType="XYZ">',
+                      f'          <DataItem Dimensions="{n_nodes} 3" NumberType="Float" Precision="8" Format="HDF">{h5_name}:/mesh/points</DataItem>',
+                      '        </Geometry>']
+            for name, center, n_components in FIELDS:
+                n = n_nodes if center == "Node" else n_elements
+                if n_components == 1:
+                    attribute_type, dims, start, count = "Scalar", f"{n}", f"{k} 0", f"1 {n}"
+                    stride, full_dims = "1 1", f"{n_steps} {n}"
+                else:
+                    attribute_type, dims, start, count = "Vector", f"{n} {n_components}", f"{k} 0 0", f"1 {n} {n_components}"
+                    stride, full_dims = "1 1 1", f"{n_steps} {n} {n_components}"
+                n_dims = len(full_dims.split())
+                lines += [f'        <Attribute Name="{name}" AttributeType="{attribute_type}" Center="{center}">',
+                          f'          <DataItem ItemType="HyperSlab" Dimensions="{dims}" Type="HyperSlab">',
+                          f'            <DataItem Dimensions="3 {n_dims}" Format="XML">{start} {stride} {count}</DataItem>',
+                          f'            <DataItem Dimensions="{full_dims}" NumberType="Float" Precision="8" Format="HDF">{h5_name}:/{name}</DataItem>',
+                          '          </DataItem>',
+                          '        </Attribute>']
+            for name, center in self.static_fields:
+                n = n_nodes if center == "Node" else n_elements
+                lines += [f'        <Attribute Name="{name}" AttributeType="Scalar" Center="{center}">',
+                          f'          <DataItem Dimensions="{n}" NumberType="Float" Precision="8" Format="HDF">{h5_name}:/{name}</DataItem>',
+                          '        </Attribute>']
+            lines.append('      </Grid>')
+        lines += ['    </Grid>', '  </Domain>', '</Xdmf>', '']
+        tmp_path = self.xdmf_path.with_suffix(".xdmf.tmp")
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines))
+        os.replace(tmp_path, self.xdmf_path)
@@ -0,0 +1,110 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import meshio
+
+# geometry of the worker processes, shared read-only through memory-mapped files
+_points = None
+_cells = None
+
+
+def _set_mesh(points, cells):
+    global _points, _cells
+    _points, _cells = points, cells
+
+
+def _init_worker(mesh_directory):
+    _set_mesh(np.load(f"{mesh_directory}/points.npy", mmap_mode="r"), np.load(f"{mesh_directory}/cells.npy", mmap_mode="r"))
+
+
+def _write_step(path, time, point_data, cell_data):
+    mesh = meshio.Mesh(points=_points, cells=[("triangle", _cells)], point_data=point_data, cell_data=cell_data,
+                       field_data={"TimeValue": np.array([time])})
+    if path.suffix == ".vtu":
+        meshio.vtu.write(path, mesh, binary=True, compression=None)
+    else:
+        mesh.write(path)
+    return path
+
+
+def write_pvd(path, times, files):
+    """
+    Writes a ParaView collection file (.pvd) indexing the files of a time series. The file names are written relative to the collection file.
+    """
+    lines = ['<?xml version="1.0"?>',
+             '<VTKFile type="Collection" version="0.1" byte_order="LittleEndian">',
+             '  <Collection>']
+    for time, file in zip(times, files):
+        lines.append(f'    <DataSet timestep="{float(time)!r}" group="" part="0" file="{Path(file).name}"/>')
+    lines += ['  </Collection>', '</VTKFile>', '']
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def write_vtk_series(points, cells, steps, destination_path, result_name:str, file_format:str = "vtu", workers:int = None):
+    """
+    Writes a time series of results as one VTK file per time step, with a pool of worker processes. The points and connectivity are written once to memory-mapped files that all workers read, so only the fields of each step are sent to the workers. At most two steps per worker are pending, so the steps can be generated lazily.
+
+    Parameters
+    ----------
+    points : ndarray
+        Node coordinates, dimension (N,3).
+    cells : ndarray
+        Triangle connectivity, dimension (M,3).
+    steps : iterable
+        Time steps as (time, point_data, cell_data) tuples, with the dicts of fields of meshio.
+    destination_path : Path
+        Directory of the files.
+    result_name : str
+        The files are named ``result_name_RES_{i}.vtu`` (or ``.vtk``).
+    file_format : str
+        "vtu" for binary VTK XML files indexed by a ``result_name_RES.pvd`` collection, or "vtk" for legacy VTK files (default: "vtu").
+    workers : int
+        Number of worker processes. With 1, the files are written in the calling process (default: the number of CPUs).
+
+    Returns
+    -------
+    files : list
+        The paths of the written files.
+    """
+    if file_format not in ("vtu", "vtk"):
+        raise ValueError(f"Unknown VTK file format: {file_format}")
+    workers = workers or os.cpu_count() or 1
+    destination_path = Path(destination_path)
+    times, files = [], []
+    if workers == 1:
+        _set_mesh(np.asarray(points), np.asarray(cells))
+        try:
+            for i, (time, point_data, cell_data) in enumerate(steps):
+                files.append(_write_step(destination_path / f"{result_name}_RES_{i}.{file_format}", time, point_data, cell_data))
+                times.append(time)
+        finally:
+            _set_mesh(None, None)
+    else:
+        mesh_directory = tempfile.mkdtemp(prefix="lizzy-vtk-")
+        try:
+            np.save(f"{mesh_directory}/points.npy", np.asarray(points))
+            np.save(f"{mesh_directory}/cells.npy", np.asarray(cells))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mesh_directory,)) as pool:
+                pending = deque()
+                for i, (time, point_data, cell_data) in enumerate(steps):
+                    if len(pending) >= 2 * workers:
+                        files.append(pending.popleft().result())
+                    pending.append(pool.submit(_write_step, destination_path / f"{result_name}_RES_{i}.{file_format}", time, point_data, cell_data))
+                    times.append(time)
+                files += [future.result() for future in pending]
+        finally:
+            shutil.rmtree(mesh_directory, ignore_errors=True)
+    if file_format == "vtu":
+        write_pvd(destination_path / f"{result_name}_RES.pvd", times, files)
+    return files
@@ -5,6 +5,9 @@
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from lizzy.IO.IO import *
+from lizzy.IO.cache import MeshCache
+from lizzy.IO.stream import StreamWriter
+from lizzy.IO.results import ResultsReader
 from lizzy.cvmesh.cvmesh import *
 from lizzy.solver.solver import *
 from lizzy.solver.psolvers import SolverType
@@ -5,13 +5,108 @@
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
+from abc import ABCMeta, abstractmethod
+from collections.abc import Sequence
+from . import entities as ent
 
 # Extends List to create a few special lists containing additional attributes: nodes, lines, elements
 
-class nodes(list):
+class lazy_list(list, metaclass=ABCMeta):
+    """
+    List whose items are created on first access. The list is reserved with one empty slot per item, and the item i is created by `factory(i)` the first time it is accessed, then kept. Iterating over the list creates all items.
+    The subclasses implement `create` and create their items from array attributes, listed in `arrays`: the list is fully defined by these arrays and can be rebuilt from them.
+
+    Attributes
+    ----------
+    factory : callable
+        Creates the item of a given index.
+    """
+    arrays = ()
+
+    def __init__(self, *args, **kwargs):
+        if self.__abstractmethods__:
+            # list.__new__ does not check the abstract methods as object.__new__ does
+            raise TypeError(f"Can't instantiate abstract class {type(self).__name__} without an implementation of: {', '.join(sorted(self.__abstractmethods__))}")
+        super().__init__(args[0])
+        self.factory = None
+
+    def reserve(self, N:int, factory=None):
+        """
+        Reserves N items, created by `factory` on access (default: the `create` method).
+        """
+        super().__init__([None] * N)
+        self.factory = factory if factory is not None else self.create
+
+    @abstractmethod
+    def create(self, i:int):
+        """
+        Creates the item of index i.
+        """
+
+    def to_arrays(self):
+        """
+        Returns the arrays that define the list, as a dict.
+        """
+        return {name: getattr(self, name) for name in self.arrays if getattr(self, name) is not None}
+
+    def from_arrays(self, arrays:dict):
+        """
+        Sets the arrays that define the list, as returned by `to_arrays`, and the number of items.
+        """
+        for name in self.arrays:
+            if name in arrays:
+                setattr(self, name, arrays[name])
+        self.N = len(getattr(self, self.arrays[0]))
+
+    @property
+    def n_created(self):
+        """
+        Number of items created so far.
+        """
+        return sum(item is not None for item in super().__iter__())
+
+    def created(self):
+        """
+        Iterates over the items created so far, without creating the others.
+        """
+        return (item for item in super().__iter__() if item is not None)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        item = super().__getitem__(i)
+        if item is None:
+            i = int(i) % len(self)
+            item = self.factory(i)
+            super().__setitem__(i, item)
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class lazy_view(Sequence):
+    """
+    Read-only view on the items `ids` of a lazy list. Used for the references between entities, so that creating an entity does not create the entities it refers to.
+    """
+    def __init__(self, items:lazy_list, ids):
+        self.items = items
+        self.ids = ids
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.items[j] for j in self.ids[i]]
+        return self.items[self.ids[i]]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class nodes(lazy_list):
     """
     List of all Nodes in the mesh. Extends List class with additional attributes.
-    Created when initialising Mesh.
+    Created when initialising Mesh. The Node objects are created on first access.
 
     Attributes
     ----------
@@ -19,16 +114,46 @@ class nodes(list):
         Array of all node coordinates, in shape (n_nodes, 3)
     N : int
         Number of nodes in the mesh
+    adjacency_indptr : ndarray
+        CSR row pointers of the node adjacency, in shape (n_nodes+1,)
+    adjacency_indices : ndarray
+        CSR neighbour ids of the node adjacency. The neighbours of node i are adjacency_indices[adjacency_indptr[i]:adjacency_indptr[i+1]]
+    triangles_indptr : ndarray
+        CSR row pointers of the triangles containing each node, in shape (n_nodes+1,)
+    triangles_indices : ndarray
+        CSR ids of the triangles containing each node, in ascending order.
+    triangles : elements
+        The elements list of the mesh, referenced by the Node objects
     """
     def __init__(self, *args, **kwargs):
+        if self.__abstractmethods__:
+            # list.__new__ does not check the abstract methods as object.__new__ does
+            raise TypeError(f"Can't instantiate abstract class {type(self).__name__} without an implementation of: {', '.join(sorted(self.__abstractmethods__))}")
         super().__init__(args[0])
         self.XYZ : np.ndarray = None
         self.N : int = 0
+        self.adjacency_indptr : np.ndarray = None
+        self.adjacency_indices : np.ndarray = None
+        self.triangles_indptr : np.ndarray = None
+        self.triangles_indices : np.ndarray = None
+        self.triangles : elements = None
+
+    arrays = ("XYZ", "adjacency_indptr", "adjacency_indices", "triangles_indptr", "triangles_indices")
+
+    def create(self, i):
+        node = ent.Node(self.XYZ[i])
+        node.id = i
+        if self.triangles_indptr is not None:
+            node.triangle_ids = self.triangles_indices[self.triangles_indptr[i]:self.triangles_indptr[i + 1]].tolist()
+            node.triangles = lazy_view(self.triangles, node.triangle_ids)
+        if self.adjacency_indptr is not None:
+            node.node_ids = self.adjacency_indices[self.adjacency_indptr[i]:self.adjacency_indptr[i + 1]].tolist()
+        return node
 
-class elements(list):
+class elements(lazy_list):
     """
     List of all Elements in the mesh. Extends List class with additional attributes.
-    Created when initialising Mesh.
+    Created when initialising Mesh. The element geometry is stored in arrays indexed by element id, and the element objects are created on first access.
 
     Attributes
     ----------
@@ -36,27 +161,226 @@ class elements(list):
         Number of elements in the mesh
     nodes_conn_table : ndarray
         Nodal connectivity table of elements
+    grad_N : ndarray
+        Gradients of the shape functions, in shape (n_elements, 3, 3): element, coordinate, node
+    A : ndarray
+        Element areas, in shape (n_elements,)
+    n : ndarray
+        Element unit normals, in shape (n_elements, 3)
+    centroid : ndarray
+        Element centroids, in shape (n_elements, 3)
+    material_tags : ndarray
+        Material tag of each element, in shape (n_elements,)
+    lines_table : ndarray
+        Ids of the lines of each element (edges 1-2, 2-3, 3-1), in shape (n_elements, 3)
+    k : ndarray
+        Permeability tensor of each element, in shape (n_elements, 3, 3). Assigned when pre-processing Mesh
+    porosity : ndarray
+        Porosity of each element, in shape (n_elements,). Assigned when pre-processing Mesh
+    h : ndarray
+        Thickness of each element, in shape (n_elements,). Assigned when pre-processing Mesh
+    nodes : nodes
+        The nodes list of the mesh, referenced by the element objects
+    lines : lines
+        The lines list of the mesh, referenced by the element objects
     """
     def __init__(self, *args, **kwargs):
+        if self.__abstractmethods__:
+            # list.__new__ does not check the abstract methods as object.__new__ does
+            raise TypeError(f"Can't instantiate abstract class {type(self).__name__} without an implementation of: {', '.join(sorted(self.__abstractmethods__))}")
         super().__init__(args[0])
         self.N : int = 0
         self.nodes_conn_table : np.ndarray = None
+        self.grad_N : np.ndarray = None
+        self.A : np.ndarray = None
+        self.n : np.ndarray = None
+        self.centroid : np.ndarray = None
+        self.material_tags : np.ndarray = None
+        self.lines_table : np.ndarray = None
+        self.k : np.ndarray = None
+        self.porosity : np.ndarray = None
+        self.h : np.ndarray = None
+        self.nodes : "nodes" = None
+        self.lines : "lines" = None
+
+    arrays = ("nodes_conn_table", "grad_N", "A", "n", "centroid", "material_tags", "lines_table", "k", "porosity", "h")
+
+    def create(self, i):
+        node_ids = self.nodes_conn_table[i].tolist()
+        tri = ent.Triangle.from_arrays(tuple(self.nodes[j] for j in node_ids), self.grad_N[i], self.A[i], self.n[i], self.centroid[i])
+        tri.id = i
+        tri.node_ids = node_ids
+        tri.material_tag = self.material_tags[i]
+        tri.line_ids = self.lines_table[i].tolist()
+        tri.lines = lazy_view(self.lines, tri.line_ids)
+        self.assign_properties(tri)
+        return tri
+
+    def assign_properties(self, element):
+        """
+        Sets the material properties of an element object from the arrays, once they are assigned. The permeability tensor of the element is a view on the array.
+        """
+        if self.k is not None:
+            element.k = self.k[element.id]
+            element.porosity = self.porosity[element.id]
+            element.h = self.h[element.id]
 
-class lines(list):
+class lines(lazy_list):
     """
-    List of all Lines in the mesh. Extends List class with additional attributes.
-    Created when initialising Mesh.
+    List of all Lines in the mesh, one per unique element edge. Extends List class with additional attributes.
+    Created when initialising Mesh. The line geometry is stored in arrays indexed by line id, and the line objects are created on first access.
 
     Attributes
     ----------
     N : int
         Number of lines in the mesh
     nodes_conn_table : ndarray
-        Nodal connectivity table of lines
+        Nodal connectivity table of lines, in shape (n_lines, 2). The first node has the lower id
+    triangles_table : ndarray
+        Ids of the elements sharing each line, in shape (n_lines, max elements per line). Unused entries are -1
+    boundary : ndarray
+        Boolean mask of the lines on the mesh boundary (belonging to one element only), in shape (n_lines,)
+    midpoint : ndarray
+        Line midpoints, in shape (n_lines, 3)
+    n : ndarray
+        Line in-plane unit normals, in shape (n_lines, 3)
+    nodes : nodes
+        The nodes list of the mesh, referenced by the line objects
+    triangles : elements
+        The elements list of the mesh, referenced by the line objects
     """
     def __init__(self, *args, **kwargs):
+        if self.__abstractmethods__:
+            # list.__new__ does not check the abstract methods as object.__new__ does
+            raise TypeError(f"Can't instantiate abstract class {type(self).__name__} without an implementation of: {', '.join(sorted(self.__abstractmethods__))}")
         super().__init__(args[0])
         self.N : int = 0
         self.nodes_conn_table : np.ndarray = None
+        self.triangles_table : np.ndarray = None
+        self.boundary : np.ndarray = None
+        self.midpoint : np.ndarray = None
+        self.n : np.ndarray = None
         self.T_nodes_inlet : np.ndarray = None
-        self.T_nodes_vent : np.ndarray = None
\ No newline at end of file
+        self.T_nodes_vent : np.ndarray = None
+        self.nodes : nodes = None
+        self.triangles : elements = None
+
+    arrays = ("nodes_conn_table", "triangles_table", "boundary", "midpoint", "n")
+
+    def create(self, i):
+        n_1, n_2 = self.nodes_conn_table[i]
+        line = ent.Line.from_arrays((self.nodes[n_1], self.nodes[n_2]), self.midpoint[i], self.n[i])
+        line.id = i
+        triangle_ids = self.triangles_table[i]
+        line.triangle_ids = triangle_ids[triangle_ids >= 0].tolist()
+        line.triangles = lazy_view(self.triangles, line.triangle_ids)
+        return line
+
+class cvs(lazy_list):
+    """
+    List of all CVs in the mesh. Extends List class with additional attributes.
+    The state of the CVs is stored in contiguous arrays indexed by CV id, and the CV objects in the list are views on these arrays, created on first access.
+    The geometry of the median-dual CVs is stored in flat arrays over the (CV, support triangle) pairs, grouped by CV in the order of the support triangles: the pairs of CV i are pairs_indptr[i]:pairs_indptr[i+1]. In each pair, the CV boundary is made of two CV lines, from the midpoint of the first triangle edge containing the node to the triangle centroid, and from the centroid to the midpoint of the second edge.
+    Created when pre-processing Mesh.
+
+    Attributes
+    ----------
+    N : int
+        Number of CVs in the mesh
+    fill : ndarray
+        Fill factor of each CV, in shape (n_cvs,)
+    free_surface : ndarray
+        Flag (0/1) of CVs on the flow front, in shape (n_cvs,)
+    arrival_time : ndarray
+        Time at which each CV was filled, inf for CVs not filled yet, in shape (n_cvs,)
+    vol : ndarray
+        Pore volume of each CV, in shape (n_cvs,)
+    A : ndarray
+        Area of each CV, in shape (n_cvs,)
+    support_indptr : ndarray
+        CSR row pointers of the support CVs of each CV, in shape (n_cvs+1,)
+    support_indices : ndarray
+        CSR ids of the support CVs of each CV.
+    pairs_indptr : ndarray
+        CSR row pointers of the (CV, support triangle) pairs of each CV, in shape (n_cvs+1,)
+    pairs_cv : ndarray
+        CV id of each pair, in shape (n_pairs,)
+    pairs_triangle : ndarray
+        Triangle id of each pair, in shape (n_pairs,)
+    lines_points : ndarray
+        End points of the two CV lines of each pair: first edge midpoint, centroid, second edge midpoint, in shape (n_pairs, 3, 3)
+    lines_l : ndarray
+        Lengths of the two CV lines of each pair, in shape (n_pairs, 2)
+    lines_n : ndarray
+        Unit normals of the two CV lines of each pair, oriented outwards from the CV, in shape (n_pairs, 2, 3)
+    slice_A : ndarray
+        Area of the CV slice in each pair (node, first edge midpoint, centroid, second edge midpoint), in shape (n_pairs,)
+    nodes : nodes
+        The nodes list of the mesh, referenced by the CV objects
+    """
+    def __init__(self, *args, **kwargs):
+        if self.__abstractmethods__:
+            # list.__new__ does not check the abstract methods as object.__new__ does
+            raise TypeError(f"Can't instantiate abstract class {type(self).__name__} without an implementation of: {', '.join(sorted(self.__abstractmethods__))}")
+        super().__init__(args[0])
+        self.N : int = 0
+        self.fill : np.ndarray = None
+        self.free_surface : np.ndarray = None
+        self.arrival_time : np.ndarray = None
+        self.vol : np.ndarray = None
+        self.A : np.ndarray = None
+        self.support_indptr : np.ndarray = None
+        self.support_indices : np.ndarray = None
+        self.pairs_indptr : np.ndarray = None
+        self.pairs_cv : np.ndarray = None
+        self.pairs_triangle : np.ndarray = None
+        self.lines_points : np.ndarray = None
+        self.lines_l : np.ndarray = None
+        self.lines_n : np.ndarray = None
+        self.slice_A : np.ndarray = None
+        self.nodes : nodes = None
+
+    arrays = ("vol", "A", "support_indptr", "support_indices", "pairs_indptr", "pairs_cv", "pairs_triangle", "lines_points", "lines_l", "lines_n", "slice_A")
+
+    def create(self, i):
+        node = self.nodes[i]
+        cv = ent.CV(id=i, node=node, state=self)
+        cv.support_triangles = node.triangles
+        cv.support_CVs = lazy_view(self, node.node_ids)
+        cv.cv_lines = []
+        for k in range(self.pairs_indptr[i], self.pairs_indptr[i + 1]):
+            points = self.lines_points[k]
+            cv.cv_lines.append([ent.CVLine.from_arrays(points[j], points[j + 1], self.lines_l[k, j], self.lines_n[k, j]) for j in range(2)])
+        return cv
+
+    def allocate(self, N:int):
+        """
+        Allocates the state arrays for N CVs.
+        """
+        self.N = N
+        self.fill = np.zeros(N)
+        self.free_surface = np.zeros(N, dtype=np.int8)
+        self.arrival_time = np.full(N, np.inf)
+        self.vol = np.zeros(N)
+        self.A = np.zeros(N)
+
+    def fork(self):
+        """
+        Returns a list of the same CVs with its own state: the state arrays (fill, free_surface, arrival_time) are copied, all other arrays are shared. The CV objects of the new list are created on access, as views on its state.
+        """
+        branch = cvs([])
+        branch.__dict__.update(self.__dict__)
+        branch.fill = self.fill.copy()
+        branch.free_surface = self.free_surface.copy()
+        branch.arrival_time = self.arrival_time.copy()
+        branch.reserve(self.N)
+        return branch
+
+    def support_of(self, ids):
+        """
+        Returns the ids of the support CVs of all CVs in `ids`, concatenated (with repetitions).
+        """
+        starts = self.support_indptr[ids]
+        counts = self.support_indptr[np.asarray(ids) + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.support_indices[np.repeat(starts, counts) + offsets]
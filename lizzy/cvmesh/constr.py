@@ -5,115 +5,185 @@
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
-from .collections import nodes, lines, elements
+from .collections import nodes, lines, elements, cvs
 from . import entities as ent
+from lizzy.IO import geometry as geom
 
 
 def CreateNodes(mesh_data):
     """
-    Creates a Nodes. Returns a "nodes" list.
+    Creates Nodes. Returns a "nodes" list, where the Node objects are created on first access.
     """
     nodes_coords = np.array(mesh_data['all_nodes_coords'])
     all_nodes = nodes([])
-    for n, X in enumerate(nodes_coords):
-        node = ent.Node(X)
-        node.id = n
-        all_nodes.append(node)
-    all_nodes.XYZ = nodes_coords # redundant but might be useful
+    all_nodes.XYZ = nodes_coords
     all_nodes.N = len(nodes_coords)
+    all_nodes.reserve(all_nodes.N)
     return all_nodes
 
 def CreateLines(mesh_data, triangles):
     """
-    Creates Lines. Returns a "lines" list.
+    Creates Lines, one per unique element edge. Returns a "lines" list, where the Line objects are created on first access.
     """
+    if 'triangles_lines' in mesh_data:
+        lines_conn, lines_triangles, boundary_lines, triangles_lines = (mesh_data['lines_conn'], mesh_data['lines_triangles'],
+                                                                        mesh_data['boundary_lines'], mesh_data['triangles_lines'])
+    else:
+        lines_conn, lines_triangles, boundary_lines, triangles_lines = geom.extract_lines(triangles.nodes_conn_table)
+    all_nodes = triangles.nodes
     all_lines = lines([])
-    line_counter = 0
-    for n, triangle in enumerate(triangles):
-        #line 1
-        line_1 = ent.Line(triangle.nodes[0], triangle.nodes[1])
-        line_1.id = line_counter
-        line_1.triangles.append(triangle)
-        line_1.triangle_ids.append(triangle.id)
-        line_counter += 1
-        all_lines.append(line_1)
-        # line 2
-        line_2 = ent.Line(triangle.nodes[1], triangle.nodes[2])
-        line_2.id = line_counter
-        line_2.triangles.append(triangle)
-        line_2.triangle_ids.append(triangle.id)
-        line_counter += 1
-        all_lines.append(line_2)
-        # line 3
-        line_3 = ent.Line(triangle.nodes[2], triangle.nodes[0])
-        line_3.id = line_counter
-        line_3.triangles.append(triangle)
-        line_3.triangle_ids.append(triangle.id)
-        line_counter += 1
-        all_lines.append(line_3)
-
-        # reference created lines to triangle
-        triangle.lines.append(line_1)
-        triangle.line_ids.append(line_1.id)
-        triangle.lines.append(line_2)
-        triangle.line_ids.append(line_2.id)
-        triangle.lines.append(line_3)
-        triangle.line_ids.append(line_3.id)
-
-    all_lines.N = len(all_lines)
+    all_lines.nodes_conn_table = np.asarray(lines_conn, dtype=np.int64)
+    all_lines.triangles_table = np.asarray(lines_triangles, dtype=np.int64)
+    all_lines.boundary = np.asarray(boundary_lines, dtype=bool)
+    all_lines.N = len(all_lines.nodes_conn_table)
+    x = all_nodes.XYZ[all_lines.nodes_conn_table]
+    all_lines.midpoint, all_lines.n = ent.Line.geometry(x[:, 0], x[:, 1])
+    triangles.lines_table = np.asarray(triangles_lines, dtype=np.int64)
+    all_lines.nodes = all_nodes
+    all_lines.triangles = triangles
+    all_lines.reserve(all_lines.N)
+    triangles.lines = all_lines
     return all_lines
 
 def CreateTriangles(mesh_data, nodes):
     """
-    Creates triangles. Returns a "triangles" list.
+    Creates triangles. Returns a "triangles" list, where the Triangle objects are created on first access.
 
-    Preliminary calculations (pre-processing) for tri elements.
-    Put triangles in planes and calculate Jacobians and areas:
-    A_el = A_xi * det(J) = 0.5 * abs(det(J))
+    Preliminary calculations (pre-processing) for tri elements, for all elements at once (see Triangle.geometry):
+    Jacobians, gradients of the shape functions, areas A_el = A_xi * det(J) = 0.5 * abs(det(J)), normals and centroids.
+    Also stores the triangles containing each node, in the nodes list.
     """
-    conn = mesh_data['nodes_conn']
+    conn = np.asarray(mesh_data['nodes_conn'], dtype=np.int64)
     all_triangles = elements([])
-    for n, local_conn in enumerate(conn):
-        node_1 = nodes[local_conn[0]]
-        node_2 = nodes[local_conn[1]]
-        node_3 = nodes[local_conn[2]]
-        tri = ent.Triangle(node_1, node_2, node_3)
-        tri.id = n
-        tri.node_ids = [node_1.id, node_2.id, node_3.id]
-        all_triangles.append(tri)
-        # also assign triangle to nodes
-        node_1.triangles.append(tri)
-        node_1.triangle_ids.append(tri.id)
-        node_2.triangles.append(tri)
-        node_2.triangle_ids.append(tri.id)
-        node_3.triangles.append(tri)
-        node_3.triangle_ids.append(tri.id)
+    all_triangles.nodes_conn_table = conn
+    all_triangles.N = len(conn)
+    all_triangles.grad_N, all_triangles.A, all_triangles.n, all_triangles.centroid = ent.Triangle.geometry(nodes.XYZ[conn])
 
     # assign material_tag tag
+    material_tags = np.full(all_triangles.N, "", dtype=object)
     for key in mesh_data['physical_domains']:
-        for i in mesh_data['physical_domains'][key]:
-            all_triangles[i].material_tag = key
+        material_tags[mesh_data['physical_domains'][key]] = key
+    all_triangles.material_tags = material_tags.astype(str)
 
-    all_triangles.nodes_conn_table = mesh_data['nodes_conn'] # needed?
-    all_triangles.N = len(all_triangles)
+    # triangles of each node, in ascending order
+    order = np.argsort(conn.ravel(), kind='stable')
+    nodes.triangles_indptr = np.zeros(nodes.N + 1, dtype=np.int64)
+    np.cumsum(np.bincount(conn.ravel(), minlength=nodes.N), out=nodes.triangles_indptr[1:])
+    nodes.triangles_indices = order // conn.shape[1]
+    nodes.triangles = all_triangles
+    all_triangles.nodes = nodes
+    all_triangles.reserve(all_triangles.N)
     return all_triangles
 
 def CreateControlVolumes(nodes):
-    # for every nodes:
-    CVs = []
-    for node in nodes:
-        # retrieve elements that contain that node
-        new_CV = ent.CV()
-        new_CV.id = node.id
-        new_CV.node = node
-        new_CV.support_triangles = node.triangles
-        new_CV.calculate_area_and_volume()
-        CVs.append(new_CV)
-    CVs = np.array(CVs)
-    # reference support CVs
-    for cv in CVs:
-        connected_nodes = cv.node.node_ids
-        cv.support_CVs = CVs[connected_nodes]
-        cv.GetCVLines()
-        cv.CheckFluxNormalOrientations()
-    return CVs
\ No newline at end of file
+    """
+    Creates the CVs, one per node. The median-dual geometry of all CVs is calculated at once (see `cv_geometry`), and the CV areas and pore volumes are summed from the slices of their support triangles. Returns a "cvs" list, where the CV objects are created on first access.
+    """
+    triangles = nodes.triangles
+    CVs = cvs([])
+    CVs.allocate(nodes.N)
+    # support CVs and (CV, support triangle) pairs
+    CVs.support_indptr = nodes.adjacency_indptr
+    CVs.support_indices = nodes.adjacency_indices
+    CVs.pairs_indptr = nodes.triangles_indptr
+    CVs.pairs_cv = np.repeat(np.arange(nodes.N), np.diff(nodes.triangles_indptr))
+    CVs.pairs_triangle = nodes.triangles_indices
+    CVs.lines_points, CVs.lines_l, CVs.lines_n, CVs.slice_A = cv_geometry(nodes.XYZ, triangles, CVs.pairs_cv, CVs.pairs_triangle)
+    slice_vol = CVs.slice_A * triangles.h[CVs.pairs_triangle] * triangles.porosity[CVs.pairs_triangle]
+    CVs.A[:] = np.bincount(CVs.pairs_cv, CVs.slice_A, minlength=nodes.N)
+    CVs.vol[:] = np.bincount(CVs.pairs_cv, slice_vol, minlength=nodes.N)
+    CVs.nodes = nodes
+    CVs.reserve(nodes.N)
+    return CVs
+
+def cv_geometry(XYZ, triangles, pairs_cv, pairs_triangle):
+    """
+    Calculates the median-dual CV geometry of all (CV, support triangle) pairs at once, as in `CV.GetCVLines`, `CV.CheckFluxNormalOrientations` and `CV.calculate_area_and_volume`. In each pair, the two triangle edges containing the node are taken in the order of the triangle lines (1-2, 2-3, 3-1), and the CV lines join their midpoints to the triangle centroid.
+
+    Parameters
+    ----------
+    XYZ : ndarray
+        Node coordinates, in shape (n_nodes, 3)
+    triangles : elements
+        The elements list of the mesh
+    pairs_cv : ndarray
+        CV (node) id of each pair, in shape (n_pairs,)
+    pairs_triangle : ndarray
+        Triangle id of each pair, in shape (n_pairs,)
+
+    Returns
+    -------
+    points : ndarray
+        End points of the two CV lines: first edge midpoint, centroid, second edge midpoint, in shape (n_pairs, 3, 3)
+    l : ndarray
+        Lengths of the CV lines, in shape (n_pairs, 2)
+    n : ndarray
+        Unit normals of the CV lines, oriented outwards from the CV, in shape (n_pairs, 2, 3)
+    slice_A : ndarray
+        Area of the slice (node, first edge midpoint, centroid, second edge midpoint) projected on the xy plane, in shape (n_pairs,)
+    """
+    x = XYZ[pairs_cv]
+    local_node = np.argmax(triangles.nodes_conn_table[pairs_triangle] == pairs_cv[:, None], axis=1)
+    # the edges containing local node 1 are lines 1 (1-2) and 3 (3-1), node 2: lines 1 and 2, node 3: lines 2 and 3
+    local_edges = np.array([[0, 2], [0, 1], [1, 2]])[local_node]
+    line_ids = triangles.lines_table[pairs_triangle[:, None], local_edges]
+    midpoints = triangles.lines.midpoint[line_ids]
+    centroid = triangles.centroid[pairs_triangle]
+    points = np.stack((midpoints[:, 0], centroid, midpoints[:, 1]), axis=1)
+    DX = points[:, :2] - points[:, 1:]
+    l = np.linalg.norm(DX, axis=2)
+    n = np.zeros_like(DX)
+    n[:, :, 0] = DX[:, :, 1] / l
+    n[:, :, 1] = -DX[:, :, 0] / l
+    # by convention, normals are oriented outwards from the CV
+    dist_outer = np.linalg.norm(centroid[:, None] + n - x[:, None], axis=2)
+    dist_inner = np.linalg.norm(centroid[:, None] - n - x[:, None], axis=2)
+    n[dist_outer < dist_inner] *= -1
+    # shoelace formula on the slice polygon
+    polygon = np.stack((x, points[:, 0], points[:, 1], points[:, 2]), axis=1)[:, :, :2]
+    following = np.roll(polygon, -1, axis=1)
+    terms = polygon[:, :, 0] * following[:, :, 1] - polygon[:, :, 1] * following[:, :, 0]
+    slice_A = np.abs(terms[:, 0] + terms[:, 1] + terms[:, 2] + terms[:, 3]) / 2
+    return points, l, n, slice_A
+
+def CreateCVMesh(triangles):
+    """
+    Creates the mesh of the CV boundaries, for visualisation. Each CV line (edge midpoint to triangle centroid) is shared by the two CVs of the edge nodes, and appears once.
+
+    Parameters
+    ----------
+    triangles : elements
+        The elements list of the mesh
+
+    Returns
+    -------
+    points : ndarray
+        Edge midpoints followed by triangle centroids, in shape (n_lines + n_triangles, 3)
+    conn : ndarray
+        Points of each segment, in shape (3 * n_triangles, 2)
+    """
+    midpoints = triangles.lines.midpoint
+    points = np.concatenate((midpoints, triangles.centroid))
+    centroid_ids = np.repeat(len(midpoints) + np.arange(triangles.N), 3)
+    conn = np.stack((triangles.lines_table.ravel(), centroid_ids), axis=1)
+    return points, conn
+
+def node_adjacency(nodes_conn, N):
+    """
+    Computes the node-to-node adjacency (nodes sharing an element, excluding the node itself) in CSR format.
+
+    Returns
+    -------
+    indptr : ndarray
+        Row pointers, in shape (N+1,). The neighbours of node i are indices[indptr[i]:indptr[i+1]]
+    indices : ndarray
+        Sorted neighbour ids of each node, concatenated.
+    """
+    conn = np.asarray(nodes_conn, dtype=np.int64)
+    n_loc = conn.shape[1]
+    rows = np.repeat(conn, n_loc, axis=1).ravel()
+    cols = np.tile(conn, (1, n_loc)).ravel()
+    keys = np.unique(rows[rows != cols] * N + cols[rows != cols])
+    indptr = np.zeros(N + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // N, minlength=N), out=indptr[1:])
+    return indptr, keys % N
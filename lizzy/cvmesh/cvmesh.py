@@ -4,10 +4,13 @@
 #  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import copy
 import numpy as np
-from lizzy.cvmesh.constr import CreateNodes, CreateLines, CreateTriangles, CreateControlVolumes
-from lizzy.cvmesh.collections import nodes, lines, elements
+from functools import cached_property
+from lizzy.cvmesh.constr import CreateNodes, CreateLines, CreateTriangles, CreateControlVolumes, CreateCVMesh, node_adjacency
+from lizzy.cvmesh.collections import nodes, lines, elements, cvs
 from lizzy.materials import MaterialManager
+from lizzy.IO.cache import MeshCache
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -17,7 +20,7 @@ class Mesh:
     """
     A class representing a FE/CV mesh.
 
-    The Mesh class provides methods for creating and manipulating a mesh. Takes a mesh_data dictionary coming from the mesh reader, and creates objects for all entities (nodes, elements, lines). Also creates the control volumes (CVs).
+    The Mesh class provides methods for creating and manipulating a mesh. Takes a mesh_data dictionary coming from the mesh reader, and computes the geometry of all entities (nodes, elements, lines) in arrays. The entity objects are created on first access. Also creates the control volumes (CVs).
 
     Parameters
     ----------
@@ -31,46 +34,48 @@ class Mesh:
     triangles
         List of all elements in the mesh.
     lines
-        List of all lines (element edges) in the mesh. Lines shared by adjacent elements are repeated. Only boundary lines are unique.
+        List of all lines (element edges) in the mesh. Lines shared by adjacent elements appear once.
     CVs
-        List of all CVs in the mesh.
+        List of all CVs in the mesh. The CV state (fill, free surface, volume, area) is stored in array attributes of the list.
+    cache_key
+        Key of the current state of the mesh (read, then pre-processed) in the MeshCache, None if the cache is disabled.
     """
     def __init__(self, mesh_reader):
         self.mesh_data = mesh_reader.mesh_data
         self.nodes = nodes([])
         self.triangles = elements([])
         self.lines = lines([])
-        self.CVs = []
+        self.CVs = cvs([])
         self.boundaries = mesh_reader.mesh_data['physical_nodes']
         self.preprocessed = False
+        self.cache_key = getattr(mesh_reader, "cache_key", None)
 
         # Init methods:
-        self.PopulateFromMeshData(self.mesh_data)
-        self.CrossReferenceEntities()
-
-        ################## ALL THIS BLOCK TO BE REMOVED
-        # create mesh of CVs for visualisation only
-        cv_mesh_nodes = []
-        cv_mesh_conn = []
-        nodes_counter = 0
-        for cv in self.CVs:
-            for two_lines_tri in cv.cv_lines:
-                for line in two_lines_tri:
-                    line_conn = []
-                    p1 = line.p1
-                    p2 = line.p2
-                    cv_mesh_nodes.append(p1)
-                    line_conn.append(nodes_counter)
-                    nodes_counter += 1
-                    cv_mesh_nodes.append(p2)
-                    line_conn.append(nodes_counter)
-                    nodes_counter += 1
-                    cv_mesh_conn.append(line_conn)
-
-        self.cv_mesh_nodes = cv_mesh_nodes
-        self.cv_mesh_conn = cv_mesh_conn
-
-    ################## ALL THIS BLOCK TO BE REMOVED
+        cached_arrays = getattr(mesh_reader, "cached_arrays", None)
+        if cached_arrays is not None and "nodes/XYZ" in cached_arrays:
+            self.PopulateFromArrays(cached_arrays)
+        else:
+            self.PopulateFromMeshData(self.mesh_data)
+            self.CrossReferenceEntities()
+            if self.cache_key is not None:
+                arrays, nested = MeshCache.pack(self.mesh_data, "mesh_data")
+                for name in ("nodes", "triangles", "lines"):
+                    arrays.update(MeshCache.pack(getattr(self, name).to_arrays(), name)[0])
+                MeshCache.store(self.cache_key, arrays, {"nested": nested})
+
+    @cached_property
+    def cv_mesh(self):
+        """
+        Mesh of the CV boundaries, for visualisation only: the segments joining the edge midpoints to the centroid of each triangle. Computed on first access.
+
+        Returns
+        -------
+        points : ndarray
+            Edge midpoints followed by triangle centroids, in shape (n_lines + n_triangles, 3)
+        conn : ndarray
+            Points of each segment, in shape (3 * n_triangles, 2)
+        """
+        return CreateCVMesh(self.triangles)
 
     def PopulateFromMeshData(self, mesh_data):
         """
@@ -85,25 +90,96 @@ class Mesh:
         self.triangles = CreateTriangles(mesh_data, self.nodes)
         self.lines = CreateLines(mesh_data, self.triangles)
 
+    def PopulateFromArrays(self, arrays):
+        """
+        Initialises nodes, lines and triangles from the arrays stored in the MeshCache, instead of computing them from the mesh data.
+
+        Parameters
+        ----------
+        arrays : dict
+            Arrays of the nodes, triangles and lines lists, with names "nodes/...", "triangles/...", "lines/..."
+        """
+        for name in ("nodes", "triangles", "lines"):
+            getattr(self, name).from_arrays(MeshCache.unpack(arrays, name, []))
+        self.nodes.triangles = self.triangles
+        self.triangles.nodes = self.nodes
+        self.triangles.lines = self.lines
+        self.lines.nodes = self.nodes
+        self.lines.triangles = self.triangles
+        for collection in (self.nodes, self.triangles, self.lines):
+            collection.reserve(collection.N)
+
     def preprocess(self):
-        # assign permeability to elements
-        materials = MaterialManager.materials
-        rosettes = MaterialManager.rosettes
-        for tri in self.triangles:
-            try:
-                material = materials[tri.material_tag]
-                rosette = rosettes[tri.material_tag]
-                u, v, w = rosette.project_along_normal(tri.n)
-                R = np.array([u, v, w]).T
-                tri.k = R @ material.k_diag @ R.T
-                tri.porosity = materials[tri.material_tag].porosity
-                tri.h = materials[tri.material_tag].thickness
-            except KeyError:
-                exit(f"Mesh contains unassigned material tag: {tri.material_tag}")
-        self.CVs = CreateControlVolumes(self.nodes)
+        """
+        Assigns the material properties to the elements and creates the CVs. The permeability tensors, porosities and thicknesses of all elements are calculated per material tag, and stored in arrays of the elements list.
+        If the mesh was read with the MeshCache enabled, the result is cached, keyed by the mesh and by the materials and rosettes of its tags.
+        """
+        cache_key = None
+        cached = None
+        if self.cache_key is not None:
+            cache_key = MeshCache.key("preprocess", self.cache_key, *self.MaterialsSignature())
+            cached = MeshCache.load(cache_key)
+        if cached is not None:
+            arrays, _ = cached
+            triangles_arrays = MeshCache.unpack(arrays, "triangles", [])
+            for name in ("k", "porosity", "h"):
+                setattr(self.triangles, name, triangles_arrays[name])
+            for tri in self.triangles.created():
+                self.triangles.assign_properties(tri)
+            self.CVs = cvs([])
+            self.CVs.allocate(self.nodes.N)
+            self.CVs.from_arrays(MeshCache.unpack(arrays, "CVs", []))
+            self.CVs.nodes = self.nodes
+            self.CVs.reserve(self.CVs.N)
+        else:
+            self.AssignMaterials()
+            self.CVs = CreateControlVolumes(self.nodes)
+            if cache_key is not None:
+                arrays = {f"triangles/{name}": getattr(self.triangles, name) for name in ("k", "porosity", "h")}
+                arrays.update(MeshCache.pack(self.CVs.to_arrays(), "CVs")[0])
+                MeshCache.store(cache_key, arrays)
+        self.cache_key = cache_key
         print("Mesh pre-processing completed\n")
         self.preprocessed = True
 
+    def AssignMaterials(self):
+        """
+        Assigns permeability, porosity and thickness to all elements from the materials and rosettes of the MaterialManager. The permeability tensor of each element is the principal permeability rotated to the rosette projected on the element: k = R k_diag R^T.
+        """
+        triangles = self.triangles
+        materials = MaterialManager.materials
+        rosettes = MaterialManager.rosettes
+        triangles.k = np.empty((triangles.N, 3, 3))
+        triangles.porosity = np.empty(triangles.N)
+        triangles.h = np.empty(triangles.N)
+        for tag in np.unique(triangles.material_tags):
+            if tag not in materials:
+                raise KeyError(f"Mesh contains unassigned material tag: {tag}")
+            material = materials[tag]
+            idx = np.nonzero(triangles.material_tags == tag)[0]
+            R = rosettes[tag].project_along_normals(triangles.n[idx])
+            triangles.k[idx] = R @ material.k_diag @ R.transpose(0, 2, 1)
+            triangles.porosity[idx] = material.porosity
+            triangles.h[idx] = material.thickness
+        # triangles created before the assignment are updated, the others read the arrays when created
+        for tri in triangles.created():
+            triangles.assign_properties(tri)
+
+    def MaterialsSignature(self):
+        """
+        Returns the material and rosette data of all material tags of the mesh, used to key the pre-processing in the MeshCache.
+        """
+        signature = []
+        for tag in np.unique(self.triangles.material_tags):
+            material = MaterialManager.materials.get(tag)
+            rosette = MaterialManager.rosettes.get(tag)
+            signature.append(str(tag))
+            if material is not None:
+                signature += [np.asarray(material.k_diag, dtype=float), float(material.porosity), float(material.thickness)]
+            if rosette is not None:
+                signature += [np.asarray(rosette.u, dtype=float), np.asarray(rosette.p0, dtype=float)]
+        return signature
+
     def CrossReferenceEntities(self):
         """
         Creates hierarchical connections between all objects that constitute the mesh: Nodes, Lines, Elements.
@@ -117,15 +193,20 @@ class Mesh:
         >>> nodes = mesh.elements[3].nodes
         """
 
-        # go through nodes and cross reference connected nodes, to help fetch support CVs
-        for node in self.nodes:
-            connected_nodes_ids = []
-            for tri in node.triangles:
-                connected_nodes_ids.append(tri.node_ids)
-            connected_nodes_ids = np.unique(connected_nodes_ids).tolist()
-            connected_nodes_ids.remove(node.id)
-            node.node_ids = connected_nodes_ids
+        # cross reference connected nodes, to help fetch support CVs. The node adjacency is stored in CSR format in the nodes list, and the Node objects read it when they are created
+        indptr, indices = node_adjacency(self.triangles.nodes_conn_table, self.nodes.N)
+        self.nodes.adjacency_indptr = indptr
+        self.nodes.adjacency_indices = indices
+
+    def fork(self):
+        """
+        Returns a copy of the mesh that shares its nodes, elements, boundaries and pre-processed arrays, with its own copy of the CV state (see ``cvs.fork``). Used to run several solutions from the same fill state.
+        """
+        branch = copy.copy(self)
+        branch.CVs = self.CVs.fork()
+        return branch
 
     def EmptyCVs(self):
-        for cv in self.CVs:
-            cv.fill = 0
+        self.CVs.fill[:] = 0
+        self.CVs.free_surface[:] = 0
+        self.CVs.arrival_time[:] = np.inf
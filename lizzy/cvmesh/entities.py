@@ -42,7 +42,7 @@ class Element2D:
 
 
 class Triangle(Element2D):
-    ### Triangle element stuff
+    ### Triangle element stuff
     # xi is 'xchi'
     dNdxi = np.array([[-1, -1],
                         [1, 0],
@@ -50,23 +50,60 @@ class Triangle(Element2D):
     def __init__(self, node_1:Node, node_2:Node, node_3:Node):
         super().__init__()
         x = np.array((node_1.coords, node_2.coords, node_3.coords))
-        J = np.array([
-            [x[1,0]-x[0,0], x[2,0]-x[0,0]],
-            [x[1,1]-x[0,1], x[2,1]-x[0,1]],
-            [x[1,2]-x[0,2], x[2,2]-x[0,2]]
-        ])
-        detJ = np.linalg.norm(np.cross(J[:, 0], J[:, 1]))
-        dxidX = np.linalg.pinv(J)
-
-        # compute triangle normal, used for rosette projection
-        u = x[0,:] - x[1,:]
-        v = x[0,:] - x[2,:]
-        n = np.linalg.cross(u, v)
-        self.n = n / np.linalg.norm(n)
+        grad_N, A, n, centroid = Triangle.geometry(x[None])
         self.nodes = (node_1, node_2, node_3)
-        self.grad_N = (Triangle.dNdxi @ dxidX).T
-        self.A = 0.5 * detJ
-        self.centroid = x.mean(0)
+        self.grad_N = grad_N[0]
+        self.A = A[0]
+        self.n = n[0]
+        self.centroid = centroid[0]
+
+    @classmethod
+    def from_arrays(cls, nodes:tuple, grad_N:np.ndarray, A:float, n:np.ndarray, centroid:np.ndarray):
+        """
+        Creates a triangle from precomputed geometry (see `geometry`), without recalculating it.
+        """
+        tri = cls.__new__(cls)
+        Element2D.__init__(tri)
+        tri.nodes = nodes
+        tri.grad_N = grad_N
+        tri.A = A
+        tri.n = n
+        tri.centroid = centroid
+        return tri
+
+    @staticmethod
+    def geometry(x:np.ndarray):
+        """
+        Calculates the geometry of a stack of triangles in 3D. Each triangle is mapped to the reference triangle by the Jacobian J = [x2-x1, x3-x1], in shape (3,2). The gradients of the shape functions use the pseudo-inverse of J, and the area is A_el = A_xi * det(J) = 0.5 * |(x2-x1) x (x3-x1)|.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            Node coordinates of the triangles, in shape (n_tri, 3, 3): triangle, node, coordinate.
+
+        Returns
+        -------
+        grad_N : np.ndarray
+            Gradients of the shape functions, in shape (n_tri, 3, 3): triangle, coordinate, node.
+        A : np.ndarray
+            Areas, in shape (n_tri,).
+        n : np.ndarray
+            Unit normals, used for rosette projection, in shape (n_tri, 3).
+        centroid : np.ndarray
+            Centroids, in shape (n_tri, 3).
+        """
+        J = np.stack((x[:, 1] - x[:, 0], x[:, 2] - x[:, 0]), axis=2)
+        cross = np.cross(J[:, :, 0], J[:, :, 1])
+        detJ = np.linalg.norm(cross, axis=1)
+        # pseudo-inverse of a full column rank J: (J^T J)^-1 J^T, with det(J^T J) = detJ^2
+        JtJ = np.einsum('nki,nkj->nij', J, J)
+        JtJ_inv = np.stack((np.stack((JtJ[:, 1, 1], -JtJ[:, 0, 1]), axis=1),
+                            np.stack((-JtJ[:, 1, 0], JtJ[:, 0, 0]), axis=1)), axis=1) / (detJ**2)[:, None, None]
+        dxidX = np.einsum('nij,nkj->nik', JtJ_inv, J)
+        grad_N = np.einsum('ai,nik->nka', Triangle.dNdxi, dxidX)
+        # u x v with u = x1-x2 and v = x1-x3 is the same as (x2-x1) x (x3-x1)
+        n = cross / detJ[:, None]
+        return grad_N, 0.5 * detJ, n, x.mean(1)
 
     def __str__(self):
         return "Triangle element ID: " + str(self.id)
@@ -85,6 +122,32 @@ class Line:
         self.triangles = []
         self.triangle_ids = []
 
+    @classmethod
+    def from_arrays(cls, nodes:tuple, midpoint:np.ndarray, n:np.ndarray):
+        """
+        Creates a line from precomputed geometry (see `geometry`), without recalculating it.
+        """
+        line = cls.__new__(cls)
+        line.nodes = nodes
+        line.id = 0
+        line.midpoint = midpoint
+        line.n = n
+        line.triangles = []
+        line.triangle_ids = []
+        return line
+
+    @staticmethod
+    def geometry(x1:np.ndarray, x2:np.ndarray):
+        """
+        Calculates the midpoints and the in-plane unit normals of a stack of lines with end points `x1` and `x2`, in shape (n_lines, 3).
+        """
+        DX = x1 - x2
+        l = np.linalg.norm(DX, axis=1)
+        n = np.zeros_like(DX)
+        n[:, 0] = DX[:, 1] / l
+        n[:, 1] = -DX[:, 0] / l
+        return 0.5 * (x1 + x2), n
+
     def ComputeMidPoint(self):
         x1 = self.nodes[0].coords
         x2 = self.nodes[1].coords
@@ -105,16 +168,49 @@ class Line:
 class CV:
     id:int = 0
     node:Node = None
-    fill:float = 0
-    area:float = 0
-    free_surface:int = 0
+    state:any = field(default=None, repr=False, compare=False)
     support_CVs:list = field(default_factory=list)
     support_lines:list = field(default_factory=list)
     support_nodes:list = field(default_factory=list)
     support_triangles : list = field(default_factory=list)
     edges:list = field(default_factory=list)
-    A:float = 0
-    vol = 0
+
+    # The CV state (fill, free_surface, vol, A) lives in the arrays of the "cvs" collection passed as `state`. These properties are views on the entry of this CV.
+    @property
+    def fill(self):
+        return self.state.fill[self.id]
+
+    @fill.setter
+    def fill(self, value):
+        self.state.fill[self.id] = value
+
+    @property
+    def free_surface(self):
+        return self.state.free_surface[self.id]
+
+    @free_surface.setter
+    def free_surface(self, value):
+        self.state.free_surface[self.id] = value
+
+    @property
+    def vol(self):
+        return self.state.vol[self.id]
+
+    @vol.setter
+    def vol(self, value):
+        self.state.vol[self.id] = value
+
+    @property
+    def A(self):
+        return self.state.A[self.id]
+
+    @A.setter
+    def A(self, value):
+        self.state.A[self.id] = value
+
+    @property
+    def area(self):
+        return self.A
 
     # The CV has this structure:
     #   support_triangles = [tri1, tri2, tri3, ... ]
@@ -147,7 +243,7 @@ class CV:
 
             line1 = self.cv_lines[i][0]   # PSEUDO CODE ALL TO CHECK AND RE-WRITE
             line2 = self.cv_lines[i][1]
-            device = v.get_device()
+            device = v.device
 
             l1 = torch.tensor(line1.l,device=device)
             n1 = torch.tensor(line1.n,device=device)
@@ -224,6 +320,19 @@ class CVLine:
         self.l = 0
         self.n = None
         self.ComputeLengthAndNormal()
+
+    @classmethod
+    def from_arrays(cls, p1, p2, l, n):
+        """
+        Creates a CV line from a precomputed length and (oriented) normal, without recalculating them.
+        """
+        line = cls.__new__(cls)
+        line.p1 = p1
+        line.p2 = p2
+        line.midpoint = 0.5*(p1 + p2)
+        line.l = l
+        line.n = n
+        return line
     
     def ComputeLengthAndNormal(self):
         DX = self.p1 - self.p2
@@ -22,6 +22,17 @@ class Rosette:
         v_project = v_project / np.linalg.norm(v_project)
         return u_project, v_project, normal
 
+    def project_along_normals(self, normals):
+        """
+        Projects the rosette on a stack of elements, see `project_along_normal`. Returns the rotation matrices [u, v, n] (as columns) of all elements, in shape (n_elements, 3, 3).
+        """
+        u_normal = (normals @ self.u)[:, None] * normals
+        u_project = self.u - u_normal
+        u_project = u_project / np.linalg.norm(u_project, axis=1)[:, None]
+        v_project = np.cross(u_project, normals)
+        v_project = v_project / np.linalg.norm(v_project, axis=1)[:, None]
+        return np.stack((u_project, v_project, normals), axis=2)
+
 
 
 class PorousMaterial:
@@ -13,7 +13,7 @@ class ProcessParameters:
     mu: float
         Dynamic viscosity of the fluid
     wo_delta_time: float
-        Time intervals at which results will be saved
+        Time intervals at which results will be saved. With np.inf, only the initial and final states are saved: the fill history is given by the arrival time of the flow front, returned in the solution as "arrival_time"
     write_all_steps: bool
         If True, all time steps will be saved and "wo_delta_time" will be ignored (default: False)
     """
@@ -32,3 +32,58 @@ class ProcessParameters:
                 setattr(cls, key, value)
             else:
                 raise AttributeError(f"'{cls.__name__}' Error: unknown attribute '{key}'")
+
+
+class SolverParameters:
+    """
+    Defines numerical parameters of the solvers. Attribute values can be assigned as kwargs of the ``assign`` method.
+
+    Attributes
+    ----------
+    iter_rtol: float
+        Convergence tolerance of the iterative pressure solvers, on the residual norm relative to the right-hand side norm (default: 1e-8)
+    iter_max: int
+        Maximum number of iterations of the iterative pressure solvers (default: 1000)
+    precond_rebuild_interval: int
+        Number of time steps after which the preconditioner of the iterative pressure solvers is set up again. In between, the preconditioner of a previous fill state is reused (default: 20)
+    incremental_max_rank: int
+        Maximum number of nodes freed since the last factorisation before the DIRECT_SPARSE_INCREMENTAL solver factorises again (default: 64)
+    multi_cv_stepping: bool
+        If True, several CVs can be filled in one time step, with the volume in excess redistributed to the neighbouring CVs. The number of CVs per step is adapted to keep the estimated fill time error within ``fill_time_tol``. If False, each time step fills exactly one CV (default: False)
+    max_cvs_per_step: int
+        Maximum number of CVs filled in one time step when ``multi_cv_stepping`` is True (default: 32)
+    fill_time_tol: float
+        Tolerance on the estimated relative fill time error of each time step when ``multi_cv_stepping`` is True (default: 0.01)
+    results_dtype: str
+        Precision of the pressure, velocity and fill factor stored for the write-out time steps, "float64" or "float32" (default: "float64")
+    results_spill_directory: str
+        If not None, the write-out time steps are stored in memory-mapped files in this directory instead of in memory (default: None)
+    results_keyframe_interval: int
+        Number of write-out time steps between two full copies of the fill factor and free surface. In between, only the nodes that changed are stored (default: 64)
+    checkpoint_path: str
+        If not None, ``Solver.solve`` writes a checkpoint of the solution in this folder every ``checkpoint_interval`` seconds. A solution is resumed from a checkpoint with ``Solver.resume``. Read when a Solver is created, as its ``checkpoint_path`` attribute (default: None)
+    checkpoint_interval: float
+        Wall-clock time between two checkpoints, in seconds (default: 300)
+    """
+    def __new__(cls, *args, **kwargs):
+        raise TypeError(f"{cls.__name__} is a singleton and must not be instantiated.")
+    iter_rtol: float = 1e-8
+    iter_max: int = 1000
+    precond_rebuild_interval: int = 20
+    incremental_max_rank: int = 64
+    multi_cv_stepping: bool = False
+    max_cvs_per_step: int = 32
+    fill_time_tol: float = 0.01
+    results_dtype: str = "float64"
+    results_spill_directory: str = None
+    results_keyframe_interval: int = 64
+    checkpoint_path: str = None
+    checkpoint_interval: float = 300.0
+
+    @classmethod
+    def assign(cls, **kwargs):
+        for key, value in kwargs.items():
+            if hasattr(cls, key):
+                setattr(cls, key, value)
+            else:
+                raise AttributeError(f"'{cls.__name__}' Error: unknown attribute '{key}'")
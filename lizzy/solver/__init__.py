@@ -5,8 +5,9 @@
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from lizzy import bcond
-from lizzy.solver.timestep import TimeStepManager
+from lizzy.solver.timestep import TimeStepManager, DeltaSeries
+from lizzy.solver.checkpoint import Checkpoint
 from lizzy.solver import fem as fe
-from lizzy.solver.psolvers import PressureSolver, SolverType
+from lizzy.solver.psolvers import PressureSolver, IterativePressureSolver, IncrementalPressureSolver, CachedPressureSolver, SolverType, ITERATIVE_SOLVERS
 from lizzy.solver.fillsolver import FillSolver
 from lizzy.solver.vsolvers import VelocitySolver
\ No newline at end of file
@@ -4,17 +4,115 @@
 #  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+import time
 import numpy as np
 import torch
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 
 
+def to_scipy_csr(k:torch.Tensor):
+    """
+    Wraps a torch sparse CSR tensor (on cpu) into a scipy CSR matrix. The index and value arrays are shared, not copied.
+    """
+    return sp.csr_matrix((k.values().numpy(), k.col_indices().numpy(), k.crow_indices().numpy()), shape=tuple(k.shape))
+
+def splu_spd(k_csc):
+    """
+    LU factorisation of a symmetric positive definite matrix: symmetric fill-reducing ordering and no pivoting, so that the factors are those of a Cholesky factorisation (up to the diagonal scaling).
+    """
+    return spla.splu(k_csc, permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0.0, options=dict(SymmetricMode=True))
+
 def solve_pressure_direct_dense(k, f):
-    p = torch.linalg.solve(k, f)
+    if k.layout == torch.sparse_csr:
+        k = k.to_dense()
+    # k is symmetric positive definite once the constraints are applied by symmetric elimination
+    L = torch.linalg.cholesky(k)
+    p = torch.cholesky_solve(f.reshape(-1, 1), L)
     return torch.flatten(p)
 
-def solve_pressure_direct_sparse(k:np.ndarray, f:np.ndarray):
-    k_sparse = k.to_sparse_csr()
-    p = torch.sparse.spsolve(k_sparse, f)
-    return p
+def solve_pressure_direct_sparse(k:torch.Tensor, f:torch.Tensor):
+    if k.device.type == 'cuda':
+        return torch.sparse.spsolve(k, f)
+    k_csc = to_scipy_csr(k).tocsc()
+    p = splu_spd(k_csc).solve(f.numpy())
+    return torch.from_numpy(p)
+
+
+class CachedSparseLU:
+    """
+    Sparse direct factorisation for a sequence of symmetric positive definite matrices sharing one sparsity pattern. The fill-reducing ordering is computed once in `analyse`, together with the permuted CSC structure and the map from the CSR nonzeros to the permuted CSC nonzeros. Each `factorise` then only gathers the values in the permuted order and runs the numeric factorisation with the natural ordering.
+
+    Attributes
+    ----------
+    stats : dict
+        Time spent in the analysis, number and total time of the numeric factorisations, and estimate of the time saved by not computing the ordering at every factorisation (``estimated_ordering_time_saved``): the ordering cost is not measured directly, but estimated once in `analyse` as the time a factorisation with ordering takes more than one without, and counted for each numeric factorisation.
+    """
+    def __init__(self):
+        self.perm = None
+        self.indptr = None
+        self.indices = None
+        self.gather = None
+        self.lu = None
+        self.stats = {"analysis_time": 0.0, "factorisations": 0, "factorisation_time": 0.0, "estimated_ordering_time_saved": 0.0}
+        self._ordering_time = 0.0
+
+    @property
+    def analysed(self):
+        return self.perm is not None
+
+    def analyse(self, k:torch.Tensor):
+        """
+        Computes the ordering and the permuted structure from the pattern of `k` (sparse CSR). The ordering is computed on the pattern with a dominant diagonal, so that every stored entry counts as structurally nonzero.
+        """
+        t_start = time.perf_counter()
+        K = to_scipy_csr(k.cpu())
+        n = K.shape[0]
+        A = sp.csr_matrix((-np.ones(K.nnz), K.indices, K.indptr), shape=K.shape)
+        A = A + sp.diags(np.diff(K.indptr) + 1.0)
+        t_ordered = time.perf_counter()
+        lu = splu_spd(A.tocsc())
+        t_ordered = time.perf_counter() - t_ordered
+        self.perm = np.argsort(lu.perm_c)
+        # permuted structure, with the position of each permuted entry in the CSR nonzeros of k
+        positions = sp.csr_matrix((np.arange(1, K.nnz + 1, dtype=float), K.indices, K.indptr), shape=K.shape)
+        permuted = positions[self.perm][:, self.perm].tocsc()
+        permuted.sort_indices()
+        self.indptr = permuted.indptr
+        self.indices = permuted.indices
+        self.gather = permuted.data.astype(np.int64) - 1
+        self.stats["analysis_time"] = time.perf_counter() - t_start
+        # the ordering cost is estimated as what a factorisation with ordering takes more than one without
+        t_natural = time.perf_counter()
+        self._splu_natural(sp.csc_matrix((A.tocsr().data[self.gather], self.indices, self.indptr), shape=(n, n)))
+        self._ordering_time = max(t_ordered - (time.perf_counter() - t_natural), 0.0)
+
+    def factorise(self, k:torch.Tensor):
+        """
+        Numeric factorisation of `k` (sparse CSR, same pattern as in `analyse`).
+        """
+        if not self.analysed:
+            self.analyse(k)
+        t_start = time.perf_counter()
+        n = k.shape[0]
+        values = k.values().cpu().numpy()
+        self.lu = self._splu_natural(sp.csc_matrix((values[self.gather], self.indices, self.indptr), shape=(n, n)))
+        self.stats["factorisations"] += 1
+        self.stats["factorisation_time"] += time.perf_counter() - t_start
+        self.stats["estimated_ordering_time_saved"] += self._ordering_time
+
+    def report(self):
+        return (f"cached sparse analysis: {self.stats['analysis_time']:.3f} s once, {self.stats['factorisations']} numeric factorisations "
+                f"in {self.stats['factorisation_time']:.3f} s, about {self.stats['estimated_ordering_time_saved']:.3f} s of ordering saved (estimate)")
 
+    @staticmethod
+    def _splu_natural(a_csc):
+        return spla.splu(a_csc, permc_spec="NATURAL", diag_pivot_thresh=0.0, options=dict(SymmetricMode=True))
 
+    def solve(self, b:np.ndarray):
+        """
+        Solves with the last factorisation. `b` can be a vector (n,) or a matrix of right-hand sides (n, m).
+        """
+        x = np.empty_like(b, dtype=float)
+        x[self.perm] = self.lu.solve(np.ascontiguousarray(b[self.perm]))
+        return x
@@ -4,4 +4,211 @@
 #  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-# to be added
\ No newline at end of file
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+
+def pcg(A, b, x0, M, rtol=1e-8, max_iter=1000):
+    """
+    Preconditioned conjugate gradient for symmetric positive definite systems. The Polak-Ribiere form of beta is used, which keeps the method robust when the preconditioner is only nearly symmetric (e.g. threshold-dropped incomplete factors).
+
+    Parameters
+    ----------
+    A : scipy.sparse matrix
+        System matrix, dimension (n,n).
+    b : np.ndarray
+        Right-hand side vector, dimension (n,).
+    x0 : np.ndarray
+        Initial guess, dimension (n,).
+    M : callable
+        Applies the preconditioner to a residual vector.
+    rtol : float
+        Convergence tolerance on the residual norm, relative to the norm of `b`.
+    max_iter : int
+        Maximum number of iterations.
+
+    Returns
+    -------
+    x : np.ndarray
+        Solution vector.
+    n_iter : int
+        Number of iterations performed.
+    res : float
+        Final relative residual norm.
+    """
+    x = np.array(x0, dtype=float)
+    b_norm = np.linalg.norm(b)
+    if b_norm == 0:
+        return np.zeros_like(x), 0, 0.0
+    r = b - A @ x
+    res = np.linalg.norm(r) / b_norm
+    if res <= rtol:
+        return x, 0, res
+    z = M(r)
+    d = z.copy()
+    rz = r @ z
+    for it in range(1, max_iter + 1):
+        Ad = A @ d
+        alpha = rz / (d @ Ad)
+        x += alpha * d
+        r_new = r - alpha * Ad
+        res = np.linalg.norm(r_new) / b_norm
+        if res <= rtol:
+            return x, it, res
+        z = M(r_new)
+        rz_new = r_new @ z
+        beta = (rz_new - r @ z) / rz
+        d = z + beta * d
+        r, rz = r_new, rz_new
+    return x, max_iter, res
+
+
+class JacobiPreconditioner:
+    """
+    Diagonal preconditioner. Preconditioners are set up on the diagonally scaled system (unit diagonal), so Jacobi reduces to the identity there.
+    """
+    needs_setup = False
+
+    def setup(self, A):
+        pass
+
+    def apply(self, r):
+        return r
+
+
+class IncompleteCholeskyPreconditioner:
+    """
+    Incomplete factorisation with threshold dropping. SuperLU's ILUTP is used in symmetric mode without pivoting, which for a symmetric positive definite matrix gives an incomplete Cholesky-type factorisation.
+
+    Parameters
+    ----------
+    drop_tol : float
+        Drop tolerance of the factor entries.
+    fill_factor : float
+        Maximum ratio of nonzeros of the factors to nonzeros of the matrix.
+    """
+    needs_setup = True
+
+    def __init__(self, drop_tol=1e-4, fill_factor=10):
+        self.drop_tol = drop_tol
+        self.fill_factor = fill_factor
+        self.ilu = None
+
+    def setup(self, A):
+        self.ilu = spla.spilu(sp.csc_matrix(A), drop_tol=self.drop_tol, fill_factor=self.fill_factor, permc_spec="MMD_AT_PLUS_A",
+                              diag_pivot_thresh=0.0, options=dict(SymmetricMode=True))
+
+    def apply(self, r):
+        return self.ilu.solve(r)
+
+
+class AMGPreconditioner:
+    """
+    Smoothed aggregation algebraic multigrid, applied as one symmetric V-cycle with damped Jacobi smoothing.
+
+    Parameters
+    ----------
+    theta : float
+        Strength of connection threshold: `|a_ij| >= theta * sqrt(|a_ii a_jj|)`.
+    max_coarse : int
+        Size below which the coarsest level is solved directly.
+    max_levels : int
+        Maximum number of levels of the hierarchy.
+    n_smooth : int
+        Number of pre- and post-smoothing sweeps.
+    """
+    needs_setup = True
+
+    def __init__(self, theta=0.08, max_coarse=300, max_levels=12, n_smooth=2):
+        self.theta = theta
+        self.max_coarse = max_coarse
+        self.max_levels = max_levels
+        self.n_smooth = n_smooth
+        self.levels = []
+        self.coarse_solver = None
+
+    def setup(self, A):
+        self.levels = []
+        A = sp.csr_matrix(A)
+        while len(self.levels) < self.max_levels - 1 and A.shape[0] > self.max_coarse:
+            d_inv = 1 / A.diagonal()
+            rho = self._spectral_radius(A, d_inv)
+            aggregates = self._aggregate(A)
+            n_agg = aggregates.max() + 1
+            if n_agg == 0 or n_agg >= A.shape[0]:
+                break
+            # tentative prolongator: normalised constant vector on each aggregate, isolated nodes are left out
+            in_agg = aggregates >= 0
+            T = sp.csr_matrix((np.ones(in_agg.sum()), (np.nonzero(in_agg)[0], aggregates[in_agg])), shape=(A.shape[0], n_agg))
+            T = T @ sp.diags(1 / np.sqrt(np.asarray(T.sum(axis=0)).ravel()))
+            P = (T - (4 / (3 * rho)) * sp.diags(d_inv) @ (A @ T)).tocsr()
+            self.levels.append((A, d_inv, rho, P))
+            A = (P.T @ A @ P).tocsr()
+        self.coarse_solver = spla.splu(sp.csc_matrix(A))
+
+    def apply(self, r):
+        return self._vcycle(0, r)
+
+    def _vcycle(self, i, b):
+        if i == len(self.levels):
+            return self.coarse_solver.solve(b)
+        A, d_inv, rho, P = self.levels[i]
+        omega = 4 / (3 * rho)
+        x = omega * d_inv * b
+        for _ in range(self.n_smooth - 1):
+            x += omega * d_inv * (b - A @ x)
+        x += P @ self._vcycle(i + 1, P.T @ (b - A @ x))
+        for _ in range(self.n_smooth):
+            x += omega * d_inv * (b - A @ x)
+        return x
+
+    @staticmethod
+    def _spectral_radius(A, d_inv, n_iter=15):
+        x = np.random.default_rng(0).random(A.shape[0])
+        rho = 1.0
+        for _ in range(n_iter):
+            y = d_inv * (A @ x)
+            rho = np.linalg.norm(y) / np.linalg.norm(x)
+            x = y / np.linalg.norm(y)
+        return rho
+
+    def _aggregate(self, A):
+        """
+        Standard aggregation on the strength graph, vectorised. The roots of the aggregates are a maximal independent set of the distance-2 strength graph, found with Luby's algorithm, so each root and its strong neighbours form a disjoint aggregate. The remaining nodes are at distance 2 of a root and join the aggregate of a neighbour. Nodes without strong connections (e.g. constrained nodes) get aggregate -1.
+        """
+        n = A.shape[0]
+        A = sp.coo_matrix(A)
+        diag = np.abs(A.diagonal())
+        strong = (A.row != A.col) & (np.abs(A.data) >= self.theta * np.sqrt(diag[A.row] * diag[A.col]))
+        S = sp.csr_matrix((np.ones(strong.sum()), (A.row[strong], A.col[strong])), shape=(n, n))
+        indptr, indices = S.indptr, S.indices
+        isolated = np.diff(indptr) == 0
+        # distance-2 strength graph, without the diagonal
+        S2 = sp.coo_matrix(S @ S + S)
+        off_diagonal = S2.row != S2.col
+        S2 = sp.csr_matrix((np.ones(off_diagonal.sum()), (S2.row[off_diagonal], S2.col[off_diagonal])), shape=(n, n))
+        has_neighbours = np.diff(S2.indptr) > 0
+        starts = S2.indptr[:-1][has_neighbours]
+        # Luby's algorithm: an undecided node with a larger (random) weight than all its undecided neighbours is a root, its neighbours are excluded
+        weights = np.random.default_rng(0).permutation(n) + 1.0
+        state = np.where(isolated, -1, 0) # 1: root, -1: excluded, 0: undecided
+        while np.any(state == 0):
+            undecided_weights = np.where(state == 0, weights, 0.0)
+            neighbour_max = np.zeros(n)
+            if len(starts) > 0:
+                neighbour_max[has_neighbours] = np.maximum.reduceat(undecided_weights[S2.indices], starts)
+            roots = (state == 0) & (weights > neighbour_max)
+            state[roots] = 1
+            state[(state == 0) & (S2 @ roots.astype(float) > 0)] = -1
+        aggregates = np.full(n, -1, dtype=np.int64)
+        roots = np.flatnonzero(state == 1)
+        aggregates[roots] = np.arange(len(roots))
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        # pass 1: the strong neighbours of each root join its aggregate
+        from_root = state[rows] == 1
+        aggregates[indices[from_root]] = aggregates[rows[from_root]]
+        # pass 2: the remaining nodes join the aggregate of a neighbour
+        attach = (aggregates[rows] < 0) & ~isolated[rows] & (aggregates[indices] >= 0)
+        aggregates[rows[attach]] = aggregates[indices[attach]]
+        return aggregates
@@ -0,0 +1,143 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import uuid
+from pathlib import Path
+import numpy as np
+import torch
+from lizzy.simparams import ProcessParameters
+from lizzy.solver.timestep import as_numpy
+
+
+class Checkpoint:
+    """
+    Binary checkpoint of the state of a Solver, in a folder. The state of the solution (time, write-out schedule, step size control, fill state of the CVs, boundary conditions, last pressure field, counters of the TimeStepManager) is written to ``state.npz``. The write-out steps stored by the TimeStepManager only grow between checkpoints, so they are written to append-only ``.bin`` files: each checkpoint appends the rows added since the previous one, and its cost does not grow with the number of write-outs. The settings of the TimeStepManager (precision and keyframe interval) are saved with the state and restored on loading.
+
+    The state file is written to a temporary file and renamed, and the history files are synced before, so a checkpoint is replaced atomically: after a crash, the folder contains the last complete checkpoint. Rows of the history files past the lengths recorded in the state file are ignored and overwritten. The history files of a solution are named after a generation recorded in the state file: the first checkpoint of a new solution in a folder writes a new generation, so the checkpoint already in the folder stays valid until it is replaced, and its history files are removed after.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the checkpoint.
+    """
+    format_version = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.written = {} # number of rows of each history array in the files, as recorded by the last checkpoint
+        self.generation = None # suffix of the history files of the solution
+
+    @property
+    def state_path(self):
+        return self.path / "state.npz"
+
+    def history_path(self, name:str):
+        return self.path / f"{name.replace('/', '.')}.{self.generation}.bin"
+
+    def save(self, solver):
+        """
+        Writes the checkpoint of `solver`.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        new_generation = not self.written
+        if new_generation:
+            # the history files of a checkpoint already in the folder are not overwritten
+            self.generation = uuid.uuid4().hex[:12]
+        manager = solver.time_step_manager
+        history, manager_state = manager.to_arrays()
+        layout = {}
+        for name, array in history.items():
+            array = np.ascontiguousarray(array)
+            start = self.written.get(name, 0)
+            row_bytes = array.itemsize * int(np.prod(array.shape[1:]))
+            with open(self.history_path(name), "r+b" if start > 0 else "wb") as f:
+                f.seek(start * row_bytes)
+                f.truncate()
+                f.write(array[start:].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            layout[name] = (array.dtype.str, array.shape[1:], len(array))
+        CVs = solver.mesh.CVs
+        state = {"layout": np.array(json.dumps({"version": self.format_version, "generation": self.generation, "history": layout,
+                                                 "dtype": manager.dtype.str, "keyframe_interval": manager.keyframe_interval})),
+                 "n_nodes": np.array(solver.N_nodes),
+                 "mu": np.array(ProcessParameters.mu),
+                 "current_time": np.array(solver.current_time),
+                 "next_wo_time": np.array(solver.next_wo_time),
+                 "n_empty_cvs": np.array(solver.n_empty_cvs),
+                 "cvs_per_step": np.array(solver.cvs_per_step),
+                 "fill_time_error": np.array(solver.fill_time_error),
+                 "last_step": np.array(solver.last_step if solver.last_step is not None else [], dtype=float),
+                 "p": np.array([]) if solver.p is None else as_numpy(solver.p),
+                 "fill": CVs.fill,
+                 "free_surface": CVs.free_surface,
+                 "arrival_time": CVs.arrival_time,
+                 "dirichlet_idx": as_numpy(solver.bcs.dirichlet_idx),
+                 "dirichlet_vals": as_numpy(solver.bcs.dirichlet_vals),
+                 "p0_idx": as_numpy(solver.bcs.p0_idx)}
+        state.update({f"manager/{key}": value for key, value in manager_state.items()})
+        tmp_path = self.path / "state.npz.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+        self.written = {name: rows for name, (_, _, rows) in layout.items()}
+        if new_generation:
+            for path in self.path.glob("*.bin"):
+                if not path.name.endswith(f".{self.generation}.bin"):
+                    os.remove(path)
+
+    def load(self, solver):
+        """
+        Sets the state of `solver` from the checkpoint. The solver must be created with the same mesh and boundary conditions as the solver of the checkpoint. The precision and keyframe interval of its TimeStepManager are set to those of the checkpoint.
+        """
+        if not self.state_path.is_file():
+            raise FileNotFoundError(f"Checkpoint not found: {self.state_path}")
+        with np.load(self.state_path, allow_pickle=False) as f:
+            state = {name: f[name] for name in f.files}
+        layout = json.loads(str(state["layout"]))
+        if layout["version"] != self.format_version:
+            raise ValueError(f"Unsupported checkpoint version {layout['version']}: {self.path}")
+        if int(state["n_nodes"]) != solver.N_nodes:
+            raise ValueError(f"Checkpoint of a mesh with {int(state['n_nodes'])} nodes, the mesh of the solver has {solver.N_nodes} nodes: {self.path}")
+        if float(state["mu"]) != ProcessParameters.mu:
+            print(f"Warning: the checkpoint was written with mu={float(state['mu'])}, the solution continues with mu={ProcessParameters.mu}")
+        self.generation = layout["generation"]
+        history = {}
+        for name, (dtype, row_shape, rows) in layout["history"].items():
+            count = rows * int(np.prod(row_shape))
+            values = np.fromfile(self.history_path(name), dtype=dtype, count=count)
+            if len(values) < count:
+                raise ValueError(f"Incomplete checkpoint, {self.history_path(name)} is truncated")
+            history[name] = values.reshape(rows, *row_shape)
+        device = solver.device
+        solver.current_time = float(state["current_time"])
+        solver.next_wo_time = float(state["next_wo_time"])
+        solver.n_empty_cvs = int(state["n_empty_cvs"])
+        solver.cvs_per_step = int(state["cvs_per_step"])
+        solver.fill_time_error = float(state["fill_time_error"])
+        last_step = state["last_step"]
+        solver.last_step = (float(last_step[0]), int(last_step[1]), float(last_step[2])) if len(last_step) else None
+        solver.p = torch.from_numpy(state["p"]).to(device) if len(state["p"]) else None
+        CVs = solver.mesh.CVs
+        CVs.fill[:] = state["fill"]
+        CVs.free_surface[:] = state["free_surface"]
+        CVs.arrival_time[:] = state["arrival_time"]
+        solver.bcs.dirichlet_idx = torch.from_numpy(state["dirichlet_idx"]).to(device)
+        solver.bcs.dirichlet_vals = torch.from_numpy(state["dirichlet_vals"]).to(device)
+        solver.bcs.p0_idx = torch.from_numpy(state["p0_idx"]).to(device)
+        if solver.pressure_solver is not None:
+            # factorisations and preconditioners are set up again from the restored fill state
+            solver.pressure_solver.reset()
+        manager = solver.time_step_manager
+        manager.dtype = np.dtype(layout["dtype"])
+        manager.keyframe_interval = int(layout["keyframe_interval"])
+        manager.from_arrays(history, {key[len("manager/"):]: value for key, value in state.items() if key.startswith("manager/")})
+        self.written = {name: rows for name, (_, _, rows) in layout["history"].items()}
+
@@ -4,19 +4,151 @@
 #  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
+from dataclasses import dataclass
 import numpy as np
 import torch
 
-def Assembly(mesh, mu,device):
-    K_tri = torch.zeros(mesh.nodes.N, mesh.nodes.N,dtype=torch.double)
-    f = torch.zeros(mesh.nodes.N,dtype=torch.double)
 
-    for tri in mesh.triangles:
-        k_el = tri.grad_N.T @ tri.k @ tri.grad_N * tri.A * tri.h / mu
-        for i in range(3):
-            for j in range(3):
-                K_tri[tri.node_ids[i], tri.node_ids[j]] += k_el[i, j]
-                
-    return K_tri.to(device), f.to(device)
+@dataclass()
+class SparsityPattern:
+    """
+    CSR sparsity pattern of the global FE matrix, computed once from the element connectivity.
 
+    Attributes
+    ----------
+    N : int
+        Number of rows/columns of the global matrix (1 dof per node).
+    crow_indices : torch.Tensor
+        CSR row pointers, dimension (N+1,).
+    col_indices : torch.Tensor
+        CSR column indices, dimension (nnz,).
+    row_indices : torch.Tensor
+        Row index of every nonzero, dimension (nnz,). Same information as `crow_indices` in COO form.
+    diag_indices : torch.Tensor
+        Position in the nonzeros of the diagonal entry of every row, dimension (N,).
+    elem_to_nnz : torch.Tensor
+        Position in the nonzeros where each entry of each element matrix is scattered, dimension (n_el, 3, 3).
+    """
+    N : int
+    crow_indices : torch.Tensor
+    col_indices : torch.Tensor
+    row_indices : torch.Tensor
+    diag_indices : torch.Tensor
+    elem_to_nnz : torch.Tensor
 
+    @property
+    def nnz(self):
+        return len(self.col_indices)
+
+    @classmethod
+    def from_connectivity(cls, nodes_conn, N:int, device='cpu'):
+        """
+        Builds the pattern by sorting the (row, col) keys of all element entries. The diagonal is always included, so that every row has a diagonal entry even if the node does not belong to any element.
+
+        Parameters
+        ----------
+        nodes_conn : np.ndarray
+            Nodal connectivity table of the elements, dimension (n_el, 3).
+        N : int
+            Number of nodes in the mesh.
+        """
+        conn = np.asarray(nodes_conn, dtype=np.int64)
+        n_el, n_loc = conn.shape
+        rows = np.broadcast_to(conn[:, :, None], (n_el, n_loc, n_loc))
+        cols = np.broadcast_to(conn[:, None, :], (n_el, n_loc, n_loc))
+        elem_keys = (rows * N + cols).ravel()
+        diag_keys = np.arange(N, dtype=np.int64) * (N + 1)
+        keys, inverse = np.unique(np.concatenate((elem_keys, diag_keys)), return_inverse=True)
+        row_indices = keys // N
+        col_indices = keys % N
+        crow_indices = np.zeros(N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_indices, minlength=N), out=crow_indices[1:])
+        return cls(N=N,
+                   crow_indices=torch.from_numpy(crow_indices).to(device),
+                   col_indices=torch.from_numpy(col_indices).to(device),
+                   row_indices=torch.from_numpy(row_indices).to(device),
+                   diag_indices=torch.from_numpy(inverse[len(elem_keys):]).to(device),
+                   elem_to_nnz=torch.from_numpy(inverse[:len(elem_keys)].reshape(n_el, n_loc, n_loc)).to(device))
+
+    def to_arrays(self):
+        """
+        Returns the index arrays of the pattern as a dict of numpy arrays, e.g. to store them in the mesh cache.
+        """
+        return {name: getattr(self, name).cpu().numpy() for name in ("crow_indices", "col_indices", "row_indices", "diag_indices", "elem_to_nnz")}
+
+    @classmethod
+    def from_arrays(cls, arrays:dict, device='cpu'):
+        """
+        Creates the pattern from the arrays returned by `to_arrays`.
+        """
+        tensors = {name: torch.from_numpy(arrays[name]).to(device) for name in ("crow_indices", "col_indices", "row_indices", "diag_indices", "elem_to_nnz")}
+        return cls(N=len(arrays["crow_indices"]) - 1, **tensors)
+
+    def to_csr(self, values:torch.Tensor):
+        """
+        Creates a sparse CSR tensor with this pattern and the given nonzero values.
+        """
+        return torch.sparse_csr_tensor(self.crow_indices, self.col_indices, values, size=(self.N, self.N), check_invariants=False)
+
+
+def element_matrices(grad_N, k, A, h, mu):
+    """
+    Calculates all element matrices in one batched operation: k_el = grad_N^T @ k @ grad_N * A * h / mu
+
+    Parameters
+    ----------
+    grad_N : torch.Tensor
+        Stacked shape function gradients, dimension (n_el, 3, 3).
+    k : torch.Tensor
+        Stacked permeability tensors, dimension (n_el, 3, 3).
+    A : torch.Tensor
+        Element areas, dimension (n_el,).
+    h : torch.Tensor
+        Element thicknesses, dimension (n_el,).
+    mu : float
+        Dynamic viscosity of the fluid.
+
+    Returns
+    -------
+    k_el : torch.Tensor
+        Stacked element matrices, dimension (n_el, 3, 3).
+    """
+    k_el = torch.einsum('eji,ejk,ekl->eil', grad_N, k, grad_N)
+    return k_el * (A * h / mu)[:, None, None]
+
+
+def Assembly(mesh, mu, device, pattern:SparsityPattern = None):
+    """
+    Assembles the (singular) global FE matrix in sparse CSR format. All element matrices are calculated at once and scattered into the nonzeros of the global matrix through the element-to-nonzero map of the sparsity pattern.
+
+    Parameters
+    ----------
+    mesh : lizzy.Mesh
+        The mesh to assemble.
+    mu : float
+        Dynamic viscosity of the fluid.
+    device : str
+        Torch device where the matrix is stored.
+    pattern : SparsityPattern
+        Sparsity pattern of the global matrix. Computed from the mesh connectivity if not given.
+
+    Returns
+    -------
+    K : torch.Tensor
+        Global matrix in sparse CSR format, dimension (N,N).
+    f : torch.Tensor
+        Right-hand side vector, dimension (N,).
+    """
+    if pattern is None:
+        pattern = SparsityPattern.from_connectivity(mesh.triangles.nodes_conn_table, mesh.nodes.N, device)
+    triangles = mesh.triangles
+    grad_N = torch.tensor(triangles.grad_N, dtype=torch.double, device=device)
+    k = torch.tensor(triangles.k, dtype=torch.double, device=device)
+    A = torch.tensor(triangles.A, dtype=torch.double, device=device)
+    h = torch.tensor(triangles.h, dtype=torch.double, device=device)
+
+    k_el = element_matrices(grad_N, k, A, h, mu)
+    values = torch.zeros(pattern.nnz, dtype=torch.double, device=device)
+    values.index_add_(0, pattern.elem_to_nnz.flatten(), k_el.flatten())
+    f = torch.zeros(mesh.nodes.N, dtype=torch.double, device=device)
+    return pattern.to_csr(values), f
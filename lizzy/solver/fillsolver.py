@@ -10,43 +10,113 @@ import lizzy
 
 class FillSolver:
     all_fluxes_per_second = None
+    total_flux = 0.0
     @staticmethod
     def find_free_surface_cvs(CVs):
         """
-        Finds the control volumes that are on the flow front. These cvs have a fill factor < 1.
+        Finds the control volumes that are on the flow front. These cvs have a fill factor < 1 and at least one filled support CV, found by a segmented max of the fill factor over the support CVs. Updates the free surface flags of the CVs and returns the ids of the front CVs.
         """
-        active_cvs = []
-        for cv in CVs:
-            cv.free_surface = 0
-            if cv.fill < 1 <= torch.max(torch.tensor([c.fill for c in cv.support_CVs])):
-                cv.free_surface = 1
-                active_cvs.append(cv)
-        return active_cvs
+        fill = CVs.fill
+        indptr = CVs.support_indptr
+        has_support = np.diff(indptr) > 0
+        support_max_fill = np.zeros(CVs.N)
+        support_max_fill[has_support] = np.maximum.reduceat(fill[CVs.support_indices], indptr[:-1][has_support])
+        front = (fill < 1) & (support_max_fill >= 1)
+        CVs.free_surface[:] = front
+        return np.nonzero(front)[0]
 
+    @staticmethod
+    def update_free_surface_cvs(CVs, front_ids, filled_ids):
+        """
+        Incremental version of `find_free_surface_cvs`, after the CVs `filled_ids` have been filled: these leave the front and their support CVs that are not full join it. Only the neighbours of the newly filled CVs are examined.
+        """
+        CVs.free_surface[filled_ids] = 0
+        candidates = np.unique(CVs.support_of(filled_ids))
+        new_front = candidates[CVs.fill[candidates] < 1]
+        CVs.free_surface[new_front] = 1
+        return np.union1d(front_ids[CVs.fill[front_ids] < 1], new_front)
+
+
+    @staticmethod
+    def precalculate_flux_operator(CVs, triangles, device):
+        """
+        Returns the sparse operator that maps the stacked element velocities (flattened, n_tri*3) to the net volumetric flux per second entering each CV. Each (CV, support triangle) pair contributes the thickness times the sum of the inward length-weighted normals of its two CV lines.
+        """
+        n_dim = 3
+        weights = -np.einsum('pj,pjk->pk', CVs.lines_l, CVs.lines_n) * triangles.h[CVs.pairs_triangle][:, None]
+        rows = np.repeat(CVs.pairs_cv, n_dim)
+        cols = (n_dim * CVs.pairs_triangle[:, None] + np.arange(n_dim)).ravel()
+        operator = torch.sparse_coo_tensor(np.vstack((rows, cols)), weights.ravel(), size=(CVs.N, triangles.N * n_dim), dtype=torch.double)
+        return operator.coalesce().to_sparse_csr().to(device)
 
     @classmethod
-    def calculate_time_step(cls, active_cvs, v_array):
-        # calculate fluxes/s per each CV
-        cls.all_fluxes_per_second = []
-        for cv in active_cvs:
-            cv_fluxes_per_s = cv.CalculateVolFluxes(v_array)
-            cls.all_fluxes_per_second.append(cv_fluxes_per_s)
-
-        # calculate time step to fill one:
-        candidate_dts = []
-        for i, cv in enumerate(active_cvs):
-            if cls.all_fluxes_per_second[i] > 0:
-                dt = ((1.00-cv.fill)*cv.vol)/cls.all_fluxes_per_second[i]
-                candidate_dts.append(dt.reshape(1))
-        #np.array(candidate_dts)
-        #print(candidate_dts)
-        dt = torch.min(torch.cat(candidate_dts)).item()
+    def calculate_time_step(cls, CVs, active_ids, v_array, flux_operator, n_cvs=1):
+        """
+        Calculates the time step from the fluxes of the active CVs, given by the `flux_operator` of the mesh (see `precalculate_flux_operator`). With `n_cvs=1` (exact mode) the time step is the time to fill the first front CV. With `n_cvs>1` it is the time to fill the `n_cvs`-th front CV, so that several CVs are filled in one step; the volume that the earlier CVs receive in excess is redistributed by `fill_current_time_step`.
+        """
+        # calculate fluxes/s of all CVs with one sparse mat-vec, keep the active ones
+        all_fluxes = torch.mv(flux_operator, v_array.reshape(-1).to(torch.double))
+        cls.all_fluxes_per_second = all_fluxes.cpu().numpy()[active_ids]
+        cls.total_flux = float(np.sum(cls.all_fluxes_per_second))
+
+        # calculate the time steps to fill each front CV:
+        inflow = cls.all_fluxes_per_second > 0
+        candidate_dts = (1.00 - CVs.fill[active_ids][inflow]) * CVs.vol[active_ids][inflow] / cls.all_fluxes_per_second[inflow]
+        k = min(n_cvs, len(candidate_dts)) - 1
+        dt = float(np.partition(candidate_dts, k)[k])
         return dt
 
     @classmethod
-    def fill_current_time_step(cls, active_cvs, dt):
-        for i, cv in enumerate(active_cvs):
-            cv.fill = min(cv.fill + cls.all_fluxes_per_second[i]*dt / cv.vol, 1)
-        for cv in active_cvs:
-            if cv.fill >= (1-lizzy.ProcessParameters.fill_tolerance):
-                cv.fill = 1
\ No newline at end of file
+    def fill_current_time_step(cls, CVs, active_ids, dt, time=0.0):
+        """
+        Fills the active CVs with their fluxes over `dt` and returns the ids of the CVs filled in this time step. The volume exceeding the capacity of a CV (multi-CV steps only) is redistributed to its support CVs that are not full, see `redistribute_overflow`.
+        The arrival time of the filled CVs is recorded in `CVs.arrival_time`: `time` (the time at the start of the step) plus the time the CV took to fill within the step, or the end of the step for CVs filled by the fill tolerance or by redistributed volume.
+        """
+        vol = CVs.vol[active_ids]
+        fill_rate = cls.all_fluxes_per_second / vol
+        fill = CVs.fill[active_ids] + fill_rate*dt
+        overflow = np.maximum(fill - 1, 0) * vol
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_full = np.where(fill >= 1, (1 - CVs.fill[active_ids]) / fill_rate, dt)
+        fill = np.minimum(fill, 1)
+        fill[fill >= (1-lizzy.ProcessParameters.fill_tolerance)] = 1
+        CVs.fill[active_ids] = fill
+        filled = fill >= 1
+        filled_ids = active_ids[filled]
+        CVs.arrival_time[filled_ids] = time + np.minimum(t_full[filled], dt)
+        if np.any(overflow > 0):
+            overflowing = overflow > 0
+            received_ids = cls.redistribute_overflow(CVs, active_ids[overflowing], overflow[overflowing])
+            received_filled_ids = received_ids[CVs.fill[received_ids] >= 1]
+            CVs.arrival_time[np.setdiff1d(received_filled_ids, filled_ids)] = time + dt
+            filled_ids = np.union1d(filled_ids, received_filled_ids)
+        return filled_ids
+
+    @staticmethod
+    def redistribute_overflow(CVs, source_ids, volumes, max_passes=10):
+        """
+        Distributes the excess volumes of the CVs `source_ids` to their support CVs that are not full, in equal parts. A CV that overflows in turn passes its excess on in the next pass. Volume that finds no CV to go to (end of the filling) is discarded. Returns the ids of all CVs that received volume.
+        """
+        received_ids = []
+        for _ in range(max_passes):
+            counts = np.diff(CVs.support_indptr)[source_ids]
+            sources = np.repeat(np.arange(len(source_ids)), counts)
+            targets = CVs.support_of(source_ids)
+            open_target = CVs.fill[targets] < 1
+            sources, targets = sources[open_target], targets[open_target]
+            n_targets = np.bincount(sources, minlength=len(source_ids))
+            if len(targets) == 0:
+                break
+            received = np.zeros(CVs.N)
+            np.add.at(received, targets, volumes[sources] / n_targets[sources])
+            targets = np.unique(targets)
+            received_ids.append(targets)
+            fill = CVs.fill[targets] + received[targets] / CVs.vol[targets]
+            excess = np.maximum(fill - 1, 0) * CVs.vol[targets]
+            fill = np.minimum(fill, 1)
+            fill[fill >= (1-lizzy.ProcessParameters.fill_tolerance)] = 1
+            CVs.fill[targets] = fill
+            source_ids, volumes = targets[excess > 0], excess[excess > 0]
+            if len(source_ids) == 0:
+                break
+        return np.unique(np.concatenate(received_ids)) if received_ids else np.array([], dtype=np.int64)
@@ -7,12 +7,22 @@
 import numpy as np
 from enum import Enum, auto
 from lizzy.solver.builtin.direct_solvers import *
+from lizzy.solver.builtin.iter_solvers import pcg, JacobiPreconditioner, IncompleteCholeskyPreconditioner, AMGPreconditioner
+from lizzy.simparams import SolverParameters
 
 class SolverType(Enum):
     DIRECT_DENSE = auto()
     DIRECT_SPARSE = auto()
     DIRECT_DENSE_GPU = auto()
     DIRECT_SPARSE_GPU = auto()
+    DIRECT_SPARSE_REDUCED = auto()
+    ITERATIVE_PCG_JACOBI = auto()
+    ITERATIVE_PCG_ICHOL = auto()
+    ITERATIVE_PCG_AMG = auto()
+    DIRECT_SPARSE_INCREMENTAL = auto()
+    DIRECT_SPARSE_CACHED = auto()
+
+ITERATIVE_SOLVERS = (SolverType.ITERATIVE_PCG_JACOBI, SolverType.ITERATIVE_PCG_ICHOL, SolverType.ITERATIVE_PCG_AMG)
 
 class PressureSolver:
     @staticmethod
@@ -22,10 +32,10 @@ class PressureSolver:
 
         Parameters
         ----------
-        k : np.ndarray
-            Stiffness matrix with Dirichlet BCs applied by row/column method. Dimension (N,N) where N is the number of Dofs (1 per node)
-        f : np.ndarray
-            Right-hand side vector. Zeros (no source yet) with ones in Dirichlet nodes. Dimension (N,1)
+        k : torch.Tensor
+            Stiffness matrix in sparse CSR format, with Dirichlet BCs applied by symmetric elimination. Dimension (N,N) where N is the number of Dofs (1 per node)
+        f : torch.Tensor
+            Right-hand side vector, with Dirichlet values lifted. Dimension (N,)
         method : SolverType
             The solver type to be used. Default is SPARSE.
         """
@@ -40,24 +50,342 @@ class PressureSolver:
 
     @staticmethod
     def apply_bcs(k, f, bcs):
-        dev = bcs.dirichlet_vals.get_device()
-        dirichlet_idx_full = torch.cat((bcs.dirichlet_idx, bcs.p0_idx), axis=0)
-        dirichlet_vals_full = torch.cat((bcs.dirichlet_vals, torch.zeros( len(bcs.p0_idx),device=dev)), axis=0)
-
-        k_modified = torch.clone(k)
-        f_modified = torch.clone(f)
-
-        k_modified[dirichlet_idx_full, :] = 0
-        k_modified[dirichlet_idx_full,dirichlet_idx_full]=1
-        f_modified[dirichlet_idx_full] = dirichlet_vals_full
-        # apply bcs
-        # for i, node_id in enumerate(dirichlet_idx_full):
-        #     k_modified[node_id, :] = 0
-        #     k_modified[node_id, node_id] = 1
-        #     f_modified[node_id] = dirichlet_vals_full[i]
+        """
+        Applies the Dirichlet and p=0 constraints to the sparse system by symmetric elimination: the known values are lifted to the right-hand side, then the rows and columns of the constrained nodes are zeroed and their diagonal set to 1. The matrix is not cloned: the result shares the CSR structure of `k` and only the nonzero values are recomputed, so the cost is proportional to nnz. The constrained system is symmetric positive definite.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+
+        Returns
+        -------
+        k_modified : torch.Tensor
+            Constrained matrix in sparse CSR format, with the same sparsity pattern as `k`.
+        f_modified : torch.Tensor
+            Constrained right-hand side vector.
+        """
+        constrained, p_known, row_indices = PressureSolver._constraints(k, f, bcs)
+        crow_indices = k.crow_indices()
+        col_indices = k.col_indices()
+
+        # lift known values to the right-hand side
+        f_modified = f - torch.mv(k, p_known)
+        f_modified[constrained] = p_known[constrained]
+
+        # zero constrained rows and columns, with 1 on their diagonal
+        values = k.values()
+        eliminated = constrained[row_indices] | constrained[col_indices]
+        values_modified = torch.where(eliminated, (row_indices == col_indices).to(values.dtype), values)
+        k_modified = torch.sparse_csr_tensor(crow_indices, col_indices, values_modified, size=k.shape, check_invariants=False)
         return k_modified, f_modified
 
+    @staticmethod
+    def reduce_system(k, f, bcs):
+        """
+        Extracts the system of the free nodes only (filled and not Dirichlet), with the known values lifted to the right-hand side. The submatrix is built by masking the nonzeros of `k` and renumbering the free nodes, so it is symmetric positive definite as the system of `apply_bcs`, but its size scales with the filled region instead of the mesh.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+
+        Returns
+        -------
+        k_free : torch.Tensor
+            Matrix of the free nodes in sparse CSR format. Dimension (N_free,N_free).
+        f_free : torch.Tensor
+            Right-hand side of the free nodes. Dimension (N_free,)
+        free_idx : torch.Tensor
+            Indices of the free nodes in the full system.
+        p_known : torch.Tensor
+            Full pressure vector with the constrained values, zero in the free nodes. Dimension (N,)
+        """
+        constrained, p_known, row_indices = PressureSolver._constraints(k, f, bcs)
+        col_indices = k.col_indices()
+        free_idx = torch.nonzero(~constrained).flatten()
+        n_free = len(free_idx)
+        new_ids = torch.full_like(constrained, -1, dtype=torch.long)
+        new_ids[free_idx] = torch.arange(n_free, device=k.device)
+
+        keep = ~(constrained[row_indices] | constrained[col_indices])
+        free_rows = new_ids[row_indices[keep]]
+        free_cols = new_ids[col_indices[keep]]
+        crow_indices = torch.zeros(n_free + 1, dtype=torch.long, device=k.device)
+        crow_indices[1:] = torch.cumsum(torch.bincount(free_rows, minlength=n_free), 0)
+        k_free = torch.sparse_csr_tensor(crow_indices, free_cols, k.values()[keep], size=(n_free, n_free), check_invariants=False)
+        f_free = (f - torch.mv(k, p_known))[free_idx]
+        return k_free, f_free, free_idx, p_known
+
+    @staticmethod
+    def solve_reduced(k, f, bcs, method:SolverType = SolverType.DIRECT_SPARSE):
+        """
+        Solves the pressure only in the free nodes and scatters the result back into the full pressure vector.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+        method : SolverType
+            The solver type used for the reduced system. Default is SPARSE.
+        """
+        k_free, f_free, free_idx, p = PressureSolver.reduce_system(k, f, bcs)
+        if len(free_idx) > 0:
+            p[free_idx] = PressureSolver.solve(k_free, f_free, method)
+        return p
 
+    @staticmethod
+    def _constraints(k, f, bcs):
+        """
+        Returns the mask of constrained nodes, the full vector of known pressures and the row index of every nonzero of `k`.
+        """
+        N = k.shape[0]
+        dev = k.device
+        row_indices = torch.repeat_interleave(torch.arange(N, device=dev), torch.diff(k.crow_indices()))
+        constrained = torch.zeros(N, dtype=torch.bool, device=dev)
+        constrained[bcs.dirichlet_idx] = True
+        constrained[bcs.p0_idx] = True
+        p_known = torch.zeros(N, dtype=f.dtype, device=dev)
+        p_known[bcs.dirichlet_idx] = bcs.dirichlet_vals.to(f.dtype)
+        return constrained, p_known, row_indices
 
 
+class IterativePressureSolver:
+    """
+    Preconditioned conjugate gradient solver for the pressure, with state kept between time steps. Each step solves the reduced system of the free nodes, warm-started from the pressure of the previous step. The preconditioner is set up on the diagonally scaled system of the free nodes and reused for `SolverParameters.precond_rebuild_interval` steps: consecutive fill states differ by a few CVs only, so a slightly outdated preconditioner stays effective. Until it is set up again, it is applied to the nodes that were free at its set-up, and the nodes freed since are preconditioned by their diagonal.
+
+    Parameters
+    ----------
+    method : SolverType
+        One of ITERATIVE_PCG_JACOBI, ITERATIVE_PCG_ICHOL, ITERATIVE_PCG_AMG.
+
+    Attributes
+    ----------
+    stats : dict
+        Iteration statistics since the last reset: number of solves, total and maximum iterations, number of preconditioner set-ups and last relative residual.
+    """
+    def __init__(self, method:SolverType):
+        match method:
+            case SolverType.ITERATIVE_PCG_JACOBI:
+                self.preconditioner = JacobiPreconditioner()
+            case SolverType.ITERATIVE_PCG_ICHOL:
+                self.preconditioner = IncompleteCholeskyPreconditioner()
+            case SolverType.ITERATIVE_PCG_AMG:
+                self.preconditioner = AMGPreconditioner()
+            case _:
+                raise ValueError(f"Unknown iterative solver type: {method}")
+        self.method = method
+        self.reset()
+
+    def reset(self):
+        self.steps_since_setup = np.inf
+        self.setup_ids = None # position of each node in the system of the preconditioner, -1 if it was not free at the set-up
+        self.n_setup = 0
+        self.stats = {"solves": 0, "iterations": 0, "max_iterations": 0, "setups": 0, "residual": 0.0}
+
+    def solve(self, k, f, bcs, p_prev=None):
+        """
+        Solves the pressure for the current constraints.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+        p_prev : torch.Tensor
+            Pressure of the previous time step, used as initial guess. Dimension (N,)
+        """
+        k_free, f_free, free_idx, p = PressureSolver.reduce_system(k, f, bcs)
+        if len(free_idx) == 0:
+            return p
+        free = free_idx.cpu().numpy()
+        A = to_scipy_csr(k_free.cpu())
+        s = 1 / np.sqrt(A.diagonal())
+        if self.preconditioner.needs_setup and self.steps_since_setup >= SolverParameters.precond_rebuild_interval:
+            self.setup_preconditioner(A, free, k.shape[0])
+        self.steps_since_setup += 1
+
+        if self.setup_ids is None:
+            M = lambda r: s * s * r
+        else:
+            # the free nodes in the system of the preconditioner, and their positions in it
+            setup_ids = self.setup_ids[free]
+            in_setup = setup_ids >= 0
+            setup_ids = setup_ids[in_setup]
+            work = np.zeros(self.n_setup)
+            def M(r):
+                z = s * r
+                work[setup_ids] = z[in_setup]
+                z[in_setup] = self.preconditioner.apply(work)[setup_ids]
+                return s * z
+        x0 = np.zeros(len(free)) if p_prev is None else p_prev.cpu().numpy()[free]
+        x, n_iter, res = pcg(A, f_free.cpu().numpy(), x0, M, SolverParameters.iter_rtol, SolverParameters.iter_max)
+        if res > SolverParameters.iter_rtol:
+            print(f"\nWarning: {self.method.name} did not converge in {n_iter} iterations (relative residual {res:.2e})")
+
+        self.stats["solves"] += 1
+        self.stats["iterations"] += n_iter
+        self.stats["max_iterations"] = max(self.stats["max_iterations"], n_iter)
+        self.stats["residual"] = res
+        p[free_idx] = torch.from_numpy(x).to(p.device)
+        return p
+
+    def setup_preconditioner(self, A, free, N:int):
+        """
+        Sets up the preconditioner on the system `A` of the `free` nodes (among `N`) scaled to unit diagonal, and records the positions of the free nodes in it.
+        """
+        s = sp.diags(1 / np.sqrt(A.diagonal()))
+        self.preconditioner.setup((s @ A @ s).tocsr())
+        self.setup_ids = np.full(N, -1, dtype=np.int64)
+        self.setup_ids[free] = np.arange(len(free))
+        self.n_setup = len(free)
+        self.steps_since_setup = 0
+        self.stats["setups"] += 1
+
+    def report(self):
+        solves = max(self.stats["solves"], 1)
+        return (f"{self.method.name}: {self.stats['iterations']} iterations in {self.stats['solves']} solves "
+                f"(mean {self.stats['iterations'] / solves:.1f}, max {self.stats['max_iterations']}), "
+                f"{self.stats['setups']} preconditioner set-ups")
+
+
+class IncrementalPressureSolver:
+    """
+    Sparse direct solver that keeps one factorisation across time steps. When nodes become free (their CV is filled), the factorisation of the reference constrained system is not recomputed: the new free nodes S are coupled to it through a Schur complement, which is the Sherman-Morrison-Woodbury correction of the rank-2|S| change of the constrained matrix. With O the nodes already free in the reference system:
+
+        (K_SS - K_SO A_ref^-1 K_OS) p_S = b_S - K_SO A_ref^-1 b_O
+        p_O = A_ref^-1 (b_O - K_OS p_S)
+
+    The columns A_ref^-1 K_OS are computed once, when a node enters S. The system is factorised again when S grows beyond `SolverParameters.incremental_max_rank` nodes, reusing the ordering of a `CachedSparseLU`.
+
+    Attributes
+    ----------
+    stats : dict
+        Number of solves, factorisations and low-rank column updates since the last reset.
+    """
+    def __init__(self):
+        self.lu = CachedSparseLU()
+        self.reset()
+
+    def reset(self):
+        self.free_ref = None
+        self.update_idx = np.array([], dtype=np.int64)
+        self.W = None
+        self.stats = {"solves": 0, "factorisations": 0, "updates": 0}
+
+    def solve(self, k, f, bcs, p_prev=None):
+        """
+        Solves the pressure for the current constraints.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+        p_prev : torch.Tensor
+            Not used, accepted for interface compatibility with the iterative solvers.
+        """
+        constrained, p_known, _ = PressureSolver._constraints(k, f, bcs)
+        free = ~constrained.cpu().numpy()
+        p_known_np = p_known.cpu().numpy()
+        K = to_scipy_csr(k.cpu())
+
+        if self.free_ref is not None:
+            new_idx = np.setdiff1d(np.nonzero(free & ~self.free_ref)[0], self.update_idx)
+        # factorise again when a node of the reference system or an updated node becomes constrained, or when S is too large
+        if (self.free_ref is None or np.any(self.free_ref & ~free) or np.any(~free[self.update_idx])
+                or len(self.update_idx) + len(new_idx) > SolverParameters.incremental_max_rank):
+            self.factorise(k, f, bcs, free)
+        elif len(new_idx) > 0:
+            self.add_update_columns(K, new_idx)
+
+        # lifted right-hand side of the constrained system
+        b = f.cpu().numpy() - K @ p_known_np
+        b[~free] = p_known_np[~free]
+        S = self.update_idx
+        b_O = b.copy()
+        b_O[S] = 0
+        y = self.lu.solve(b_O)
+        if len(S) > 0:
+            K_SO = K[S] @ sp.diags(self.free_ref.astype(float))
+            schur = K[S][:, S].toarray() - K_SO @ self.W
+            p_S = np.linalg.solve(schur, b[S] - K_SO @ y)
+            y -= self.W @ p_S
+            y[S] = p_S
+        self.stats["solves"] += 1
+        return torch.from_numpy(y).to(k.device)
+
+    def factorise(self, k, f, bcs, free):
+        k_constrained, _ = PressureSolver.apply_bcs(k, f, bcs)
+        self.lu.factorise(k_constrained)
+        self.free_ref = free
+        self.update_idx = np.array([], dtype=np.int64)
+        self.W = np.zeros((len(free), 0))
+        self.stats["factorisations"] += 1
+
+    def add_update_columns(self, K, new_idx):
+        """
+        Adds the nodes `new_idx` to the updated set and computes their columns A_ref^-1 K_Oi.
+        """
+        K_O_new = (sp.diags(self.free_ref.astype(float)) @ K[:, new_idx]).toarray()
+        self.W = np.hstack((self.W, self.lu.solve(K_O_new)))
+        self.update_idx = np.concatenate((self.update_idx, new_idx))
+        self.stats["updates"] += len(new_idx)
+
+    def report(self):
+        return (f"{SolverType.DIRECT_SPARSE_INCREMENTAL.name}: {self.stats['factorisations']} factorisations for {self.stats['solves']} solves, "
+                f"{self.stats['updates']} low-rank node updates; " + self.lu.report())
+
+
+class CachedPressureSolver:
+    """
+    Sparse direct solver of the constrained system that computes the fill-reducing ordering and the permuted structure once per `Solver`. The constrained matrix returned by `PressureSolver.apply_bcs` keeps the sparsity pattern of the singular matrix at every step, so each step only runs the numeric factorisation.
+    """
+    def __init__(self):
+        self.lu = CachedSparseLU()
+        self.reset()
+
+    def reset(self):
+        self.stats = {"solves": 0}
+
+    def solve(self, k, f, bcs, p_prev=None):
+        """
+        Solves the pressure for the current constraints.
+
+        Parameters
+        ----------
+        k : torch.Tensor
+            Singular global matrix in sparse CSR format. Dimension (N,N).
+        f : torch.Tensor
+            Right-hand side vector. Dimension (N,)
+        bcs : lizzy.bcond.SolverBCs
+            The constraints to apply.
+        p_prev : torch.Tensor
+            Not used, accepted for interface compatibility with the iterative solvers.
+        """
+        k_constrained, f_constrained = PressureSolver.apply_bcs(k, f, bcs)
+        self.lu.factorise(k_constrained)
+        p = self.lu.solve(f_constrained.cpu().numpy())
+        self.stats["solves"] += 1
+        return torch.from_numpy(p).to(k.device)
 
+    def report(self):
+        return f"{SolverType.DIRECT_SPARSE_CACHED.name}: " + self.lu.report()
@@ -6,10 +6,13 @@
 
 import numpy as np
 import torch
+import copy
 import time
+from pathlib import Path
 from lizzy.solver import *
 from lizzy.bcond import SolverBCs
-from lizzy.simparams import ProcessParameters
+from lizzy.simparams import ProcessParameters, SolverParameters
+from lizzy.IO.cache import MeshCache
 
 class Solver:
     def __init__(self, mesh, bc_manager, solver_type=SolverType.DIRECT_SPARSE,device='cpu'):
@@ -23,7 +26,7 @@ class Solver:
         bc_manager : lizzy.bcond.BCManager
             The manager that contains all boundary conditions to be used for the solution.
         solver_type : lizzy.solver.SolverType
-            Currently implemented solvers are DIRECT_DENSE and DIRECT_SPARSE.
+            Currently implemented solvers are DIRECT_DENSE, DIRECT_SPARSE, DIRECT_SPARSE_REDUCED, DIRECT_SPARSE_INCREMENTAL and DIRECT_SPARSE_CACHED, and the preconditioned conjugate gradient solvers ITERATIVE_PCG_JACOBI, ITERATIVE_PCG_ICHOL and ITERATIVE_PCG_AMG. DIRECT_SPARSE_REDUCED solves only the system of the filled nodes at each step. DIRECT_SPARSE_INCREMENTAL updates one factorisation as nodes are filled instead of factorising at every step. DIRECT_SPARSE_CACHED computes the fill-reducing ordering once and only the numeric factorisation at each step. The iterative solvers are configured with ``SolverParameters``.
         """
         self.mesh = mesh
         self.bc_manager = bc_manager
@@ -32,15 +35,41 @@ class Solver:
         self.N_nodes = mesh.nodes.N
         self.K_sing = None
         self.f_orig = None
+        self.pattern = None
+        self.flux_operator = None # operator giving the fluxes of the CVs from the element velocities, see "FillSolver.precalculate_flux_operator"
         self.current_time = 0
         self.n_empty_cvs = np.inf
         self.next_wo_time = ProcessParameters.wo_delta_time
         self.device = device
+        self.p = None
+        self.cvs_per_step = 1
+        self.fill_time_error = 0.0
+        self.last_step = None # (dt, n_filled, total flux) of the last time step
+        self.pressure_solver = None # pressure solvers that keep a state between time steps
+        self.writer = None # StreamWriter writing the write-out steps during the solution
+        self.checkpoint = None # Checkpoint of the solution, see "save_checkpoint"
+        self.checkpoint_path = SolverParameters.checkpoint_path # folder of the checkpoints written by "solve", None to disable them
+        self.last_checkpoint_time = time.time()
+        self.time_step_manager = TimeStepManager(mesh.nodes.N, mesh.triangles.N)
+        self.pressure_solver = self.create_pressure_solver(solver_type)
         # assembly is calculated at instantiation of the solver
         self.perform_fe_precalcs(device)
         # when a solver is instantiated, all simulation variables are initialised
         self.initialise_new_solution(device)
 
+    @staticmethod
+    def create_pressure_solver(solver_type):
+        """
+        Returns the pressure solver keeping a state between time steps of `solver_type`, or None for the solver types without state.
+        """
+        if solver_type in ITERATIVE_SOLVERS:
+            return IterativePressureSolver(solver_type)
+        if solver_type == SolverType.DIRECT_SPARSE_INCREMENTAL:
+            return IncrementalPressureSolver()
+        if solver_type == SolverType.DIRECT_SPARSE_CACHED:
+            return CachedPressureSolver()
+        return None
+
     def perform_fe_precalcs(self,device='cpu'):
         
         # preprocess mesh
@@ -49,10 +78,43 @@ class Solver:
         # warn if no process parameters were assigned:
         if not ProcessParameters.has_been_assigned:
             print(f"Warning: Process parameters were not assigned. Running with default values: mu={ProcessParameters.mu}, wo_delta_time={ProcessParameters.wo_delta_time}")
-        # assemble FE global matrix (singular)
-        self.K_sing, self.f_orig = fe.Assembly(self.mesh, ProcessParameters.mu,device)
+        cache_key = None
+        cached = None
+        if self.mesh.cache_key is not None:
+            cache_key = MeshCache.key("fe", self.mesh.cache_key, float(ProcessParameters.mu))
+            cached = MeshCache.load(cache_key)
+        if cached is not None:
+            self.load_fe_precalcs(cached[0], device)
+            return
+        # assemble FE global matrix (singular), in sparse format
+        self.pattern = fe.SparsityPattern.from_connectivity(self.mesh.triangles.nodes_conn_table, self.N_nodes, device)
+        self.K_sing, self.f_orig = fe.Assembly(self.mesh, ProcessParameters.mu, device, self.pattern)
         # precalculate vectorised stuff for velocity
         VelocitySolver.precalculate_B(self.mesh.triangles,device)
+        # precalculate the operator giving the fluxes of all CVs from the element velocities
+        self.flux_operator = FillSolver.precalculate_flux_operator(self.mesh.CVs, self.mesh.triangles, device)
+        if cache_key is not None:
+            arrays = self.pattern.to_arrays()
+            arrays["K_values"] = self.K_sing.values().cpu().numpy()
+            arrays["B"] = VelocitySolver.B.cpu().numpy()
+            flux_operator = self.flux_operator
+            arrays["flux_crow_indices"] = flux_operator.crow_indices().cpu().numpy()
+            arrays["flux_col_indices"] = flux_operator.col_indices().cpu().numpy()
+            arrays["flux_values"] = flux_operator.values().cpu().numpy()
+            MeshCache.store(cache_key, arrays)
+
+    def load_fe_precalcs(self, arrays, device):
+        """
+        Sets the global matrix, the velocity operator and the flux operator from the arrays stored in the MeshCache by `perform_fe_precalcs`.
+        """
+        self.pattern = fe.SparsityPattern.from_arrays(arrays, device)
+        self.K_sing = self.pattern.to_csr(torch.from_numpy(arrays["K_values"]).to(device))
+        self.f_orig = torch.zeros(self.N_nodes, dtype=torch.double, device=device)
+        VelocitySolver.B = torch.from_numpy(arrays["B"]).to(device)
+        VelocitySolver.nodes_conn = self.mesh.triangles.nodes_conn_table
+        n_cv = len(arrays["flux_crow_indices"]) - 1
+        self.flux_operator = torch.sparse_csr_tensor(torch.from_numpy(arrays["flux_crow_indices"]), torch.from_numpy(arrays["flux_col_indices"]),
+                                                     torch.from_numpy(arrays["flux_values"]), size=(n_cv, 3 * self.mesh.triangles.N), dtype=torch.double).to(device)
 
     def update_dirichlet_bcs(self,device):
         """
@@ -76,16 +138,16 @@ class Solver:
         """
         Complementary to "update_dirichlet_bcs()", this updates the indices of all nodes with a fill factor < 1.0. These will be uses to assign an internal condition p=0.
         """
-        empty_node_ids = [cv.id for cv in self.mesh.CVs if cv.fill < 1]  # nodes with fill factor < 1
-        self.bcs.p0_idx = torch.tensor(empty_node_ids).to(device)
+        empty_node_ids = np.nonzero(self.mesh.CVs.fill < 1)[0]  # nodes with fill factor < 1
+        self.bcs.p0_idx = torch.from_numpy(empty_node_ids).to(device)
 
     def fill_initial_cvs(self):
         """
         Must be called AFTER calling "update_dirichlet_bcs()"
         """
-        initial_cvs = self.mesh.CVs[self.bcs.dirichlet_idx.to('cpu').numpy()]
-        for cv in initial_cvs:
-            cv.fill = 1.0
+        inlet_ids = self.bcs.dirichlet_idx.cpu().numpy()
+        self.mesh.CVs.fill[inlet_ids] = 1.0
+        self.mesh.CVs.arrival_time[inlet_ids] = 0.0
 
     def update_n_empty_cvs(self):
         """
@@ -99,29 +161,169 @@ class Solver:
         """
         self.current_time = 0
         self.next_wo_time = ProcessParameters.wo_delta_time
+        self.p = None
+        self.cvs_per_step = 1
+        self.fill_time_error = 0.0
+        self.last_step = None # (dt, n_filled, total flux) of the last time step
+        if self.pressure_solver is not None:
+            self.pressure_solver.reset()
         self.bcs = SolverBCs()
         self.mesh.EmptyCVs()
         self.update_dirichlet_bcs(device)
         self.fill_initial_cvs()
         self.update_empty_nodes_idx(device)
         self.update_n_empty_cvs()
-        TimeStepManager.reset()
-        TimeStepManager.save_initial_timestep(self.mesh, self.bcs)
+        self.time_step_manager.reset()
+        self.time_step_manager.save_initial_timestep(self.mesh, self.bcs)
+        self.checkpoint = None
+        self.last_checkpoint_time = time.time()
+
+    def save_checkpoint(self, path):
+        """
+        Writes a checkpoint of the current state of the solution in the folder `path`, see ``Checkpoint``. Successive checkpoints of a solution in the same folder only append the write-out steps stored since the previous one.
+        """
+        if self.checkpoint is None or self.checkpoint.path != Path(path):
+            self.checkpoint = Checkpoint(path)
+        self.checkpoint.save(self)
+        self.last_checkpoint_time = time.time()
+
+    def load_checkpoint(self, path):
+        """
+        Restores the state of the solution from the checkpoint in the folder `path`. The solver must be created with the same mesh, boundary conditions and process parameters as the solver that wrote the checkpoint.
+        """
+        self.checkpoint = Checkpoint(path)
+        self.checkpoint.load(self)
+        self.last_checkpoint_time = time.time()
+
+    def resume(self, path, log="on"):
+        """
+        Restores the state of the solution from the checkpoint in the folder `path` and continues the solution. Returns the solution, as ``solve``.
+        """
+        self.load_checkpoint(path)
+        return self.solve(log)
+
+    def fork(self, bc_manager=None, checkpoint_path=None):
+        """
+        Returns a new Solver that continues the current solution independently (a branch), for example to compare scenarios from the same partially filled state. The branch shares with this solver the mesh geometry and pre-processed arrays, the assembled global matrix ``K_sing`` and the velocity and flux operators, which are not modified by the solution. It has its own copy of the state of the solution: the CV fill state, time, boundary conditions, last pressure field and stored write-out steps. Each branch is continued with ``solve``, and its solution contains the steps stored before the fork. If the steps are spilled to disk, the branch stores them in its own files.
+
+        Parameters
+        ----------
+        bc_manager : lizzy.bcond.BCManager
+            Boundary conditions of the branch, e.g. with an inlet opened at the time of the fork. The CVs of new inlets are filled at the current time (default: the boundary conditions of this solver).
+        checkpoint_path : str
+            Folder of the checkpoints written by ``solve`` for the branch, which must differ from the folder of this solver. If None, the branch writes no checkpoints (default: None).
+
+        Returns
+        -------
+        branch : Solver
+            The new solver.
+        """
+        if checkpoint_path is not None and self.checkpoint_path is not None and Path(checkpoint_path) == Path(self.checkpoint_path):
+            raise ValueError(f"The checkpoints of a branch must be written in another folder than those of the forked solver: {checkpoint_path}")
+        branch = copy.copy(self)
+        branch.mesh = self.mesh.fork()
+        branch.bcs = SolverBCs()
+        branch.bcs.dirichlet_idx = self.bcs.dirichlet_idx.clone()
+        branch.bcs.dirichlet_vals = self.bcs.dirichlet_vals.clone()
+        branch.bcs.p0_idx = self.bcs.p0_idx.clone()
+        branch.p = self.p.clone() if isinstance(self.p, torch.Tensor) else copy.copy(self.p)
+        branch.pressure_solver = self.create_pressure_solver(self.solver_type)
+        branch.writer = None
+        branch.checkpoint = None
+        branch.checkpoint_path = checkpoint_path
+        manager = self.time_step_manager
+        branch.time_step_manager = TimeStepManager(manager.n_nodes, manager.n_elements, manager.dtype, manager.spill_directory, manager.keyframe_interval)
+        branch.time_step_manager.from_arrays(*manager.to_arrays())
+        if bc_manager is not None:
+            branch.bc_manager = bc_manager
+            branch.update_dirichlet_bcs(branch.device)
+            CVs = branch.mesh.CVs
+            inlet_ids = branch.bcs.dirichlet_idx.cpu().numpy()
+            opened_ids = inlet_ids[CVs.fill[inlet_ids] < 1]
+            CVs.fill[opened_ids] = 1.0
+            CVs.arrival_time[opened_ids] = branch.current_time
+            branch.update_empty_nodes_idx(branch.device)
+            branch.update_n_empty_cvs()
+        return branch
+
+    def attach_writer(self, writer):
+        """
+        Attaches a StreamWriter to the solver: the write-out time steps are then written while the solution runs. Pass None to detach it.
+
+        Parameters
+        ----------
+        writer : lizzy.StreamWriter
+            The writer of the results.
+        """
+        self.writer = writer
+
+    def solve_pressure(self):
+        """
+        Solves the pressure field for the current fill state, with the method selected by the solver type.
+        """
+        match self.solver_type:
+            case SolverType.DIRECT_SPARSE_REDUCED:
+                p = PressureSolver.solve_reduced(self.K_sing, self.f_orig, self.bcs, SolverType.DIRECT_SPARSE)
+            case _ if self.pressure_solver is not None:
+                p = self.pressure_solver.solve(self.K_sing, self.f_orig, self.bcs, self.p)
+            case _:
+                k, f = PressureSolver.apply_bcs(self.K_sing, self.f_orig, self.bcs)
+                p = PressureSolver.solve(k, f, self.solver_type)
+        self.p = p
+        return p
+
+    def update_cvs_per_step(self):
+        """
+        Step size control of the multi-CV time stepping, called once the fluxes of the current time step are known. The fluxes of a step are those of the fill state at its start, so each step integrates the total flow rate Q with an explicit Euler rule. The local error of the last step, 0.5*dt*|dQ|/Q in time, is estimated from the change of Q between the last step and the current one. Filling the same CVs one at a time would reduce this error by the number of CVs filled in the step: the difference, accumulated in "fill_time_error", is the estimated error with respect to the exact one-CV mode. The number of CVs per step is halved when the relative error of a step exceeds the tolerance and doubled when it is well below it.
+        """
+        if self.last_step is None:
+            return
+        dt, n_filled, q_old = self.last_step
+        q_new = FillSolver.total_flux
+        if n_filled == 0 or q_new <= 0:
+            # steps shortened to a write-out time without filling any CV carry no information on the step size
+            return
+        error = 0.5 * abs(q_new - q_old) / q_new * (1 - 1 / max(n_filled, 1))
+        self.fill_time_error += error * dt
+        if error > SolverParameters.fill_time_tol:
+            self.cvs_per_step = max(self.cvs_per_step // 2, 1)
+        elif error < 0.25 * SolverParameters.fill_time_tol:
+            self.cvs_per_step = min(self.cvs_per_step * 2, SolverParameters.max_cvs_per_step)
+
+    def solve(self, log="on", end_time=None):
+        """
+        Runs the filling simulation from the current state until all CVs are filled, or until `end_time`. Returns the solution: the write-out time steps stored since ``initialise_new_solution``.
 
-    def solve(self, log="on"):
+        Parameters
+        ----------
+        log : str
+            "on" to print the fill time and the number of empty CVs at each time step (default: "on").
+        end_time : float
+            If not None, the solution stops at this time, which is written out. Calling ``solve`` again continues the solution, and ``fork`` can branch it (default: None).
+        """
         solve_time_start = time.time()
         print("SOLVE STARTED for mesh with {} elements".format(self.mesh.triangles.N))
-        while self.n_empty_cvs > 0:
+        # Find active cvs on the free surface. After the first step, the front is updated around the CVs filled in each step
+        active_ids = FillSolver.find_free_surface_cvs(self.mesh.CVs)
+        if self.writer is not None:
+            self.writer.open()
+            # the steps already stored: the initial one, or those restored from a checkpoint
+            for k in range(self.time_step_manager.n_write_out):
+                step = self.time_step_manager.get_step(k)
+                self.writer.write_step(step["time"], step["p"], step["fill_factor"], step["free_surface"], step["v"])
+        while self.n_empty_cvs > 0 and (end_time is None or self.current_time < end_time):
             write_out = False
             # Solve pressure field
-            k, f = PressureSolver.apply_bcs(self.K_sing, self.f_orig, self.bcs)
-            p = PressureSolver.solve(k, f, self.solver_type)
+            p = self.solve_pressure()
             # calculate velocity field
             v_array = VelocitySolver.calculate_elem_velocities(p, ProcessParameters.mu)
-            # Find active cvs on the free surface
-            active_cvs = FillSolver.find_free_surface_cvs(self.mesh.CVs)
             # Calculate current time step for filling active cvs
-            dt = FillSolver.calculate_time_step(active_cvs, v_array)
+            n_cvs = self.cvs_per_step if SolverParameters.multi_cv_stepping else 1
+            dt = FillSolver.calculate_time_step(self.mesh.CVs, active_ids, v_array, self.flux_operator, n_cvs)
+            if SolverParameters.multi_cv_stepping:
+                self.update_cvs_per_step()
+            if end_time is not None and self.current_time + dt >= end_time:
+                dt = end_time - self.current_time
             # if dt passes a scheduled write-out time, force dt to match the write-out time and flag the step for write-out
             if ProcessParameters.wo_delta_time > 0.0:
                 if self.current_time + dt > self.next_wo_time:
@@ -130,23 +332,45 @@ class Solver:
                     write_out = True
             else:
                 write_out = True
+            # the step reaching the end time (if not shortened to a write-out time) is written out
+            reached_end = end_time is not None and self.current_time + dt >= end_time
+            if reached_end:
+                write_out = True
+                while 0.0 < ProcessParameters.wo_delta_time and self.next_wo_time <= end_time:
+                    self.next_wo_time += ProcessParameters.wo_delta_time
             # Fill active cvs
-            FillSolver.fill_current_time_step(active_cvs, dt)
+            filled_ids = FillSolver.fill_current_time_step(self.mesh.CVs, active_ids, dt, self.current_time)
+            self.last_step = (dt, len(filled_ids), FillSolver.total_flux)
             # Update the filling time
-            self.current_time += dt
-            # save time step results
-            TimeStepManager.save_timestep(self.current_time, dt, p, v_array, [cv.fill for cv in self.mesh.CVs], [cv.free_surface for cv in self.mesh.CVs], write_out)
+            self.current_time = end_time if reached_end else self.current_time + dt
             # update the empty nodes for next step
             self.update_empty_nodes_idx(self.device)
-            # Print number of empty cvs
             self.update_n_empty_cvs()
+            # save time step results, the last step is always written out
+            write_out = write_out or self.n_empty_cvs == 0
+            self.time_step_manager.save_timestep(self.current_time, dt, p, v_array, self.mesh.CVs.fill, self.mesh.CVs.free_surface, write_out)
+            if self.writer is not None and write_out:
+                self.writer.write_step(self.current_time, p, self.mesh.CVs.fill, self.mesh.CVs.free_surface, v_array)
+            # update the free surface for next step
+            active_ids = FillSolver.update_free_surface_cvs(self.mesh.CVs, active_ids, filled_ids)
+            # Print number of empty cvs
             if log == "on":
                 print("\rFill time: {:.5f}".format(self.current_time) + ", Empty CVs: {:4}".format(self.n_empty_cvs), end='')
+            if self.checkpoint_path is not None and time.time() - self.last_checkpoint_time >= SolverParameters.checkpoint_interval:
+                self.save_checkpoint(self.checkpoint_path)
 
-        solution = TimeStepManager.pack_solution()
+        if self.writer is not None:
+            self.writer.write_field("ArrivalTime", self.mesh.CVs.arrival_time)
+            self.writer.close()
+        solution = self.time_step_manager.pack_solution()
+        solution["arrival_time"] = self.mesh.CVs.arrival_time.copy()
         # good night and good luck
         solve_time_end = time.time()
         total_solve_time = solve_time_end - solve_time_start
         print("\nSOLVE COMPLETED in {:.2f} seconds".format(total_solve_time))
+        if self.pressure_solver is not None:
+            print(self.pressure_solver.report())
+        if SolverParameters.multi_cv_stepping and log == "on" and self.current_time > 0:
+            print("Multi-CV stepping: estimated fill time error {:.4g} ({:.3%} of the fill time)".format(self.fill_time_error, self.fill_time_error / self.current_time))
         return solution
     
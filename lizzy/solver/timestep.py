@@ -4,70 +4,377 @@
 #  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 #  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
-from dataclasses import dataclass
+import os
+import shutil
+import tempfile
 import numpy as np
+import torch
+from lizzy.simparams import SolverParameters
 
-@dataclass()
-class TimeStep:
-        index : int
-        time : float
-        dt : float
-        P : any
-        V : any
-        fill_factor : any
-        flow_front : any
-        write_out : bool
 
-class TimeStepManager:
-    time_steps = []
-    time_step_count = 0
+def as_numpy(values):
+    """
+    Returns a field given as array, list or torch tensor as a numpy array.
+    """
+    if isinstance(values, torch.Tensor):
+        return values.detach().cpu().numpy()
+    return np.asarray(values)
+
+
+class DeltaSeries:
+    """
+    Sequence of snapshots of a nodal field, stored as keyframes (full copies) every `keyframe_interval` snapshots and in between as sparse deltas: the indices and new values of the nodes that changed since the previous snapshot. Between write-outs only the CVs near the flow front change their fill factor and free surface flag, so the storage scales with the number of changes instead of the number of nodes.
 
-    @classmethod
-    def save_timestep(cls, time, dt, P, v_array, fill_factor, flow_front, write_out):
+    Snapshots are reconstructed on demand from the last keyframe. Indexing with an int returns a snapshot (N,), indexing with a slice returns an array of snapshots and ``np.asarray`` returns all snapshots. Consecutive snapshots are reconstructed incrementally, so iterating over the series costs one delta per snapshot.
 
-        
-        if(v_array.shape[1]==3):
-            v_full = v_array
+    Parameters
+    ----------
+    n : int
+        Number of values of a snapshot.
+    dtype : dtype
+        Type of the values.
+    keyframe_interval : int
+        Number of snapshots between two keyframes.
+    new_array : callable
+        Function (name, shape, dtype) returning a new uninitialised array, used for the storage (default: np.empty).
+    release : callable
+        Function called with the arrays replaced when the storage grows (default: None).
+    name : str
+        Name of the field, prefix of the names of the storage arrays.
+    """
+    def __init__(self, n:int, dtype, keyframe_interval:int, new_array=None, release=None, name:str = "series"):
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.name = name
+        self._new_array = new_array or (lambda _, shape, dtype: np.empty(shape, dtype=dtype))
+        self._release = release
+        self.n_snapshots = 0
+        self.keyframes = np.empty((0, n), dtype=self.dtype)
+        self.indices = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=self.dtype)
+        # the delta of snapshot k is indices[offsets[k]:offsets[k+1]]
+        self.offsets = [0]
+        self.current = np.zeros(n, dtype=self.dtype)
+        self._cursor = None
+
+    def append(self, values):
+        """
+        Appends a snapshot. The values are copied.
+        """
+        values = np.asarray(values).astype(self.dtype, copy=False)
+        k = self.n_snapshots
+        if k % self.keyframe_interval == 0:
+            i = k // self.keyframe_interval
+            if i == len(self.keyframes):
+                self.keyframes = self._grow(self.keyframes, "keyframes")
+            self.keyframes[i] = values
+            changed = np.empty(0, dtype=np.int64)
         else:
-            v3_nul = np.zeros((np.size(v_array,0), 1))
-            v_full = np.hstack((v_array, v3_nul))
-        timestep = TimeStep(cls.time_step_count, time, dt, P, v_full, np.clip([float(f) for f in fill_factor], 0, 1), flow_front, write_out)
-        cls.time_steps.append(timestep)
-        cls.time_step_count += 1
-
-    @classmethod
-    def get_write_out_steps(cls):
-        return [step for step in cls.time_steps if step.write_out == True]
-
-    @classmethod
-    def save_initial_timestep(cls, mesh, bcs):
-        time_0 = 0
-        p_0 = [0] * mesh.nodes.N
-        fill_factor_0 = [0] * mesh.nodes.N
-        flow_front_0 = [0] * mesh.nodes.N
-        for i, val in enumerate(bcs.dirichlet_idx):
-            p_0[val] = bcs.dirichlet_vals[i]
-            fill_factor_0[val] = 1
-            flow_front_0[val] = 1
+            changed = np.flatnonzero(values != self.current)
+        start, end = self.offsets[-1], self.offsets[-1] + len(changed)
+        while end > len(self.indices):
+            self.indices = self._grow(self.indices, "indices")
+            self.values = self._grow(self.values, "values")
+        self.indices[start:end] = changed
+        self.values[start:end] = values[changed]
+        self.offsets.append(end)
+        self.current[:] = values
+        self.n_snapshots += 1
+
+    def snapshot(self, k:int):
+        """
+        Returns a copy of the k-th snapshot.
+        """
+        if k < 0:
+            k += self.n_snapshots
+        if not 0 <= k < self.n_snapshots:
+            raise IndexError(f"snapshot {k} out of range for {self.n_snapshots} snapshots")
+        if k == self.n_snapshots - 1:
+            return self.current.copy()
+        keyframe = k // self.keyframe_interval
+        if self._cursor is not None and self._cursor[0] // self.keyframe_interval == keyframe and self._cursor[0] <= k:
+            start, state = self._cursor
+        else:
+            start, state = keyframe * self.keyframe_interval, np.array(self.keyframes[keyframe])
+        for j in range(start + 1, k + 1):
+            delta = slice(self.offsets[j], self.offsets[j + 1])
+            state[self.indices[delta]] = self.values[delta]
+        self._cursor = (k, state)
+        return state.copy()
+
+    @property
+    def shape(self):
+        return (self.n_snapshots, self.n)
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nbytes(self):
+        """
+        Size in bytes of the stored keyframes and deltas.
+        """
+        n_keyframes = -(-self.n_snapshots // self.keyframe_interval)
+        n_changes = self.offsets[-1]
+        return n_keyframes * self.n * self.dtype.itemsize + n_changes * (self.indices.itemsize + self.values.itemsize)
+
+    def __len__(self):
+        return self.n_snapshots
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            snapshots = [self.snapshot(k) for k in range(*key.indices(self.n_snapshots))]
+            return np.stack(snapshots) if snapshots else np.empty((0, self.n), dtype=self.dtype)
+        return self.snapshot(int(key))
+
+    def __iter__(self):
+        for k in range(self.n_snapshots):
+            yield self.snapshot(k)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def copy(self):
+        """
+        Returns an independent copy of the series, stored in memory.
+        """
+        series = DeltaSeries(self.n, self.dtype, self.keyframe_interval, name=self.name)
+        series.from_arrays(*self.to_arrays())
+        return series
+
+    def to_arrays(self):
+        """
+        Returns the series as two dicts of arrays: the history (keyframes, deltas and their offsets), whose arrays only grow by appending as snapshots are appended, and the state (the last snapshot and the number of snapshots).
+        """
+        n_keyframes = -(-self.n_snapshots // self.keyframe_interval)
+        n_changes = self.offsets[-1]
+        history = {"keyframes": self.keyframes[:n_keyframes],
+                   "indices": self.indices[:n_changes],
+                   "values": self.values[:n_changes],
+                   "offsets": np.array(self.offsets, dtype=np.int64)}
+        state = {"current": self.current.copy(),
+                 "n_snapshots": np.array(self.n_snapshots)}
+        return history, state
+
+    def from_arrays(self, history:dict, state:dict):
+        """
+        Sets the series from the arrays of `to_arrays`.
+        """
+        self.keyframes = self._new_array(f"{self.name}_keyframes", (max(len(history["keyframes"]), 4), self.n), self.dtype)
+        self.keyframes[:len(history["keyframes"])] = history["keyframes"]
+        capacity = max(len(history["indices"]), self.keyframe_interval)
+        self.indices = self._new_array(f"{self.name}_indices", (capacity,), np.int64)
+        self.values = self._new_array(f"{self.name}_values", (capacity,), self.dtype)
+        self.indices[:len(history["indices"])] = history["indices"]
+        self.values[:len(history["values"])] = history["values"]
+        self.offsets = [int(offset) for offset in history["offsets"]]
+        self.current[:] = state["current"]
+        self.n_snapshots = int(state["n_snapshots"])
+        self._cursor = None
+
+    def _grow(self, array, kind):
+        capacity = max(2 * len(array), self.keyframe_interval if kind != "keyframes" else 4)
+        grown = self._new_array(f"{self.name}_{kind}", (capacity, *array.shape[1:]), array.dtype)
+        grown[:len(array)] = array
+        if self._release is not None:
+            self._release(array)
+        return grown
+
+
+class TimeStepManager:
+    """
+    Stores the write-out time steps of a solution. The steps that are not written out are only counted. The pressure and velocity of each step are stored in one preallocated array with a row per write-out step, whose capacity is doubled when it is full, so the memory scales with the number of write-outs. The fill factor and free surface, which only change near the flow front between two steps, are stored as keyframes and sparse deltas (see `DeltaSeries`). The arrays can be spilled to disk (memory-mapped files), to keep in memory only the pages in use.
+
+    Parameters
+    ----------
+    n_nodes : int
+        Number of nodes of the mesh.
+    n_elements : int
+        Number of elements of the mesh.
+    dtype : str
+        Precision of the stored pressure, velocity and fill factor, "float64" or "float32" (default: ``SolverParameters.results_dtype``).
+    spill_directory : str
+        Directory of the memory-mapped files, or None to keep the arrays in memory (default: ``SolverParameters.results_spill_directory``).
+    keyframe_interval : int
+        Number of write-out steps between two full copies of the fill factor and free surface (default: ``SolverParameters.results_keyframe_interval``).
+
+    Attributes
+    ----------
+    time_step_count : int
+        Number of time steps saved, written out or not.
+    n_write_out : int
+        Number of write-out time steps stored.
+    """
+    initial_capacity = 16
+
+    def __init__(self, n_nodes:int, n_elements:int, dtype:str = None, spill_directory:str = None, keyframe_interval:int = None):
+        self.n_nodes = n_nodes
+        self.n_elements = n_elements
+        self.dtype = np.dtype(dtype or SolverParameters.results_dtype)
+        self.spill_directory = spill_directory if spill_directory is not None else SolverParameters.results_spill_directory
+        self.keyframe_interval = keyframe_interval or SolverParameters.results_keyframe_interval
+        self.time_step_count = 0
+        self.n_write_out = 0
+        self.capacity = 0
+        self.arrays = {}
+        self._spill_path = None
+        self.series = self.new_series()
+
+    def field_specs(self):
+        """
+        Returns the (shape of a step, dtype) of each stored field.
+        """
+        return {"index": ((), np.int64),
+                "time": ((), np.float64),
+                "dt": ((), np.float64),
+                "p": ((self.n_nodes,), self.dtype),
+                "v": ((self.n_elements, 3), self.dtype)}
+
+    def new_series(self):
+        """
+        Returns the empty delta-encoded series of the fill factor and free surface.
+        """
+        return {"fill_factor": DeltaSeries(self.n_nodes, self.dtype, self.keyframe_interval, self.new_array, self.release, "fill_factor"),
+                "free_surface": DeltaSeries(self.n_nodes, np.int8, self.keyframe_interval, self.new_array, self.release, "free_surface")}
+
+    def new_array(self, name:str, shape:tuple, dtype):
+        """
+        Returns a new uninitialised array, memory-mapped to the file "name_{shape[0]}.npy" if the steps are spilled to disk.
+        """
+        if self.spill_directory is not None and self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix="lizzy-steps-", dir=self.spill_directory)
+        if self._spill_path is not None:
+            return np.lib.format.open_memmap(f"{self._spill_path}/{name}_{shape[0]}.npy", mode="w+", dtype=dtype, shape=shape)
+        return np.empty(shape, dtype=dtype)
+
+    @staticmethod
+    def release(array):
+        """
+        Removes the file of a memory-mapped array that was replaced.
+        """
+        if isinstance(array, np.memmap):
+            try:
+                os.remove(array.filename)
+            except OSError:
+                pass
+
+    def allocate(self, capacity:int):
+        """
+        Allocates the arrays for `capacity` write-out steps, keeping the steps already stored.
+        """
+        arrays = {}
+        for name, (shape, dtype) in self.field_specs().items():
+            array = self.new_array(name, (capacity, *shape), dtype)
+            if name in self.arrays:
+                array[:self.n_write_out] = self.arrays[name][:self.n_write_out]
+            arrays[name] = array
+        old_arrays, self.arrays = self.arrays, arrays
+        self.capacity = capacity
+        for array in old_arrays.values():
+            self.release(array)
+
+    def save_timestep(self, time, dt, P, v_array, fill_factor, flow_front, write_out):
+        """
+        Saves a time step. Only write-out steps are stored, the last step of a solution must be saved as write-out.
+        """
+        if write_out:
+            if self.n_write_out == self.capacity:
+                self.allocate(max(2 * self.capacity, self.initial_capacity))
+            k = self.n_write_out
+            arrays = self.arrays
+            arrays["index"][k] = self.time_step_count
+            arrays["time"][k] = time
+            arrays["dt"][k] = dt
+            arrays["p"][k] = as_numpy(P)
+            v_array = as_numpy(v_array)
+            arrays["v"][k, :, :v_array.shape[1]] = v_array
+            arrays["v"][k, :, v_array.shape[1]:] = 0
+            self.series["fill_factor"].append(np.clip(as_numpy(fill_factor), 0, 1))
+            self.series["free_surface"].append(as_numpy(flow_front))
+            self.n_write_out += 1
+        self.time_step_count += 1
+
+    def save_initial_timestep(self, mesh, bcs):
+        p_0 = np.zeros(mesh.nodes.N)
+        fill_factor_0 = np.zeros(mesh.nodes.N)
+        flow_front_0 = np.zeros(mesh.nodes.N, dtype=np.int8)
+        dirichlet_idx = as_numpy(bcs.dirichlet_idx)
+        p_0[dirichlet_idx] = as_numpy(bcs.dirichlet_vals)
+        fill_factor_0[dirichlet_idx] = 1
+        flow_front_0[dirichlet_idx] = 1
         v_0 = np.zeros((mesh.triangles.N, 2))
-        cls.save_timestep(time_0, 0, p_0, v_0, fill_factor_0, flow_front_0, True)
-
-    @classmethod
-    def pack_solution(cls):
-        # flag the last time step as write-out:
-        cls.time_steps[-1].write_out = True
-        # populate solution with write-out time steps:
-        wo_time_steps = cls.get_write_out_steps()
-        solution = {"time_steps" : len(wo_time_steps),
-                    "p" : [step.P for step in wo_time_steps],
-                    "v" : [step.V.tolist() for step in wo_time_steps],
-                    "time" : [step.time for step in wo_time_steps],
-                    "fill_factor" : [step.fill_factor for step in wo_time_steps],
-                    "free_surface" : [step.flow_front for step in wo_time_steps],
+        self.save_timestep(0, 0, p_0, v_0, fill_factor_0, flow_front_0, True)
+
+    def get_step(self, k:int) -> dict:
+        """
+        Returns the fields of the k-th write-out step: views of the stored arrays, and the reconstructed fill factor and free surface.
+        """
+        step = {name: array[k] for name, array in self.arrays.items()}
+        step.update({name: series[k] for name, series in self.series.items()})
+        return step
+
+    def pack_solution(self, copy:bool = True) -> dict:
+        """
+        Returns the solution: the number of write-out steps and the arrays of the write-out steps, with one row per step. The fill factor and free surface are `DeltaSeries`, indexed like the arrays: a step is reconstructed when it is accessed.
+
+        Parameters
+        ----------
+        copy : bool
+            If True, the solution owns its arrays, copied in memory. If False, the arrays are views of the stored arrays (memory-mapped if the steps are spilled to disk) and the series are those of the manager: they are modified by a continued or new solution (default: True).
+        """
+        n = self.n_write_out
+        solution = {"time_steps" : n,
+                    "p" : self.arrays["p"][:n],
+                    "v" : self.arrays["v"][:n],
+                    "time" : self.arrays["time"][:n],
+                    "fill_factor" : self.series["fill_factor"],
+                    "free_surface" : self.series["free_surface"],
                     }
+        if copy:
+            solution.update({key: np.array(solution[key]) for key in ("p", "v", "time")})
+            solution.update({key: solution[key].copy() for key in ("fill_factor", "free_surface")})
         return solution
 
-    @classmethod
-    def reset(cls):
-        cls.time_steps = []
-        cls.time_step_count = 0
\ No newline at end of file
+    def to_arrays(self):
+        """
+        Returns the stored steps as two dicts of arrays: the history, whose arrays only grow by appending rows as steps are saved, and the state (the step counters and the current fill factor and free surface). Used to write checkpoints.
+        """
+        n = self.n_write_out
+        history = {name: self.arrays[name][:n] if name in self.arrays else np.empty((0, *shape), dtype=dtype)
+                   for name, (shape, dtype) in self.field_specs().items()}
+        state = {"time_step_count": np.array(self.time_step_count), "n_write_out": np.array(n)}
+        for name, series in self.series.items():
+            series_history, series_state = series.to_arrays()
+            history.update({f"{name}/{key}": value for key, value in series_history.items()})
+            state.update({f"{name}/{key}": value for key, value in series_state.items()})
+        return history, state
+
+    def from_arrays(self, history:dict, state:dict):
+        """
+        Sets the stored steps from the arrays of `to_arrays`, replacing the current ones.
+        """
+        self.reset()
+        n = int(state["n_write_out"])
+        self.allocate(max(n, self.initial_capacity))
+        for name in self.field_specs():
+            self.arrays[name][:n] = history[name]
+        self.n_write_out = n
+        self.time_step_count = int(state["time_step_count"])
+        for name, series in self.series.items():
+            prefix = f"{name}/"
+            series.from_arrays({key[len(prefix):]: value for key, value in history.items() if key.startswith(prefix)},
+                               {key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)})
+
+    def reset(self):
+        self.time_step_count = 0
+        self.n_write_out = 0
+        self.capacity = 0
+        self.arrays = {}
+        if self._spill_path is not None:
+            # the files of a previous solution may still be mapped by its arrays, they are removed if possible
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+        self.series = self.new_series()
@@ -14,12 +14,8 @@ class VelocitySolver:
     @classmethod
     def precalculate_B(cls, triangles,device):
 
-        b_ncol = triangles[0].grad_N.shape[1]
-        cls.B = torch.empty((len(triangles), 3, b_ncol), dtype=torch.double).to(device)
+        cls.B = torch.tensor(np.einsum('nji,njk->nik', triangles.k, triangles.grad_N), dtype=torch.double).to(device)
 
-        for i in range(len(triangles)):
-            cls.B[i] =  torch.tensor(triangles[i].k.T @ triangles[i].grad_N).to(device)
-        
         cls.nodes_conn = triangles.nodes_conn_table
 
     @classmethod
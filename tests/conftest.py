@@ -0,0 +1,37 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import pytest
+
+@pytest.fixture()
+def build_solver():
+    """
+    Returns a function building a Solver of a rectangular mesh, filled from its left edge at 1 bar, with a single material and mu=0.1.
+    """
+    def build(mesh_path="tests/test_meshes/Rect_1M_64elem.msh", wo_delta_time=100, solver_type=liz.SolverType.DIRECT_SPARSE, mesh_reader=None):
+        mesh_reader = mesh_reader or liz.Reader(mesh_path)
+        liz.ProcessParameters.assign(mu=0.1, wo_delta_time=wo_delta_time)
+        liz.MaterialManager.add_material('domain', liz.PorousMaterial(1E-10, 1E-10, 1E-10, 0.5, 1.0))
+        mesh = liz.Mesh(mesh_reader)
+        bc_manager = liz.BCManager()
+        bc_manager.add_inlet(liz.Inlet('left_edge', 1E+05))
+        return liz.Solver(mesh, bc_manager, solver_type)
+    return build
+
+@pytest.fixture()
+def solver(build_solver):
+    return build_solver()
+
+@pytest.fixture(autouse=True)
+def mesh_cache(tmp_path):
+    """
+    Redirects the mesh cache to a temporary folder, so that the tests never read or write the cache of the user.
+    """
+    directory = liz.MeshCache.directory
+    liz.MeshCache.assign(directory=tmp_path / "cache")
+    yield
+    liz.MeshCache.assign(directory=directory)
@@ -0,0 +1,46 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import pytest
+from lizzy.solver import fem as fe
+
+mu = 0.1
+
+@pytest.fixture()
+def mesh():
+    mesh_reader = liz.Reader("tests/test_meshes/Rect_1M_64elem.msh")
+    material_1 = liz.PorousMaterial(1E-10, 3E-11, 1E-10, 0.5, 2.0)
+    liz.MaterialManager.add_material('domain', material_1, liz.Rosette((1, 1, 0)))
+    mesh = liz.Mesh(mesh_reader)
+    mesh.preprocess()
+    return mesh
+
+def test_sparse_assembly_matches_element_loop(mesh: liz.Mesh):
+    K, f = fe.Assembly(mesh, mu, 'cpu')
+    K_ref = np.zeros((mesh.nodes.N, mesh.nodes.N))
+    for tri in mesh.triangles:
+        k_el = tri.grad_N.T @ tri.k @ tri.grad_N * tri.A * tri.h / mu
+        K_ref[np.ix_(tri.node_ids, tri.node_ids)] += k_el
+    assert np.allclose(K.to_dense().numpy(), K_ref, rtol=1e-12, atol=1e-24)
+    assert not f.any()
+
+def test_sparsity_pattern(mesh: liz.Mesh):
+    pattern = fe.SparsityPattern.from_connectivity(mesh.triangles.nodes_conn_table, mesh.nodes.N)
+    rows = pattern.row_indices.numpy()
+    cols = pattern.col_indices.numpy()
+    # diagonal map points to diagonal entries, one per row
+    assert np.array_equal(rows[pattern.diag_indices.numpy()], np.arange(mesh.nodes.N))
+    assert np.array_equal(cols[pattern.diag_indices.numpy()], np.arange(mesh.nodes.N))
+    # element map points to the right (row, col) entries
+    conn = np.asarray(mesh.triangles.nodes_conn_table)
+    elem_to_nnz = pattern.elem_to_nnz.numpy()
+    assert np.array_equal(rows[elem_to_nnz], np.broadcast_to(conn[:, :, None], elem_to_nnz.shape))
+    assert np.array_equal(cols[elem_to_nnz], np.broadcast_to(conn[:, None, :], elem_to_nnz.shape))
+    # pattern is symmetric
+    keys = set(zip(rows, cols))
+    assert all((c, r) in keys for r, c in keys)
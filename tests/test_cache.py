@@ -0,0 +1,67 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import torch
+import pytest
+
+@pytest.fixture()
+def cache(tmp_path):
+    directory, enabled, max_size, code_version = liz.MeshCache.directory, liz.MeshCache.enabled, liz.MeshCache.max_size, liz.MeshCache.code_version
+    liz.MeshCache.assign(directory=tmp_path, enabled=True)
+    yield liz.MeshCache
+    liz.MeshCache.assign(directory=directory, enabled=enabled, max_size=max_size, code_version=code_version)
+
+@pytest.fixture()
+def build_reader_solver(build_solver):
+    def build():
+        mesh_reader = liz.Reader("tests/test_meshes/Rect_1M_64elem.msh")
+        return mesh_reader, build_solver(mesh_reader=mesh_reader)
+    return build
+
+def test_warm_start(cache, build_reader_solver):
+    reader_cold, solver_cold = build_reader_solver()
+    flux_cold = solver_cold.flux_operator.to_dense()
+    assert reader_cold.cached_arrays is None
+    # mesh, pre-processing and FE operators
+    assert len(cache.entries()) == 3
+    reader_warm, solver_warm = build_reader_solver()
+    assert reader_warm.cached_arrays is not None
+    mesh_cold, mesh_warm = solver_cold.mesh, solver_warm.mesh
+    assert np.array_equal(mesh_warm.triangles.nodes_conn_table, mesh_cold.triangles.nodes_conn_table)
+    assert np.array_equal(mesh_warm.CVs.vol, mesh_cold.CVs.vol)
+    assert np.array_equal(mesh_warm.triangles[5].k, mesh_cold.triangles[5].k)
+    assert [n.id for n in mesh_warm.CVs[7].support_CVs] == [n.id for n in mesh_cold.CVs[7].support_CVs]
+    assert torch.equal(solver_warm.K_sing.to_dense(), solver_cold.K_sing.to_dense())
+    assert torch.equal(solver_warm.flux_operator.to_dense(), flux_cold)
+    # a different material is a new pre-processing entry
+    liz.MaterialManager.add_material('domain', liz.PorousMaterial(2E-10, 1E-10, 1E-10, 0.5, 1.0))
+    mesh = liz.Mesh(liz.Reader("tests/test_meshes/Rect_1M_64elem.msh"))
+    mesh.preprocess()
+    assert len(cache.entries()) == 4
+    assert not np.array_equal(mesh.triangles.k, mesh_cold.triangles.k)
+
+def test_eviction(cache, build_reader_solver):
+    build_reader_solver()
+    sizes = [size for _, size, _ in cache.entries()]
+    cache.assign(max_size=sum(sizes) - 1)
+    cache.evict()
+    assert len(cache.entries()) == len(sizes) - 1
+
+def test_code_version(cache, build_reader_solver):
+    build_reader_solver()
+    # entries written by another version of the code are not reused
+    cache.assign(code_version="other")
+    mesh_reader, _ = build_reader_solver()
+    assert mesh_reader.cached_arrays is None
+    assert len(cache.entries()) == 6
+
+def test_opt_out(cache, build_reader_solver):
+    cache.assign(enabled=False)
+    mesh_reader, _ = build_reader_solver()
+    assert mesh_reader.cache_key is None
+    assert cache.entries() == []
@@ -0,0 +1,124 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import pytest
+
+def test_checkpoint_resume(build_solver, tmp_path, monkeypatch):
+    solver = build_solver()
+    reference = solver.solve(log="off")
+    n_steps = solver.time_step_manager.time_step_count
+    # the solution is interrupted after the checkpoint of the 10th write-out
+    save_checkpoint = liz.Solver.save_checkpoint
+    def save_and_interrupt(self, path):
+        save_checkpoint(self, path)
+        if self.time_step_manager.n_write_out == 10:
+            raise RuntimeError("interrupted")
+    monkeypatch.setattr(liz.Solver, "save_checkpoint", save_and_interrupt)
+    solver.checkpoint_path = tmp_path
+    try:
+        liz.SolverParameters.assign(checkpoint_interval=0)
+        solver.initialise_new_solution(solver.device)
+        with pytest.raises(RuntimeError, match="interrupted"):
+            solver.solve(log="off")
+    finally:
+        liz.SolverParameters.assign(checkpoint_interval=300.0)
+    monkeypatch.undo()
+    solver = build_solver()
+    solution = solver.resume(tmp_path, log="off")
+    assert solver.time_step_manager.time_step_count == n_steps
+    assert solution["time_steps"] == reference["time_steps"]
+    assert np.allclose(solution["time"], reference["time"], rtol=1e-12)
+    assert np.allclose(solution["p"], reference["p"], rtol=1e-10, atol=1e-6)
+    assert np.array_equal(solution["fill_factor"], reference["fill_factor"])
+    assert np.array_equal(solution["free_surface"], reference["free_surface"])
+    assert np.allclose(solution["arrival_time"], reference["arrival_time"], rtol=1e-12)
+
+def test_checkpoint_replace(build_solver, tmp_path, monkeypatch):
+    try:
+        liz.SolverParameters.assign(results_dtype="float32", results_keyframe_interval=4)
+        solver = build_solver()
+    finally:
+        liz.SolverParameters.assign(results_dtype="float64", results_keyframe_interval=64)
+    partial = solver.solve(log="off", end_time=1000)
+    fill_factor = np.asarray(partial["fill_factor"])
+    solver.save_checkpoint(tmp_path)
+    # the settings of the TimeStepManager are restored from the checkpoint
+    restored = build_solver()
+    restored.load_checkpoint(tmp_path)
+    manager = restored.time_step_manager
+    assert manager.dtype == np.float32 and manager.keyframe_interval == 4
+    assert np.array_equal(manager.pack_solution()["fill_factor"], fill_factor)
+    # a failed checkpoint of another solution leaves the previous checkpoint valid
+    other = build_solver()
+    other.solve(log="off", end_time=500)
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr("lizzy.solver.checkpoint.os.replace", fail)
+    with pytest.raises(OSError, match="disk full"):
+        other.save_checkpoint(tmp_path)
+    monkeypatch.undo()
+    restored = build_solver()
+    restored.load_checkpoint(tmp_path)
+    assert restored.current_time == 1000
+    assert np.array_equal(restored.time_step_manager.pack_solution()["fill_factor"], fill_factor)
+    # once replaced, the history files of the previous checkpoint are removed
+    other.save_checkpoint(tmp_path)
+    assert all(path.name.endswith(f".{other.checkpoint.generation}.bin") for path in tmp_path.glob("*.bin"))
+    restored = build_solver()
+    restored.load_checkpoint(tmp_path)
+    assert restored.current_time == 500
+
+def test_fork(build_solver):
+    solver = build_solver()
+    reference = solver.solve(log="off")
+    solver.initialise_new_solution(solver.device)
+    partial = solver.solve(log="off", end_time=1000)
+    assert partial["time"][-1] == 1000 and np.any(solver.mesh.CVs.fill < 1)
+    branch = solver.fork()
+    bc_manager = liz.BCManager()
+    bc_manager.add_inlet(liz.Inlet('left_edge', 1E+05))
+    bc_manager.add_inlet(liz.Inlet('right_edge', 1E+05))
+    branch_two_inlets = solver.fork(bc_manager)
+    # the branches share the assembled operators and the mesh geometry, not the fill state
+    assert branch.K_sing is solver.K_sing and branch.mesh.nodes is solver.mesh.nodes
+    assert branch.mesh.CVs.fill is not solver.mesh.CVs.fill
+    solution = branch.solve(log="off")
+    solution_two_inlets = branch_two_inlets.solve(log="off")
+    # the state of the forked solver is unchanged
+    assert solver.current_time == 1000 and np.any(solver.mesh.CVs.fill < 1)
+    assert np.allclose(solution["time"], reference["time"], rtol=1e-12)
+    assert np.array_equal(solution["fill_factor"], reference["fill_factor"])
+    assert solution_two_inlets["time"][-1] < reference["time"][-1]
+    right_edge = solver.mesh.boundaries['right_edge']
+    assert np.all(solution_two_inlets["arrival_time"][right_edge] == 1000)
+    assert np.array_equal(solution_two_inlets["time"][:partial["time_steps"]], partial["time"])
+
+def test_fork_checkpoints(build_solver, tmp_path):
+    try:
+        liz.SolverParameters.assign(checkpoint_path=tmp_path / "parent", checkpoint_interval=0, results_spill_directory=tmp_path)
+        solver = build_solver()
+        solver.solve(log="off", end_time=1000)
+        with pytest.raises(ValueError):
+            solver.fork(checkpoint_path=tmp_path / "parent")
+        assert solver.fork().checkpoint_path is None
+        bc_manager = liz.BCManager()
+        bc_manager.add_inlet(liz.Inlet('left_edge', 1E+05))
+        bc_manager.add_inlet(liz.Inlet('right_edge', 1E+05))
+        branch = solver.fork(bc_manager, checkpoint_path=tmp_path / "branch")
+        branch_solution = branch.solve(log="off")
+        solution = solver.solve(log="off")
+        assert branch.time_step_manager._spill_path != solver.time_step_manager._spill_path
+    finally:
+        liz.SolverParameters.assign(checkpoint_path=None, checkpoint_interval=300.0, results_spill_directory=None)
+    # each solution is resumed from its own checkpoint
+    for path, reference in ((tmp_path / "parent", solution), (tmp_path / "branch", branch_solution)):
+        resumed = build_solver().resume(path, log="off")
+        assert np.array_equal(resumed["time"], reference["time"])
+        assert np.array_equal(resumed["fill_factor"], reference["fill_factor"])
+        assert np.array_equal(resumed["arrival_time"], reference["arrival_time"])
+    assert branch_solution["time"][-1] < solution["time"][-1]
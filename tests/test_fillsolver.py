@@ -0,0 +1,100 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import torch
+import pytest
+from lizzy.solver import FillSolver
+
+@pytest.fixture()
+def mesh():
+    mesh_reader = liz.Reader("tests/test_meshes/Rect_1M_64elem.msh")
+    material_1 = liz.PorousMaterial(1E-10, 1E-10, 1E-10, 0.5, 1.0)
+    liz.MaterialManager.add_material('domain', material_1)
+    mesh = liz.Mesh(mesh_reader)
+    mesh.preprocess()
+    return mesh
+
+def test_support_adjacency(mesh: liz.Mesh):
+    for cv in mesh.CVs:
+        support_ids = mesh.CVs.support_of([cv.id])
+        assert support_ids.tolist() == [c.id for c in cv.support_CVs]
+        assert cv.id not in support_ids
+
+def test_free_surface_incremental(mesh: liz.Mesh):
+    CVs = mesh.CVs
+    rng = np.random.default_rng(0)
+    CVs.fill[mesh.boundaries['left_edge']] = 1
+    front_ids = FillSolver.find_free_surface_cvs(CVs)
+    while len(front_ids) > 0:
+        # fill a random subset of the front
+        filled_ids = front_ids[rng.random(len(front_ids)) < 0.3]
+        CVs.fill[filled_ids] = 1
+        front_ids = FillSolver.update_free_surface_cvs(CVs, front_ids, filled_ids)
+        free_surface = CVs.free_surface.copy()
+        assert np.array_equal(front_ids, FillSolver.find_free_surface_cvs(CVs))
+        assert np.array_equal(free_surface, CVs.free_surface)
+    assert np.all(CVs.fill == 1)
+
+def test_flux_operator(mesh: liz.Mesh):
+    flux_operator = FillSolver.precalculate_flux_operator(mesh.CVs, mesh.triangles, 'cpu')
+    v_array = torch.tensor(np.random.default_rng(0).random((mesh.triangles.N, 3)) - 0.5)
+    fluxes = torch.mv(flux_operator, v_array.reshape(-1))
+    for cv in mesh.CVs:
+        assert torch.isclose(fluxes[cv.id], cv.CalculateVolFluxes(v_array), rtol=1e-12, atol=1e-15)
+
+def test_flux_operator_per_solver(build_solver):
+    solver = build_solver()
+    flux_operator = solver.flux_operator.to_dense()
+    # a solver of another mesh has its own operator
+    other = build_solver("tests/test_meshes/Rect_1M_256elem.msh")
+    assert other.flux_operator.shape[0] == other.mesh.CVs.N != solver.mesh.CVs.N
+    assert torch.equal(solver.flux_operator.to_dense(), flux_operator)
+
+def test_multi_cv_stepping(build_solver):
+    solver = build_solver("tests/test_meshes/Rect_1M_1024elem.msh")
+    mesh = solver.mesh
+    solution_exact = solver.solve(log="off")
+    n_steps_exact = solver.time_step_manager.time_step_count
+    try:
+        liz.SolverParameters.assign(multi_cv_stepping=True, fill_time_tol=0.01)
+        solver.initialise_new_solution(solver.device)
+        solution_multi = solver.solve(log="off")
+        n_steps_multi = solver.time_step_manager.time_step_count
+    finally:
+        liz.SolverParameters.assign(multi_cv_stepping=False)
+    assert n_steps_multi < n_steps_exact / 2
+    fill_time_diff = abs(solution_multi["time"][-1] - solution_exact["time"][-1])
+    assert fill_time_diff < 2 * solver.fill_time_error
+    assert fill_time_diff < 0.01 * solution_exact["time"][-1]
+    assert np.all(mesh.CVs.fill == 1)
+
+def test_multi_cv_stepping_no_step(build_solver, capsys):
+    solver = build_solver()
+    try:
+        liz.SolverParameters.assign(multi_cv_stepping=True)
+        # the solution ends before the first time step
+        solution = solver.solve(end_time=0)
+    finally:
+        liz.SolverParameters.assign(multi_cv_stepping=False)
+    assert solution["time_steps"] == 1
+    assert "fill time error" not in capsys.readouterr().out
+
+def test_arrival_time(build_solver):
+    solver = build_solver(wo_delta_time=np.inf)
+    mesh = solver.mesh
+    solution = solver.solve(log="off")
+    arrival_time = solution["arrival_time"]
+    # only the initial and final states are stored
+    assert solution["time_steps"] == 2
+    assert np.all(np.isfinite(arrival_time))
+    assert np.all(arrival_time[mesh.boundaries['left_edge']] == 0)
+    assert arrival_time.max() == pytest.approx(solution["time"][-1])
+    # 1D flow: the arrival time grows with the distance from the inlet
+    x, inverse = np.unique(mesh.nodes.XYZ[:, 0].round(9), return_inverse=True)
+    mean_arrival_time = np.bincount(inverse, arrival_time) / np.bincount(inverse)
+    assert np.all(np.diff(mean_arrival_time) > 0)
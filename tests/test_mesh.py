@@ -0,0 +1,107 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import pytest
+from lizzy.cvmesh import entities as ent
+from lizzy.cvmesh.collections import lazy_list
+
+@pytest.fixture()
+def mesh():
+    mesh_reader = liz.Reader("tests/test_meshes/Rect_1M_64elem.msh")
+    return liz.Mesh(mesh_reader)
+
+def test_entities_created_on_access(mesh: liz.Mesh):
+    assert mesh.triangles.n_created == 0 and mesh.nodes.n_created == 0 and mesh.lines.n_created == 0
+    tri = mesh.triangles[5]
+    assert mesh.triangles.n_created == 1 and mesh.nodes.n_created == 3 and mesh.lines.n_created == 0
+    assert mesh.triangles[5] is tri
+    assert [node.id for node in tri.nodes] == tri.node_ids
+    assert all(tri in node.triangles for node in tri.nodes)
+    assert all(set(line.nodes) <= set(tri.nodes) for line in tri.lines)
+
+def test_lazy_list_requires_create():
+    class items(lazy_list):
+        pass
+    # a list that cannot create its items fails when it is built, not on access
+    with pytest.raises(TypeError):
+        items([])
+
+def test_triangle_geometry_arrays(mesh: liz.Mesh):
+    for tri in mesh.triangles:
+        x = np.array([node.coords for node in tri.nodes])
+        J = np.array([x[1] - x[0], x[2] - x[0]]).T
+        assert np.allclose(tri.grad_N, (ent.Triangle.dNdxi @ np.linalg.pinv(J)).T, rtol=1e-12, atol=1e-12)
+        assert np.isclose(tri.A, 0.5 * np.linalg.norm(np.cross(J[:, 0], J[:, 1])), rtol=1e-12)
+        assert np.allclose(tri.centroid, x.mean(0))
+        # shape function gradients of a linear triangle reproduce the in-plane coordinates
+        assert np.allclose(tri.grad_N @ x, np.diag([1, 1, 0]), atol=1e-12)
+
+def test_unique_lines(mesh: liz.Mesh):
+    lines = mesh.lines
+    conn = mesh.triangles.nodes_conn_table
+    # each triangle edge maps to the line with the same nodes
+    for tri in mesh.triangles:
+        for i, line in enumerate(tri.lines):
+            assert set(line.nodes) == {tri.nodes[i], tri.nodes[(i + 1) % 3]}
+            assert tri.id in line.triangle_ids
+    # unique lines: interior lines are shared by two triangles, and the mesh is a disk (V - E + F = 1)
+    assert len(np.unique(lines.nodes_conn_table, axis=0)) == lines.N
+    assert np.array_equal(lines.boundary, (lines.triangles_table >= 0).sum(axis=1) == 1)
+    assert mesh.nodes.N - lines.N + mesh.triangles.N == 1
+    boundary_nodes = np.unique(lines.nodes_conn_table[lines.boundary])
+    assert np.isin(mesh.boundaries['left_edge'], boundary_nodes).all()
+
+def test_cv_geometry_arrays(mesh: liz.Mesh):
+    liz.MaterialManager.add_material('domain', liz.PorousMaterial(1E-10, 1E-10, 1E-10, 0.5, 2.0))
+    mesh.preprocess()
+    CVs = mesh.CVs
+    for cv in CVs:
+        # reference: per-CV construction from the entity objects
+        reference = ent.CV(id=cv.id, node=cv.node, state=CVs.__class__([]))
+        reference.state.allocate(CVs.N)
+        reference.support_triangles = cv.node.triangles
+        reference.calculate_area_and_volume()
+        reference.GetCVLines()
+        reference.CheckFluxNormalOrientations()
+        assert np.isclose(cv.vol, reference.vol, rtol=1e-12) and np.isclose(cv.A, reference.A, rtol=1e-12)
+        for lines, reference_lines in zip(cv.cv_lines, reference.cv_lines):
+            for line, reference_line in zip(lines, reference_lines):
+                assert np.allclose(line.p1, reference_line.p1) and np.allclose(line.p2, reference_line.p2)
+                assert np.isclose(line.l, reference_line.l) and np.allclose(line.n, reference_line.n)
+    assert np.isclose(CVs.A.sum(), mesh.triangles.A.sum())
+
+def test_cv_mesh(mesh: liz.Mesh):
+    assert "cv_mesh" not in vars(mesh)
+    points, conn = mesh.cv_mesh
+    assert len(conn) == 3 * mesh.triangles.N
+    segments = {tuple(np.round(points[c].ravel(), 12)) for c in conn}
+    # every CV line is one of the segments, in one direction or the other
+    liz.MaterialManager.add_material('domain', liz.PorousMaterial(1E-10, 1E-10, 1E-10, 0.5, 1.0))
+    mesh.preprocess()
+    for cv in mesh.CVs:
+        for lines in cv.cv_lines:
+            for line in lines:
+                p1, p2 = np.round(line.p1, 12), np.round(line.p2, 12)
+                assert tuple(np.concatenate((p1, p2))) in segments or tuple(np.concatenate((p2, p1))) in segments
+
+def test_material_assignment(mesh: liz.Mesh):
+    material = liz.PorousMaterial(1E-10, 3E-11, 1E-11, 0.4, 2.0)
+    rosette = liz.Rosette((1, 2, 0))
+    liz.MaterialManager.add_material('domain', material, rosette)
+    tri = mesh.triangles[7]  # created before the assignment
+    mesh.preprocess()
+    for tri in mesh.triangles:
+        R = np.array(rosette.project_along_normal(tri.n)).T
+        assert np.allclose(tri.k, R @ material.k_diag @ R.T, rtol=1e-12, atol=1e-24)
+        assert tri.porosity == 0.4 and tri.h == 2.0
+    assert mesh.triangles[7].k is not None and np.shares_memory(mesh.triangles[7].k, mesh.triangles.k)
+
+def test_unassigned_material_tag(mesh: liz.Mesh):
+    liz.MaterialManager.materials.pop('domain', None)
+    with pytest.raises(KeyError, match="unassigned material tag: domain"):
+        mesh.preprocess()
@@ -0,0 +1,133 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import torch
+import scipy.sparse as sp
+import pytest
+from lizzy.solver.builtin.iter_solvers import AMGPreconditioner
+from lizzy.solver import PressureSolver, IterativePressureSolver, IncrementalPressureSolver, CachedPressureSolver, SolverType
+
+@pytest.fixture()
+def solver(build_solver):
+    solver = build_solver()
+    mesh = solver.mesh
+    # partially filled state: a band of nodes next to the inlet
+    mesh.CVs.fill[mesh.nodes.XYZ[:, 0] < 0.3] = 1
+    solver.update_empty_nodes_idx(solver.device)
+    return solver
+
+def test_apply_bcs_symmetric_elimination(solver):
+    k, f = PressureSolver.apply_bcs(solver.K_sing, solver.f_orig, solver.bcs)
+    assert k.layout == torch.sparse_csr
+    # the constrained system shares the sparsity pattern of the singular matrix
+    assert torch.equal(k.col_indices(), solver.K_sing.col_indices())
+    k_dense = k.to_dense()
+    assert torch.allclose(k_dense, k_dense.T, rtol=1e-12, atol=0)
+    assert torch.all(torch.linalg.eigvalsh(k_dense) > 0)
+
+def test_constrained_solution(solver):
+    k, f = PressureSolver.apply_bcs(solver.K_sing, solver.f_orig, solver.bcs)
+    p_sparse = PressureSolver.solve(k, f, SolverType.DIRECT_SPARSE)
+    p_dense = PressureSolver.solve(k, f, SolverType.DIRECT_DENSE)
+    assert torch.allclose(p_sparse, p_dense, rtol=1e-10)
+    assert torch.allclose(p_sparse[solver.bcs.dirichlet_idx], solver.bcs.dirichlet_vals.double())
+    assert torch.all(p_sparse[solver.bcs.p0_idx] == 0)
+    # equilibrium in the free nodes of the original system
+    free = np.setdiff1d(np.arange(solver.N_nodes), np.concatenate((solver.bcs.dirichlet_idx.numpy(), solver.bcs.p0_idx.numpy())))
+    residual = torch.mv(solver.K_sing, p_sparse)[free]
+    assert torch.max(torch.abs(residual)) < 1e-12 * torch.max(torch.abs(torch.mv(solver.K_sing, p_sparse)))
+
+def test_reduced_solution(solver):
+    k, f = PressureSolver.apply_bcs(solver.K_sing, solver.f_orig, solver.bcs)
+    p_full = PressureSolver.solve(k, f, SolverType.DIRECT_SPARSE)
+    k_free, f_free, free_idx, _ = PressureSolver.reduce_system(solver.K_sing, solver.f_orig, solver.bcs)
+    assert k_free.shape[0] == len(free_idx) < solver.N_nodes
+    p_reduced = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+    assert torch.allclose(p_reduced, p_full, rtol=1e-10)
+
+@pytest.mark.parametrize("method", [SolverType.ITERATIVE_PCG_JACOBI, SolverType.ITERATIVE_PCG_ICHOL, SolverType.ITERATIVE_PCG_AMG])
+def test_iterative_solution(solver, method):
+    p_direct = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+    iterative_solver = IterativePressureSolver(method)
+    p_cold = iterative_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+    assert torch.allclose(p_cold, p_direct, rtol=1e-6)
+    # warm start from the solution converges immediately
+    p_warm = iterative_solver.solve(solver.K_sing, solver.f_orig, solver.bcs, p_direct)
+    assert torch.allclose(p_warm, p_direct, rtol=1e-6)
+    assert iterative_solver.stats["solves"] == 2
+    assert iterative_solver.stats["iterations"] == iterative_solver.stats["max_iterations"] > 0
+
+@pytest.mark.parametrize("method", [SolverType.ITERATIVE_PCG_ICHOL, SolverType.ITERATIVE_PCG_AMG])
+def test_iterative_outdated_preconditioner(solver, method):
+    iterative_solver = IterativePressureSolver(method)
+    xyz = solver.mesh.nodes.XYZ
+    for x_front in (0.3, 0.5, 0.7):
+        solver.mesh.CVs.fill[xyz[:, 0] < x_front] = 1
+        solver.update_empty_nodes_idx(solver.device)
+        p_direct = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+        p_iterative = iterative_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+        assert torch.allclose(p_iterative, p_direct, rtol=1e-6)
+    # the preconditioner of the first fill state is reused for the nodes freed since
+    assert iterative_solver.stats["setups"] == 1
+    assert iterative_solver.n_setup < len(PressureSolver.reduce_system(solver.K_sing, solver.f_orig, solver.bcs)[2])
+
+def test_amg_aggregation():
+    n = 40
+    T = sp.diags([-1.0, 2.0, -1.0], [-1, 0, 1], shape=(n, n))
+    A = (sp.kron(T, sp.eye(n)) + sp.kron(sp.eye(n), T)).tocsr()
+    aggregates = AMGPreconditioner()._aggregate(A)
+    # every node is aggregated, in aggregates of the size of a node neighbourhood
+    assert np.all(aggregates >= 0)
+    sizes = np.bincount(aggregates)
+    assert np.all(sizes >= 2) and np.all(sizes <= 25)
+
+def test_incremental_solution(solver):
+    incremental_solver = IncrementalPressureSolver()
+    xyz = solver.mesh.nodes.XYZ
+    for x_front in (0.3, 0.4, 0.5, 0.7):
+        solver.mesh.CVs.fill[xyz[:, 0] < x_front] = 1
+        solver.update_empty_nodes_idx(solver.device)
+        p_direct = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+        p_incremental = incremental_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+        assert torch.allclose(p_incremental, p_direct, rtol=1e-10)
+    # one factorisation, then node updates only
+    assert incremental_solver.stats["factorisations"] == 1
+    assert incremental_solver.stats["updates"] > 0
+
+def test_incremental_updated_node_constrained(solver):
+    incremental_solver = IncrementalPressureSolver()
+    xyz = solver.mesh.nodes.XYZ
+    incremental_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+    solver.mesh.CVs.fill[xyz[:, 0] < 0.5] = 1
+    solver.update_empty_nodes_idx(solver.device)
+    incremental_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+    updated = incremental_solver.update_idx[:3]
+    assert len(updated) > 0
+    # updated nodes become Dirichlet nodes
+    solver.bcs.dirichlet_idx = torch.cat((solver.bcs.dirichlet_idx, torch.from_numpy(updated)))
+    solver.bcs.dirichlet_vals = torch.cat((solver.bcs.dirichlet_vals, torch.full((len(updated),), 5E+04, dtype=torch.double)))
+    p_direct = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+    p_incremental = incremental_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+    assert torch.allclose(p_incremental[updated], torch.tensor(5E+04, dtype=torch.double))
+    assert torch.allclose(p_incremental, p_direct, rtol=1e-10)
+    assert incremental_solver.stats["factorisations"] == 2
+
+def test_cached_solution(solver):
+    cached_solver = CachedPressureSolver()
+    perm = None
+    xyz = solver.mesh.nodes.XYZ
+    for x_front in (0.3, 0.6):
+        solver.mesh.CVs.fill[xyz[:, 0] < x_front] = 1
+        solver.update_empty_nodes_idx(solver.device)
+        p_direct = PressureSolver.solve_reduced(solver.K_sing, solver.f_orig, solver.bcs)
+        p_cached = cached_solver.solve(solver.K_sing, solver.f_orig, solver.bcs)
+        assert torch.allclose(p_cached, p_direct, rtol=1e-10)
+        # the ordering is computed only once
+        assert perm is None or cached_solver.lu.perm is perm
+        perm = cached_solver.lu.perm
+    assert cached_solver.lu.stats["factorisations"] == 2
@@ -0,0 +1,51 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import meshio
+import pytest
+from lizzy.IO.IO import Format
+
+@pytest.fixture(autouse=True)
+def no_cache():
+    enabled = liz.MeshCache.enabled
+    liz.MeshCache.assign(enabled=False)
+    yield
+    liz.MeshCache.assign(enabled=enabled)
+
+def assert_same_mesh_data(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        if isinstance(a[key], dict):
+            assert a[key].keys() == b[key].keys()
+            for name in a[key]:
+                assert np.array_equal(a[key][name], b[key][name])
+        else:
+            assert np.array_equal(a[key], b[key])
+
+def test_native_reader():
+    mesh_reader = liz.Reader("tests/test_meshes/Rect_1M_64elem.msh")
+    assert mesh_reader.detect_format() == Format.MSH
+    assert_same_mesh_data(mesh_reader.mesh_data, mesh_reader.read_gmsh_file_meshio())
+    assert mesh_reader.mesh_data['physical_domains'].keys() == {'domain'}
+    assert mesh_reader.mesh_data['physical_nodes'].keys() == {'left_edge', 'right_edge'}
+
+def test_native_reader_binary(tmp_path):
+    mesh_file = meshio.read("tests/test_meshes/Rect_1M_64elem.msh")
+    mesh_file.cell_sets = {}
+    meshio.write(tmp_path / "binary.msh", mesh_file, file_format="gmsh", binary=True)
+    mesh_reader = liz.Reader(tmp_path / "binary.msh")
+    assert_same_mesh_data(mesh_reader.mesh_data, liz.Reader("tests/test_meshes/Rect_1M_64elem.msh").mesh_data)
+
+def test_legacy_format(tmp_path):
+    mesh_file = meshio.read("tests/test_meshes/Rect_1M_64elem.msh")
+    meshio.write(tmp_path / "legacy.msh", mesh_file, file_format="gmsh22", binary=False)
+    mesh_reader = liz.Reader(tmp_path / "legacy.msh")
+    assert mesh_reader.detect_format() == Format.MSH_LEGACY
+    assert len(mesh_reader.mesh_data['nodes_conn']) == 64
+    with pytest.raises(FileNotFoundError):
+        liz.Reader(tmp_path / "missing.msh")
@@ -0,0 +1,74 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import lizzy as liz
+import numpy as np
+import pytest
+
+def test_write_out_steps_only(solver):
+    solution = solver.solve(log="off")
+    manager = solver.time_step_manager
+    assert manager.n_write_out == solution["time_steps"] < manager.time_step_count
+    assert isinstance(solution["p"], np.ndarray) and solution["p"].shape == (solution["time_steps"], solver.N_nodes)
+    assert solution["v"].shape == (solution["time_steps"], solver.mesh.triangles.N, 3)
+    # write-out times, then the end of the filling
+    assert np.allclose(solution["time"][:-1], 100 * np.arange(solution["time_steps"] - 1))
+    assert np.all(solution["fill_factor"][-1] == 1)
+
+def test_spill_float32(solver, tmp_path):
+    solution = solver.solve(log="off")
+    try:
+        liz.SolverParameters.assign(results_dtype="float32", results_spill_directory=tmp_path)
+        solver.time_step_manager = liz.TimeStepManager(solver.N_nodes, solver.mesh.triangles.N)
+        solver.initialise_new_solution(solver.device)
+        solution_spilled = solver.solve(log="off")
+    finally:
+        liz.SolverParameters.assign(results_dtype="float64", results_spill_directory=None)
+    assert isinstance(solver.time_step_manager.arrays["p"], np.memmap)
+    assert not isinstance(solution_spilled["p"], np.memmap) and solution_spilled["p"].dtype == np.float32
+    # the arrays of one capacity are on disk
+    assert len(list(tmp_path.glob("lizzy-steps-*/p_*.npy"))) == 1
+    assert np.array_equal(solution_spilled["time"], solution["time"])
+    assert np.allclose(solution_spilled["p"], solution["p"], rtol=1e-6)
+    assert np.array_equal(solution_spilled["free_surface"], solution["free_surface"])
+
+def test_delta_series():
+    rng = np.random.default_rng(0)
+    snapshots = np.zeros((23, 50))
+    for k in range(1, len(snapshots)):
+        snapshots[k] = snapshots[k - 1]
+        snapshots[k, rng.integers(0, 50, 3)] = rng.random(3)
+    series = liz.solver.DeltaSeries(50, float, keyframe_interval=4)
+    for snapshot in snapshots:
+        series.append(snapshot)
+    assert len(series) == 23 and series.shape == (23, 50)
+    # random access, sequential access and negative indices
+    for k in rng.permutation(23):
+        assert np.array_equal(series[k], snapshots[k])
+    assert np.array_equal(np.asarray(series), snapshots)
+    assert np.array_equal(series[-2], snapshots[-2])
+    assert np.array_equal(series[5:12:3], snapshots[5:12:3])
+    assert series.nbytes < snapshots.nbytes / 2
+
+def test_write_all_steps_deltas(solver):
+    liz.ProcessParameters.assign(wo_delta_time=-1)
+    solution = solver.solve(log="off")
+    fill_factor = solution["fill_factor"]
+    assert solution["time_steps"] == solver.time_step_manager.time_step_count
+    # the filled region only grows
+    assert np.all(np.diff(np.sum(np.asarray(fill_factor) == 1, axis=1)) >= 0)
+    assert fill_factor.nbytes < fill_factor.shape[0] * fill_factor.shape[1] * fill_factor.dtype.itemsize / 4
+
+def test_solution_owns_arrays(solver):
+    partial = solver.solve(log="off", end_time=1000)
+    n = partial["time_steps"]
+    fill_factor = partial["fill_factor"][-1]
+    # continuing the solution does not modify the solution already returned
+    solution = solver.solve(log="off")
+    assert solution["time_steps"] > n
+    assert len(partial["fill_factor"]) == len(partial["p"]) == n
+    assert np.array_equal(partial["fill_factor"][-1], fill_factor)
+    assert not np.shares_memory(partial["p"], solver.time_step_manager.arrays["p"])
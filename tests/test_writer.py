@@ -0,0 +1,86 @@
+#  Copyright 2025-2025 Simone Bancora, Paris Mulye
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#  You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import xml.etree.ElementTree as ET
+import lizzy as liz
+import numpy as np
+import h5py
+import meshio
+import pytest
+
+def test_stream_writer(solver, tmp_path):
+    writer = liz.StreamWriter(solver.mesh, "stream", tmp_path)
+    solver.attach_writer(writer)
+    solution = solver.solve(log="off")
+    assert not writer.is_open
+    with h5py.File(writer.h5_path, "r") as f:
+        assert np.array_equal(f["mesh/points"][()], solver.mesh.nodes.XYZ)
+        assert np.array_equal(f["time"][()], solution["time"])
+        assert np.allclose(f["Pressure"][()], np.array(solution["p"]))
+        assert np.array_equal(f["FillFactor"][()], np.array(solution["fill_factor"]))
+        assert np.array_equal(f["FreeSurface"][()], np.array(solution["free_surface"]))
+        assert np.allclose(f["Velocity"][()], np.array(solution["v"]))
+        assert f["Pressure"].chunks == (1, solver.mesh.nodes.N)
+    grids = ET.parse(writer.xdmf_path).getroot().findall("./Domain/Grid/Grid")
+    assert len(grids) == solution["time_steps"]
+    assert float(grids[-1].find("Time").get("Value")) == solution["time"][-1]
+
+def test_stream_writer_xdmf_interval(solver, tmp_path):
+    writer = liz.StreamWriter(solver.mesh, "stream", tmp_path, xdmf_interval=3600)
+    writer.open()
+    N, M = solver.mesh.nodes.N, solver.mesh.triangles.N
+    for k in range(3):
+        writer.write_step(k, np.zeros(N), np.ones(N), np.zeros(N), np.zeros((M, 2)))
+    writer.write_field("ArrivalTime", np.zeros(N))
+    assert not writer.xdmf_path.exists()
+    writer.close()
+    grids = ET.parse(writer.xdmf_path).getroot().findall("./Domain/Grid/Grid")
+    assert [float(grid.find("Time").get("Value")) for grid in grids] == [0, 1, 2]
+    assert grids[-1].find("Attribute[@Name='ArrivalTime']") is not None
+
+def test_save_results_xdmf(solver, tmp_path, monkeypatch):
+    solution = solver.solve(log="off")
+    monkeypatch.chdir(tmp_path)
+    liz.Writer(solver.mesh).save_results(solution, "saved")
+    assert sorted(p.name for p in (tmp_path / "results" / "saved").iterdir()) == ["saved_RES.h5", "saved_RES.xdmf"]
+    with h5py.File(tmp_path / "results" / "saved" / "saved_RES.h5", "r") as f:
+        assert np.array_equal(f["time"][()], solution["time"])
+
+@pytest.mark.parametrize("file_format, workers", [("vtu", 2), ("vtk", 1)])
+def test_save_results_vtk(solver, tmp_path, monkeypatch, file_format, workers):
+    solution = solver.solve(log="off")
+    monkeypatch.chdir(tmp_path)
+    liz.Writer(solver.mesh).save_results(solution, "saved", format=file_format, workers=workers)
+    destination_path = tmp_path / "results" / "saved"
+    for i in range(solution["time_steps"]):
+        mesh = meshio.read(destination_path / f"saved_RES_{i}.{file_format}")
+        assert np.array_equal(mesh.cells_dict["triangle"], solver.mesh.triangles.nodes_conn_table)
+        assert np.allclose(mesh.point_data["Pressure"], solution["p"][i])
+        assert np.array_equal(mesh.point_data["FillFactor"], solution["fill_factor"][i])
+        assert np.allclose(mesh.cell_data["Velocity"][0], solution["v"][i])
+    if file_format == "vtu":
+        datasets = ET.parse(destination_path / "saved_RES.pvd").getroot().findall("./Collection/DataSet")
+        assert [d.get("file") for d in datasets] == [f"saved_RES_{i}.vtu" for i in range(solution["time_steps"])]
+        assert np.array_equal([float(d.get("timestep")) for d in datasets], solution["time"])
+
+def test_results_reader(solver, tmp_path):
+    writer = liz.StreamWriter(solver.mesh, "stream", tmp_path)
+    solver.attach_writer(writer)
+    solution = solver.solve(log="off")
+    with liz.ResultsReader(tmp_path / "stream") as results:
+        assert len(results) == solution["time_steps"]
+        assert np.array_equal(results.points, solver.mesh.nodes.XYZ)
+        step = results[-1]
+        assert isinstance(step["p"], np.memmap)
+        assert np.allclose(step["p"], solution["p"][-1])
+        assert np.array_equal(step["fill_factor"], solution["fill_factor"][-1])
+        assert np.allclose(step["v"], solution["v"][-1])
+        # time window and node subset
+        nodes = solver.mesh.boundaries["left_edge"]
+        steps = results.steps(150, 450)
+        assert np.array_equal(results.time[steps], [200, 300, 400])
+        assert np.allclose(results.field("p", 150, 450, nodes=nodes), np.asarray(solution["p"])[steps][:, nodes])
+        assert np.array_equal(results.field("arrival_time"), solution["arrival_time"])